@@ -48,6 +48,8 @@ import typing
 
 sys.path.append("../")
 from Shared.DataService import DataService
+from Shared.harvestCalendar import HarvestCalendar
+from Shared.queryProfiler import PROFILER
 
 
 # Tables being used (see links in Required tables above)
@@ -83,6 +85,9 @@ TABLECROSSSTATIONWEEKLYD = "dataset_cross_weekly_station_JASO"
 TABLECROSSSATMONTHLY = "dataset_cross_monthly_sat"
 TABLECROSSSTATIONMONTHLY = "dataset_cross_monthly_station"
 
+# The types the key columns are loaded as, the attributes keep their precision since they are stored in the datasets as is
+KEY_DTYPES = {"year": "int16", "month": "int16", "day": "int16", "district": "int16"}
+
 
 # Load the database connection environment variables located in the docker folder
 try:
@@ -99,15 +104,19 @@ PG_PW = os.getenv("POSTGRES_PW")
 
 
 def main():
-    generateNoErgotTables()
-    generateCrossWeeklyTables()
-    generateCrossMonthlyTables()
+    # tags the queries of each step so they can be told apart when profiling (see QUERY_PROFILE in queryProfiler)
+    with PROFILER.stage("generateNoErgotTables"):
+        generateNoErgotTables()
+    with PROFILER.stage("generateCrossWeeklyTables"):
+        generateCrossWeeklyTables()
+    with PROFILER.stage("generateCrossMonthlyTables"):
+        generateCrossMonthlyTables()
 
 
-def getConn():
+def getDB() -> DataService:
     """
     Purpose:
-    Get a connection to the database
+    Get a handle on the database
     """
     if (
         PG_DB is None
@@ -118,9 +127,35 @@ def getConn():
     ):
         raise Exception("Missing required env var(s)")
 
-    db = DataService(PG_DB, PG_ADDR, int(PG_PORT), PG_USER, PG_PW)
+    return DataService(PG_DB, PG_ADDR, int(PG_PORT), PG_USER, PG_PW)
+
+
+def getConn():
+    """
+    Purpose:
+    Get a connection to the database
+    """
+    return getDB().connect()
+
+
+def pullTable(query: sq.sql.elements.TextClause) -> pd.DataFrame:
+    """
+    Purpose:
+    Loads the results of a query into a DataFrame with narrow key types
+
+    Remarks: the whole result is held in memory (it is stored in the datasets as is), streaming only avoids holding it twice as raw rows and a DataFrame
+
+    Psuedocode:
+    - Get a handle on the database
+    - Stream the results from the database in chunks with the key columns typed as per KEY_DTYPES
+    - [Combine the chunks into a single DataFrame](https://pandas.pydata.org/docs/reference/api/pandas.concat.html)
+    - Close the database connection
+    """
+    db = getDB()
+    df = pd.concat(db.stream(query, dtypes=KEY_DTYPES), ignore_index=True)
+    db.cleanup()
 
-    return db.connect()
+    return df
 
 
 def pullWeatherStationData() -> pd.DataFrame:
@@ -132,20 +167,16 @@ def pullWeatherStationData() -> pd.DataFrame:
     - [agg_weather_combined](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#agg_weather_combined)
 
     Psuedocode:
-    - Get a connection to the database
     - Create the weather station data SQL query
-    - [Load the data from the database directly into a DataFrame](https://pandas.pydata.org/docs/reference/api/pandas.read_sql.html)
-    - Close the database connection
+    - Load the data from the database (see pullTable)
     """
-    conn = getConn()
     weatherDataQuery = sq.text(
         f"""
         SELECT * FROM public.{COMBINED_WEATHER_TABLE}
         """
     )
 
-    df = pd.read_sql(weatherDataQuery, conn)
-    conn.close()
+    df = pullTable(weatherDataQuery)
 
     return df
 
@@ -159,20 +190,16 @@ def pullWeatherCopernicusData() -> pd.DataFrame:
     - [agg_day_copernicus_satellite_data](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#agg_day_copernicus_satellite_data)
 
     # Psuedocode:
-    - Get a connection to the database
     - Create the Copernicus weather data SQL query
-    - [Load the data from the database directly into a DataFrame](https://pandas.pydata.org/docs/reference/api/pandas.read_sql.html)
-    - Close the database connection
+    - Load the data from the database (see pullTable)
     """
-    conn = getConn()
     weatherDataQuery = sq.text(
         f"""
         SELECT * FROM public.{COPERNICUS_WEATHER_TABLE}
         """
     )
 
-    df = pd.read_sql(weatherDataQuery, conn)
-    conn.close()
+    df = pullTable(weatherDataQuery)
 
     return df
 
@@ -186,12 +213,9 @@ def pullSoilMoistureData() -> pd.DataFrame:
     - [agg_soil_moisture](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#agg_soil_moisture)
 
     Psuedocode:
-    - Get a connection to the database
     - Create the soil moisture data SQL query
-    - [Load the data from the database directly into a DataFrame](https://pandas.pydata.org/docs/reference/api/pandas.read_sql.html)
-    - Close the database connection
+    - Load the data from the database (see pullTable)
     """
-    conn = getConn()
     weatherDataQuery = sq.text(
         f"""
         SELECT year, month, day, district, 
@@ -200,8 +224,7 @@ def pullSoilMoistureData() -> pd.DataFrame:
         """
     )
 
-    df = pd.read_sql(weatherDataQuery, conn)
-    conn.close()
+    df = pullTable(weatherDataQuery)
 
     return df
 
@@ -215,12 +238,9 @@ def pullAggErgotData() -> pd.DataFrame:
     - [agg_ergot_sample_v2](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#agg_ergot_sample_v2)
 
     Psuedocode:
-    - Get a connection to the database
     - Create the ergot data SQL query
-    - [Load the data from the database directly into a DataFrame](https://pandas.pydata.org/docs/reference/api/pandas.read_sql.html)
-    - Close the database connection
+    - Load the data from the database (see pullTable)
     """
-    conn = getConn()
     weatherDataQuery = sq.text(
         f"""
         SELECT year, district, 
@@ -240,8 +260,7 @@ def pullAggErgotData() -> pd.DataFrame:
         """
     )
 
-    df = pd.read_sql(weatherDataQuery, conn)
-    conn.close()
+    df = pullTable(weatherDataQuery)
 
     return df
 
@@ -255,20 +274,16 @@ def pullIndividualErgotSampleData() -> pd.DataFrame:
     - [ergot_sample_feat_eng](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#ergot_sample_feat_eng)
 
     Psuedocode:
-    - Get a connection to the database
     - Create the ergot data SQL query
-    - [Load the data from the database directly into a DataFrame](https://pandas.pydata.org/docs/reference/api/pandas.read_sql.html)
-    - Close the database connection
+    - Load the data from the database (see pullTable)
     """
-    conn = getConn()
     weatherDataQuery = sq.text(
         f"""
         SELECT * FROM public.{ERGOT_SAMPLES_TABLE}
         """
     )
 
-    df = pd.read_sql(weatherDataQuery, conn)
-    conn.close()
+    df = pullTable(weatherDataQuery)
 
     return df
 
@@ -371,15 +386,12 @@ def getWeeklySat(dailyDf: pd.DataFrame) -> pd.DataFrame:
     Aggregate the Copernicus weather data by week
 
     Pseudocode:
-    - Add the week to the data
+    - Add the week to the data ([harvestCalendar](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions/blob/main/src/Shared/harvestCalendar.py))
     - [Aggregate](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.agg.html) the data
       [by year, month, week of year and district](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.groupby.html)
     """
-    dailyDf["date"] = pd.to_datetime(dailyDf[["year", "month", "day"]])
-
-    # add a week of year column
-    dailyDf["week_of_year"] = dailyDf["date"].dt.isocalendar().week
-    dailyDf = dailyDf.drop(columns=["date"])
+    # add a week of year column (numbered the same way as the station and moisture aggregators)
+    dailyDf = HarvestCalendar().addCalendarAttrs(dailyDf, {"week": "week_of_year"})
 
     # aggregate by week of year year and district
     weeklyDf = (
@@ -454,15 +466,12 @@ def getWeeklySoilMoisture(dailyDf: pd.DataFrame) -> pd.DataFrame:
     Aggregate the Satellite soil moisture data by week
 
     Pseudocode:
-    - Add the week to the data
+    - Add the week to the data ([harvestCalendar](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions/blob/main/src/Shared/harvestCalendar.py))
     - [Aggregate](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.agg.html) the data
       [by year, month, week of year and district](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.groupby.html)
     """
-    dailyDf["date"] = pd.to_datetime(dailyDf[["year", "month", "day"]])
-
-    # add a week of year column
-    dailyDf["week_of_year"] = dailyDf["date"].dt.isocalendar().week
-    dailyDf = dailyDf.drop(columns=["date"])
+    # add a week of year column (numbered the same way as the station and moisture aggregators)
+    dailyDf = HarvestCalendar().addCalendarAttrs(dailyDf, {"week": "week_of_year"})
 
     # aggregate by week of year year and district
     weeklyDf = (
@@ -585,15 +594,12 @@ def getWeeklyStation(dailyDf: pd.DataFrame) -> pd.DataFrame:
     Aggregate the weather station data by week
 
     Pseudocode:
-    - Add the week to the data
+    - Add the week to the data ([harvestCalendar](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions/blob/main/src/Shared/harvestCalendar.py))
     - [Aggregate](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.agg.html) the data
       [by year, month, week of year and district](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.groupby.html)
     """
-    dailyDf["date"] = pd.to_datetime(dailyDf[["year", "month", "day"]])
-
-    # add a week of year column
-    dailyDf["week_of_year"] = dailyDf["date"].dt.isocalendar().week
-    dailyDf = dailyDf.drop(columns=["date"])
+    # add a week of year column (numbered the same way as the station and moisture aggregators)
+    dailyDf = HarvestCalendar().addCalendarAttrs(dailyDf, {"week": "week_of_year"})
 
     # aggregate by week of year year and district
     weeklyDf = (
@@ -707,24 +713,15 @@ def pushChunkwise(df: pd.DataFrame, tablename: str) -> None:
     Stores data in the database in chunks
 
     Pseudocode:
-    - Get a database connection
-    - [Push the data to the database](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.to_sql.html)
+    - Get a handle on the database
+    - Push the data to the database (bulk write, streamed in chunks)
     - Close the connection
 
     Remarks: Some of our large data has too many columns to fit into the database, thus, we store the data in chunks accross multiple tables instead to bypass this restriction
     """
-    conn = getConn()
-
-    df.to_sql(
-        tablename,
-        conn,
-        schema="public",
-        if_exists="append",
-        index=False,
-        chunksize=1000,
-    )
-
-    conn.close()
+    db = getDB()
+    db.bulkWrite(df, tablename)
+    db.cleanup()
 
 
 def generateNoErgotTables():
@@ -798,20 +795,16 @@ def getDatasetDailySat() -> pd.DataFrame:
     - [dataset_daily_sat](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#dataset_daily_sat)
 
     Psuedocode:
-    - Get a connection to the database
     - Create the ergot data SQL query
-    - [Load the data from the database directly into a DataFrame](https://pandas.pydata.org/docs/reference/api/pandas.read_sql.html)
-    - Close the database connection
+    - Load the data from the database (see pullTable)
     """
-    conn = getConn()
     query = sq.text(
         f"""
         SELECT * FROM public.{TABLESATDAILY}
         """
     )
 
-    df = pd.read_sql(query, conn)
-    conn.close()
+    df = pullTable(query)
 
     return df
 
@@ -825,20 +818,16 @@ def getDatasetDailyStation() -> pd.DataFrame:
     - [dataset_daily_station](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#dataset_daily_station)
 
     Psuedocode:
-    - Get a connection to the database
     - Create the ergot data SQL query
-    - [Load the data from the database directly into a DataFrame](https://pandas.pydata.org/docs/reference/api/pandas.read_sql.html)
-    - Close the database connection
+    - Load the data from the database (see pullTable)
     """
-    conn = getConn()
     query = sq.text(
         f"""
         SELECT * FROM public.{TABLESTATIONDAILY}
         """
     )
 
-    df = pd.read_sql(query, conn)
-    conn.close()
+    df = pullTable(query)
 
     return df
 
@@ -852,20 +841,16 @@ def getDatasetWeeklySat() -> pd.DataFrame:
     - [dataset_weekly_sat](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#dataset_weekly_sat)
 
     Psuedocode:
-    - Get a connection to the database
     - Create the ergot data SQL query
-    - [Load the data from the database directly into a DataFrame](https://pandas.pydata.org/docs/reference/api/pandas.read_sql.html)
-    - Close the database connection
+    - Load the data from the database (see pullTable)
     """
-    conn = getConn()
     query = sq.text(
         f"""
         SELECT * FROM public.{TABLESATWEEKLY}
         """
     )
 
-    df = pd.read_sql(query, conn)
-    conn.close()
+    df = pullTable(query)
 
     return df
 
@@ -879,20 +864,16 @@ def getDatasetWeeklyStation() -> pd.DataFrame:
     - [dataset_weekly_station](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#dataset_weekly_station)
 
     Psuedocode:
-    - Get a connection to the database
     - Create the ergot data SQL query
-    - [Load the data from the database directly into a DataFrame](https://pandas.pydata.org/docs/reference/api/pandas.read_sql.html)
-    - Close the database connection
+    - Load the data from the database (see pullTable)
     """
-    conn = getConn()
     query = sq.text(
         f"""
         SELECT * FROM public.{TABLESTATIONWEEKLY}
         """
     )
 
-    df = pd.read_sql(query, conn)
-    conn.close()
+    df = pullTable(query)
 
     return df
 
@@ -906,20 +887,16 @@ def getDatasetMonthlySat() -> pd.DataFrame:
     - [dataset_monthly_sat](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#dataset_monthly_sat)
 
     Psuedocode:
-    - Get a connection to the database
     - Create the ergot data SQL query
-    - [Load the data from the database directly into a DataFrame](https://pandas.pydata.org/docs/reference/api/pandas.read_sql.html)
-    - Close the database connection
+    - Load the data from the database (see pullTable)
     """
-    conn = getConn()
     query = sq.text(
         f"""
         SELECT * FROM public.{TABLESATMONTHLY}
         """
     )
 
-    df = pd.read_sql(query, conn)
-    conn.close()
+    df = pullTable(query)
 
     return df
 
@@ -933,20 +910,16 @@ def getDatasetMonthlyStation() -> pd.DataFrame:
     - [dataset_monthly_station](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#dataset_monthly_station)
 
     Psuedocode:
-    - Get a connection to the database
     - Create the ergot data SQL query
-    - [Load the data from the database directly into a DataFrame](https://pandas.pydata.org/docs/reference/api/pandas.read_sql.html)
-    - Close the database connection
+    - Load the data from the database (see pullTable)
     """
-    conn = getConn()
     query = sq.text(
         f"""
         SELECT * FROM public.{TABLESTATIONMONTHLY}
         """
     )
 
-    df = pd.read_sql(query, conn)
-    conn.close()
+    df = pullTable(query)
 
     return df
 
@@ -64,6 +64,7 @@ except:
 sys.path.append("../")
 from Shared.GenericQueryBuilder import GenericQueryBuilder
 from Shared.DataService import DataService
+from Shared.queryProfiler import PROFILER
 from Ergot.ergotAggregator import ErgotAggregator
 from Soil.soilAggregator import SoilAggregator
 from WeatherStation.hlyAggregator import HlyAggregator
@@ -132,10 +133,14 @@ class SetCreator:
         conn = db.connect()
 
         # checks if the data that is needed has been aggregated, if not, aggregate it
-        self.__verifySoilIsAggregated(db, queryBuilder)
-        self.__verifyErgotIsAggregated(db, queryBuilder)
-        self.__verifyHlyIsAggregated(LOCAL_FILE_DATASETS_LOC)
-        self.__verifyMoistureIsAggregated(LOCAL_FILE_DATASETS_LOC)
+        with PROFILER.stage("verifySoilIsAggregated"):
+            self.__verifySoilIsAggregated(db, queryBuilder)
+        with PROFILER.stage("verifyErgotIsAggregated"):
+            self.__verifyErgotIsAggregated(db, queryBuilder)
+        with PROFILER.stage("verifyHlyIsAggregated"):
+            self.__verifyHlyIsAggregated(LOCAL_FILE_DATASETS_LOC)
+        with PROFILER.stage("verifyMoistureIsAggregated"):
+            self.__verifyMoistureIsAggregated(LOCAL_FILE_DATASETS_LOC)
 
         # pull all data
         hlyByDayDF = pd.read_csv(f"{LOCAL_FILE_DATASETS_LOC}/{HLY_CSV_BY_DAY}")
@@ -152,8 +157,9 @@ class SetCreator:
             f"{LOCAL_FILE_DATASETS_LOC}/{MOISTURE_CSV_BY_MONTH}"
         )
 
-        soilDF = pd.read_sql(SOIL_QUERY, conn)
-        ergotDF = pd.read_sql(ERGOT_QUERY, conn)
+        with PROFILER.stage("pullSoilAndErgot"):
+            soilDF = pd.read_sql(SOIL_QUERY, conn)
+            ergotDF = pd.read_sql(ERGOT_QUERY, conn)
 
         db.cleanup()
 
@@ -307,7 +313,7 @@ class SetCreator:
         hasHlyByMonth = os.path.isfile(f"{path}/{HLY_CSV_BY_MONTH}")
 
         if not hasHlyByDay or not hasHlyByWeek or not hasHlyByMonth:
-            hlyAggregator = HlyAggregator()
+            hlyAggregator = HlyAggregator(aggregateInDB=True)
 
             try:
                 os.chdir(os.path.dirname(os.path.abspath(__file__)))
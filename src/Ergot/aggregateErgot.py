@@ -437,10 +437,7 @@ def createAggErgotV1() -> None:
         if not tableExists:
             createAggErgotTable(db)
 
-        aggErgot.to_sql(
-            TABLENAME, con=conn, schema="public", if_exists="replace", index=False
-        )
-        # conn.commit()
+        db.replaceTable(aggErgot, TABLENAME)
     except Exception as e:
         print([f"[ERROR] {e}"])
 
@@ -476,10 +473,7 @@ def createAggErgotV2() -> None:
         if not tableExists:
             createAggErgotTableV2(db)
 
-        aggErgot.to_sql(
-            TABLENAMEV2, con=conn, schema="public", if_exists="replace", index=False
-        )
-        # conn.commit()
+        db.replaceTable(aggErgot, TABLENAMEV2)
     except Exception as e:
         print([f"[ERROR] {e}"])
 
@@ -63,10 +63,7 @@ class ErgotAggregator:
             if not tableExists:
                 self.createAggErgotTable(db)
 
-            aggErgot.to_sql(
-                TABLENAME, con=conn, schema="public", if_exists="replace", index=False
-            )
-            conn.commit()
+            db.replaceTable(aggErgot, TABLENAME)
         except Exception as e:
             print([f"[ERROR] {e}"])
 
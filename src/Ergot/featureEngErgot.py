@@ -130,11 +130,9 @@ def main():
         tableExists = queryBuilder.readTableExists(db.execute(request))
 
         if not tableExists:
-            createErgotFeatEngTableV1(db)
+            createErgotFeatEngTableV1(db, TABLENAME)
 
-        ergotDf.to_sql(
-            TABLENAME, conn, schema="public", if_exists="replace", index=False
-        )
+        db.replaceTable(ergotDf, TABLENAME)
     except Exception as e:
         print("An error occurred while writing to the database {}".format(e))
         raise e
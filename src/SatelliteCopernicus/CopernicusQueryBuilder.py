@@ -9,6 +9,7 @@ import sys
 sys.path.append("../")
 from Shared.GenericQueryBuilder import GenericQueryBuilder
 from Shared.DataService import DataService
+from Shared.schemaManager import SchemaManager
 
 
 # Table name that stores the copernicus satellite data
@@ -27,6 +28,7 @@ class CopernicusQueryBuilder(GenericQueryBuilder):
         Pseudocode:
         - Check if the table already exists
         - If it does not exist, create it
+        - Create its indexes (if they do not already exist)
 
         Remarks: Creating the table manually ensures the tables persist (usually due to the inability to locate a unique key)
         """
@@ -108,3 +110,22 @@ class CopernicusQueryBuilder(GenericQueryBuilder):
             )
 
             db.execute(query)
+
+        SchemaManager().createIndexes(db, AGG_COPERNICUS_TABLE)
+
+    def deleteDayReq(self, date: str) -> str:
+        """
+        Purpose:
+        Removes the data of a day (i.e 2022-07-01) so that it can be stored again without duplicates
+
+        Table:
+        - [agg_day_copernicus_satellite_data](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#agg_day_copernicus_satellite_data)
+
+        Remarks: not committed, so it can run in the transaction storing the new data (see the preQueries of DataService.bulkWrite)
+        """
+        year, month, day = [int(part) for part in date.split("-")]
+
+        return f"""
+        DELETE FROM {AGG_COPERNICUS_TABLE}
+        WHERE year = {year} AND month = {month} AND day = {day};
+        """
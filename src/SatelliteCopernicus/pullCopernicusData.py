@@ -11,19 +11,23 @@
 # Remarks:
 # - null values - na.mask, null etc... can sometimes cause issues
 # - Copernicus needs an API key which if access has been/still is granted can be setup with the [following steps](https://cds.climate.copernicus.eu/api-how-to)
+# - Missing days are requested in batches of up to MAX_FIELDS fields (one or more months at a time, see planRequests)
+#   and each batch is processed day by day
+# - With a raw archive (RAW_ARCHIVE_DIR), the downloaded NetCDF zips are archived, in replay mode (RAW_ARCHIVE_MODE=replay)
+#   they are read from the archive instead (no API key is needed, every archived request of the current area is processed
+#   again and its days replace the ones already in the table)
 # -------------------------------------------
 from CopernicusQueryBuilder import CopernicusQueryBuilder
 from dotenv import load_dotenv
 import multiprocessing as mp
 from datetime import datetime
-from pandas import Index
 import geopandas as gpd  # type: ignore
 import sqlalchemy as sq
 import xarray as xr  # type: ignore
 import pandas as pd
 import numpy as np
 import cdsapi  # type: ignore
-import os, sys, time, random, zipfile, calendar
+import os, sys, calendar, contextlib, typing
 
 try:
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
@@ -32,6 +36,12 @@ except:
 
 sys.path.append("../")
 from Shared.DataService import DataService
+from Shared.schemaManager import SchemaManager
+from Shared.rateLimiter import RateLimiter, shareLimiter, getSharedLimiter
+from Shared.rawArchive import RawArchive, openArchive, requestName
+from Shared.regionLookup import loadRegionLookup, regionsKey
+from Shared.cdsPipeline import CDSPipeline
+from Shared.zipReader import openMember
 
 
 TABLE = "agg_day_copernicus_satellite_data"  # Table name that stores the copernicus satellite data
@@ -39,6 +49,9 @@ AG_REGIONS_TABLE = "census_ag_regions"  # Table name that stores the agriculture
 
 LOG_FILE = "data/scrape_copernicus_parallel_20230703.log"  # The file used to store progress information
 ERROR_FILE = "data/scrape_copernicus_parallel_20230703.err"  # The file used to store error information
+REGION_LOOKUP_DIR = (
+    "data/region_lookup"  # The folder caching the region of each grid cell
+)
 
 
 # Load the database connection environment variables located in the docker folder
@@ -55,10 +68,16 @@ PG_USER = os.getenv("POSTGRES_USER")
 PG_PW = os.getenv("POSTGRES_PW")
 
 
-NUM_WORKERS = 1  # The number of workers we want to employ (maximum is 16 as per the number of cores)
-REQ_DELAY = 60  # 1 minute - the base delay required to bypass pulling limits
-MIN_DELAY = 20  # 1 minute - once added to the required delay, creates a minimum delay of 5 minutes to bypass pulling limits
-MAX_DELAY = 180  # 3 minutes - once added to the required delay, creates a maximum delay of 5 minutes to bypass pulling limits
+DATASET = "reanalysis-era5-land"  # The Copernicus dataset we pull data from
+ARCHIVE_SOURCE = "era5-land"  # The source the downloads are archived under
+
+NUM_WORKERS = 4  # The number of workers processing the downloads (maximum is 16 as per the number of cores)
+REQUEST_RATE = 0.2  # The number of data requests (submissions and polls) per second (one every 5 seconds)
+MAX_QUEUED = 4  # The number of requests queued on the CDS at once (the account's concurrency quota)
+POLL_INTERVAL = 30  # The number of seconds between polls of the queued requests
+
+# The most fields (variables x hours x days) the CDS accepts in a single ERA5-Land request
+MAX_FIELDS = int(os.getenv("COPERNICUS_MAX_FIELDS") or 12000)
 
 MIN_MONTH = 1  # The month we start pulling data from
 MAX_MONTH = 12  # The month we stop pulling data from
@@ -93,6 +112,30 @@ ATTRS = [  # the attributes we want to pull data for
     "leaf_area_index_low_vegetation",
 ]
 
+# The NetCDF names of the attributes (in the order of ATTRS) and the names they are stored under
+VARIABLES = {
+    "d2m": "dewpoint_temperature",
+    "t2m": "temperature",
+    "evabs": "evaporation_from_bare_soil",
+    "src": "skin_reservoir_content",
+    "skt": "skin_temperature",
+    "smlt": "snowmelt",
+    "stl1": "soil_temperature_level_1",
+    "stl2": "soil_temperature_level_2",
+    "stl3": "soil_temperature_level_3",
+    "stl4": "soil_temperature_level_4",
+    "ssr": "surface_net_solar_radiation",
+    "sp": "surface_pressure",
+    "swvl1": "volumetric_soil_water_layer_1",
+    "swvl2": "volumetric_soil_water_layer_2",
+    "swvl3": "volumetric_soil_water_layer_3",
+    "swvl4": "volumetric_soil_water_layer_4",
+    "lai_hv": "leaf_area_index_high_vegetation",
+    "lai_lv": "leaf_area_index_low_vegetation",
+}
+
+AGGREGATES = ["min", "max", "mean"]  # The daily aggregates stored for each attribute
+
 HOURS = [  # the hours we want to pull data for
     "00:00",
     "01:00",
@@ -150,43 +193,164 @@ def main():
     # Load the agriculture region geometries from the database
     agRegions = loadGeometry(conn)
 
-    completedDf = getCompleteDates(conn)
+    # In replay mode, the archived requests are processed again (whether or not their days are in the table)
+    archive = openArchive()
+    replay = archive is not None and archive.replay
+    if replay:
+        requests = planReplay(archive)  # type: ignore
+    else:
+        requests = planRequests(getCompleteDates(conn))
     db.cleanup()  # Disconnect from the database (workers maintain their own connections)
 
-    # Creates the list of arguments (stored as tuples) used in the multiple processes for pullSateliteData(agRegions, year, month, days, outputFile)
+    # Creates the list of arguments (stored as tuples) used in the multiple processes for pullSateliteData(agRegions, year, months, days, outputFile)
+    # a job per request, each covering the missing (or archived) days of one or more months
+    for year, months, days in requests:
+        outputFile = f"data/copernicus_{year}_{months[0]}_{days[0]}"
+        jobArgs.append(tuple((agRegions, year, months, days, outputFile)))
+
+    updateLog(LOG_FILE, f"Planned {len(jobArgs)} requests\n")
+
+    # Handles the multiple processes
+    # Defines the number of workers and shares the rate limiter with them (retries requests when the CDS queue is full)
+    limiter = RateLimiter(REQUEST_RATE, MAX_QUEUED)
+    pool = mp.Pool(NUM_WORKERS, initializer=shareLimiter, initargs=(limiter,))
+
+    if replay:
+        # Creates the queue of jobs - pullSateliteData is the function and jobArgs holds the arguments
+        pool.starmap(pullSatelliteData, jobArgs)
+    else:
+        # Requests are queued on the CDS without blocking, each download is processed by the pool as soon as it is ready
+        client = cdsapi.Client(wait_until_complete=False, delete=False)
+        pipeline = CDSPipeline(
+            client,
+            DATASET,
+            limiter,
+            MAX_QUEUED,
+            POLL_INTERVAL,
+            log=lambda message: updateLog(ERROR_FILE, f"{message}\n"),
+        )
+
+        # a job is (request, download target, arguments of processDownload)
+        jobs = []
+        for args in jobArgs:
+            _, year, months, days, outputFile = args
+            request = buildRequest(year, months, days)
+            jobs.append((request, f"{outputFile}.netcdf.zip", args))
+
+        pipeline.run(
+            jobs,
+            pool,
+            processDownload,
+            lambda request, target: archiveDownload(archive, request, target),
+        )
+
+    pool.close()  # Once these jobs are finished close the multiple processes pool
+    pool.join()
+
+    # Refresh the planner statistics after the bulk load
+    db = DataService(PG_DB, PG_ADDR, int(PG_PORT), PG_USER, PG_PW)
+    SchemaManager().analyze(db, TABLE)
+    db.cleanup()
+
+
+def planRequests(
+    completedDf: pd.DataFrame,
+) -> typing.List[typing.Tuple[str, typing.List[str], typing.List[str]]]:
+    """
+    Purpose:
+    Groups the days which have not been pulled yet into as few requests as the CDS size limit allows
+
+    Pseudocode:
+    - For each month, find the days which have not been pulled yet
+    - Split them into the fewest batches of at most MAX_FIELDS fields (evenly sized)
+    - Merge consecutive months of a year missing the same days while the request stays within MAX_FIELDS
+        - A shorter month can join the request of a longer one as the CDS skips the dates which do not exist
+
+    Remarks:
+    - Requests are returned as (year, months, days), a request covers each of its days in each of its months
+    - The number of fields of a request is the number of attributes x hours x months x days
+    """
+    fieldsPerDay = len(ATTRS) * len(HOURS)
+    maxDays = max(1, MAX_FIELDS // fieldsPerDay)
+    requests: typing.List[typing.Tuple[str, typing.List[str], typing.List[str]]] = []
+
     for year in YEARS:
         for month in MONTHS:
             # Calculates the number of days - stored in index 1 of a tuple
             numDays = calendar.monthrange(int(year), int(month))[1]
 
-            # calculates a random delay (asc for groups of 12)
-            delay = random.randint(MIN_DELAY, MAX_DELAY)
-
-            days = [str(day) for day in range(1, numDays + 1)]
-            outputFile = f"data/copernicus_{year}_{month}"
-
             # removes the days that have already been completed
-            completedDaysDf = completedDf.loc[
+            completedDays = completedDf.loc[
                 (completedDf["year"] == int(year))
-                & (completedDf["month"] == int(month))
+                & (completedDf["month"] == int(month)),
+                "day",
+            ].tolist()
+            incompleteDays = [
+                str(day) for day in range(1, numDays + 1) if day not in completedDays
             ]
-            completedDays = completedDaysDf["day"].tolist()
-            incompleteDays = []
-            for day in days:
-                if int(day) not in completedDays:
-                    incompleteDays.append(day)
+            if len(incompleteDays) == 0:
+                continue
 
-            if len(incompleteDays) > 0:
-                jobArgs.append(
-                    tuple((agRegions, delay, year, month, incompleteDays, outputFile))
-                )
+            numBatches = -(-len(incompleteDays) // maxDays)
+            for batch in np.array_split(np.array(incompleteDays), numBatches):
+                days = batch.tolist()
 
-    # Handles the multiple processes
-    pool = mp.Pool(NUM_WORKERS)  # Defines the number of workers
+                # merges the batch into the previous month's request if the request covers exactly the missing days
+                # (the CDS skips the dates which do not exist, i.e the 31st of a 30 day month)
+                if len(requests) > 0:
+                    prevYear, prevMonths, prevDays = requests[-1]
+                    validDays = [day for day in prevDays if int(day) <= numDays]
+                    numFields = fieldsPerDay * (len(prevMonths) + 1) * len(prevDays)
 
-    # Creates the queue of jobs - pullSateliteData is the function and jobArgs holds the arguments
-    pool.starmap(pullSatelliteData, jobArgs)
-    pool.close()  # Once these jobs are finished close the multiple processes pool
+                    if (
+                        prevYear == year
+                        and validDays == days
+                        and int(prevMonths[-1]) == int(month) - 1
+                        and numFields <= MAX_FIELDS
+                    ):
+                        prevMonths.append(month)
+                        continue
+
+                requests.append((year, [month], days))
+
+    return requests
+
+
+def planReplay(
+    archive: RawArchive,
+) -> typing.List[typing.Tuple[str, typing.List[str], typing.List[str]]]:
+    """
+    Purpose:
+    Lists the archived requests of the current area so that they can be processed again
+
+    Pseudocode:
+    - For each archived request of the area, read its year, months and days from its period (year-months-days)
+    - Skip the requests made with other parameters (i.e other attributes), they would not be found when replayed
+    - Sort the requests by date
+
+    Remarks: requests are returned as (year, months, days) like planRequests
+    """
+    area = ",".join(str(coord) for coord in AREA)
+    requests = []
+
+    for entry in archive.entries(ARCHIVE_SOURCE, key=area):
+        year, months, days = entry["period"].split("-")
+        request = (year, months.split(","), days.split(","))
+
+        if entry["name"] != requestName(DATASET, buildRequest(*request)):
+            updateLog(ERROR_FILE, f"Skipping archived request {entry['name']}\n")
+            continue
+
+        requests.append(request)
+
+    return sorted(
+        requests,
+        key=lambda request: (
+            int(request[0]),
+            [int(month) for month in request[1]],
+            [int(day) for day in request[2]],
+        ),
+    )
 
 
 def updateLog(fileName: str, message: str):
@@ -224,6 +388,7 @@ def loadGeometry(conn: sq.engine.Connection) -> gpd.GeoDataFrame:
     - [Load the regions directly into a GeoDataFrame](https://geopandas.org/en/stable/docs/reference/api/geopandas.GeoDataFrame.from_postgis.html)
         - crs sets the coordinate system, in our case we want EPSG:3347
         - geom_col specifies which column holds the geometry/boundaries
+    - Hash the geometries once (see [regionLookup](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions/blob/main/src/Shared/regionLookup.py)) so the days processed later reuse the hash
     """
     query = sq.text(f"select cr_num, district, geometry FROM public.{AG_REGIONS_TABLE}")
 
@@ -231,6 +396,9 @@ def loadGeometry(conn: sq.engine.Connection) -> gpd.GeoDataFrame:
         query, conn, crs="EPSG:3347", geom_col="geometry"
     )
 
+    # hashes the geometries once, the hash is passed along with the regions to the workers
+    regionsKey(agRegions)
+
     return agRegions
 
 
@@ -254,323 +422,221 @@ def getCompleteDates(conn: sq.engine.Connection) -> pd.DataFrame:
     return dates
 
 
-def addDateAttrs(df: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+@contextlib.contextmanager
+def openNetCDF(file: str) -> typing.Iterator[xr.Dataset]:
     """
     Purpose:
-    Breaks down the date row into multiple attributes that are easier to work with (year, month and date)
+    Opens the NetCDF file of a download straight from its zip (nothing is extracted to disk)
 
     Pseudocode:
-    - For each row, get the date and extract the year, month and date
-    - [Cast these attributes](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.astype.html) (year, month and date) to an integer
-    - [Delete](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.drop.html) the original datetime row
-    - If an error is encountered, log it
+    - Open the zip's member (see [zipReader](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions/blob/main/src/Shared/zipReader.py))
+    - Pick the reader from the file's signature: NetCDF3 files start with CDF (scipy), NetCDF4 files are HDF5 files (h5netcdf)
+    - [Open the dataset](https://docs.xarray.dev/en/stable/generated/xarray.open_dataset.html) over the member
+
+    Remarks: the dataset and the member are closed when the with block exits
     """
-    try:
-        for index in range(len(df.index)):
-            date = pd.Timestamp(np.datetime64(df.at[index, "datetime"]))
-            df.at[index, "year"] = date.year
-            df.at[index, "month"] = date.month
-            df.at[index, "day"] = date.day
-
-        df[["year", "month", "day"]] = df[["year", "month", "day"]].astype(int)
-        df.drop(columns=["datetime"], inplace=True)
-    except Exception as e:
-        updateLog(ERROR_FILE, f"Error adding date attributes {e}\n")
+    with openMember(f"./{file}.netcdf.zip") as member:
+        engine = "scipy" if member.read(3) == b"CDF" else "h5netcdf"
+        member.seek(0)
 
-    return df
+        with xr.open_dataset(member, engine=engine) as dataset:
+            yield dataset
 
 
-def addRegions(df: pd.DataFrame, agRegions: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+def aggregateDataset(dataset: xr.Dataset, agRegions: gpd.GeoDataFrame) -> pd.DataFrame:
     """
     Purpose:
-    Transforms the Copernicus DataFrame into a GeoDataFrame
+    Aggregates the Copernicus Satellite data by day and region (year, month, day, cr_num and district) straight from its arrays
 
     Psuedocode:
-    - [Create geometry for each set of longitude/latitude](https://geopandas.org/en/stable/docs/reference/api/geopandas.points_from_xy.html) for the data found in the Copernicus data
-    - [Set the coordinate system](https://geopandas.org/en/stable/docs/reference/api/geopandas.GeoDataFrame.to_crs.html) to the same one used throughout the codebase (EPSG:3347)
-    - Label the data to the regions [by joining them together](https://geopandas.org/en/stable/docs/reference/api/geopandas.sjoin.html)
-        - how=left specifies that the Copernicus data is always kept even if it does not fall within a region
-        - predicate=within joins the data based on which rows of Copernicus data fall into what regions
-    - [Drop irrelevant columns](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.drop.html)
-    - [Drop irregular data](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.notna.html)
-    - [Cast cr_num and district to integers](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.astype.html)
+    - Load the region of each cell of the grid (see [regionLookup](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions/blob/main/src/Shared/regionLookup.py)) and group the cells by region (cells outside of every region are dropped)
+        - The regions are only joined to the grid the first time it is seen, the lookup is then read from REGION_LOOKUP_DIR
+    - Find where each day starts along the time axis
+    - For each attribute, load its (time, latitude, longitude) array, flatten the grid and take the cells of each region in order
+        - Reduce the hours of each day, then the cells of each region ([reduceat](https://numpy.org/doc/stable/reference/generated/numpy.ufunc.reduceat.html))
+        - minimums and maximums ignore missing values (fmin/fmax), means divide the sum of the values by their count
+        - attributes missing from the file are left null
+    - Fill a preallocated block with the aggregates in the order of the table's columns
+
+    Remarks:
+    - Same rows as grouping the flat hourly table (one row per hour and cell) by day and region, without ever building it
+      (tests/test_pullCopernicusData.py checks it against that reference)
+    - Days are the UTC dates of the timestamps, the file can hold any number of days
     """
-    df = gpd.GeoDataFrame(
-        df, crs="EPSG:4326", geometry=gpd.points_from_xy(df.lon, df.lat)
-    )
+    # the grid axes are the dataset's coordinates (already unique, only their order differs)
+    lats = dataset["latitude"].values
+    lons = dataset["longitude"].values
 
-    # Changes the points projection to match the agriculture regions of EPSG:3347
-    df.to_crs(crs="EPSG:3347", inplace=True)  # type: ignore
-
-    # Join the two dataframes based on which points fit within what agriculture regions
-    df = gpd.sjoin(df, agRegions, how="left", predicate="within")
+    lookup = loadRegionLookup(
+        np.sort(lats), np.sort(lons), agRegions, REGION_LOOKUP_DIR
+    )
+    cells, regionStarts, crNums, districts = lookup.zones(lats, lons)
+
+    if not dataset.indexes["time"].is_monotonic_increasing:
+        dataset = dataset.sortby("time")
+    dates = dataset["time"].values.astype("datetime64[D]")
+    days, dayStarts = np.unique(dates, return_index=True)
+
+    columns = [f"{agg}_{attr}" for attr in VARIABLES.values() for agg in AGGREGATES]
+    block = np.full((len(days) * len(crNums), len(columns)), np.nan)
+
+    for i, variable in enumerate(VARIABLES):
+        if variable not in dataset or len(cells) == 0:
+            continue
+
+        values = dataset[variable].transpose("time", "latitude", "longitude").values
+        values = values.reshape(len(dates), -1)[:, cells].astype(np.float64)
+        missing = np.isnan(values)
+
+        mins = np.fmin.reduceat(values, dayStarts, axis=0)
+        maxs = np.fmax.reduceat(values, dayStarts, axis=0)
+        sums = np.add.reduceat(np.where(missing, 0, values), dayStarts, axis=0)
+        counts = np.add.reduceat(~missing, dayStarts, axis=0, dtype=np.int64)
+
+        mins = np.fmin.reduceat(mins, regionStarts, axis=1)
+        maxs = np.fmax.reduceat(maxs, regionStarts, axis=1)
+        sums = np.add.reduceat(sums, regionStarts, axis=1)
+        counts = np.add.reduceat(counts, regionStarts, axis=1)
+        means = np.divide(
+            sums, counts, out=np.full(sums.shape, np.nan), where=counts > 0
+        )
 
-    df.drop(columns=["geometry", "index_right", "lat", "lon"], inplace=True)
-    df = df[df["cr_num"].notna()]  # Take rows that are valid numbers
-    df[["cr_num"]] = df[["cr_num"]].astype(int)
-    df[["district"]] = df[["district"]].astype(int)
+        # rows are ordered by day then region
+        block[:, i * 3] = mins.ravel()
+        block[:, i * 3 + 1] = maxs.ravel()
+        block[:, i * 3 + 2] = means.ravel()
+
+    dayIndex = pd.DatetimeIndex(np.repeat(days, len(crNums)))
+    aggregate = pd.DataFrame(
+        {
+            "year": dayIndex.year.to_numpy(np.int64),
+            "month": dayIndex.month.to_numpy(np.int64),
+            "day": dayIndex.day.to_numpy(np.int64),
+            "cr_num": np.tile(crNums, len(days)),
+            "district": np.tile(districts, len(days)),
+        }
+    )
+    aggregate[columns] = block
 
-    return df
+    return aggregate
 
 
-def unzipFile(file: str):
+def buildRequest(year: str, months: typing.List[str], days: typing.List[str]) -> dict:
     """
     Purpose:
-    Unzips a zip file and extracts all of its content
+    Creates the [data request](https://cds.climate.copernicus.eu/cdsapp#!/dataset/reanalysis-era5-land?tab=form) for the days of one or more months of a year
 
-    Pseudocode:
-    - Open the zipfile (naming convention comes from the Copernicus data request)
-    - Load its contents (*we only expect one*)
-    - Rename the file
-    - [Extract the file](https://www.geeksforgeeks.org/working-zip-files-python/)
+    Remarks: single values are sent as is so that the days archived before requests were batched are still replayed
     """
-    with zipfile.ZipFile(f"./{file}.netcdf.zip", "r") as zip_ref:  # Opens the zip file
-        zipinfos = zip_ref.infolist()
-
-        for zipinfo in zipinfos:  # we only expect one
-            zipinfo.filename = f"{file}.nc"  # Changes the unzipped files name
-            zip_ref.extract(zipinfo)  # Unzips the file
-            break
-
-
-def readNetCDF(file: str) -> pd.DataFrame:
+    return {
+        "format": "netcdf.zip",
+        "variable": ATTRS,
+        "year": year,
+        "month": months if len(months) > 1 else months[0],
+        "day": days if len(days) > 1 else days[0],
+        "time": HOURS,
+        "area": AREA,
+    }
+
+
+def archiveDownload(archive: typing.Optional[RawArchive], request: dict, file: str):
     """
     Purpose:
-    Reads a netCEF file
+    Archives a downloaded request if a raw archive is configured (under its area, dates and request)
 
-    Pseudocode:
-    - [Open the file](https://docs.xarray.dev/en/stable/generated/xarray.open_dataset.html)
-    - [Convert its contents into a DataFrame](https://docs.xarray.dev/en/latest/generated/xarray.DataArray.to_dataframe.html)
-    - Close the file
-    - If an error is encountered, log it
+    Remarks: the zip is already compressed
     """
-    try:
-        dataset = xr.open_dataset(f"./{file}.nc")
-        df = dataset.to_dataframe().reset_index()
-        dataset.close()
-    except Exception as e:
-        updateLog(ERROR_FILE, f"Error reading netCDF file {e}\n")
+    if archive is None:
+        return
 
-    return df
+    months = (
+        request["month"] if isinstance(request["month"], list) else [request["month"]]
+    )
+    days = request["day"] if isinstance(request["day"], list) else [request["day"]]
+    archive.putFile(
+        file,
+        ARCHIVE_SOURCE,
+        ",".join(str(coord) for coord in AREA),
+        f"{request['year']}-{','.join(months)}-{','.join(days)}",
+        requestName(DATASET, request),
+        compress=False,
+    )
 
 
-def formatDF(df: pd.DataFrame) -> pd.DataFrame:
+def pullSatelliteData(
+    agRegions: gpd.GeoDataFrame,
+    year: str,
+    months: typing.List[str],
+    days: typing.List[str],
+    outputFile: str,
+):
     """
     Purpose:
-    Prepares the DataFrame for future processing
-
-    Preprocessing:
-    - Add empty attribute columns we will fill later (year, month and day)
-    - [Rename DataFrame columns](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.rename.html)
-    - Double checks all attributes are present
-    - [Casts all attributes to floats](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.astype.html)
-    - Log any errors
-    """
-    try:
-        # Adds the remaining attributes we want to store which will be gathered during data preprocessing
-        df["year"] = None
-        df["month"] = None
-        df["day"] = None
-
-        # Renames the dataframes columns so it can be matched when its posted to the database
-        df.rename(columns={"longitude": "lon"}, inplace=True)
-        df.rename(columns={"latitude": "lat"}, inplace=True)
-        df.rename(columns={"time": "datetime"}, inplace=True)
-        df.rename(columns={"d2m": "dewpoint_temperature"}, inplace=True)
-        df.rename(columns={"t2m": "temperature"}, inplace=True)
-        df.rename(columns={"evabs": "evaporation_from_bare_soil"}, inplace=True)
-        df.rename(columns={"src": "skin_reservoir_content"}, inplace=True)
-        df.rename(columns={"skt": "skin_temperature"}, inplace=True)
-        df.rename(columns={"smlt": "snowmelt"}, inplace=True)
-        df.rename(columns={"stl1": "soil_temperature_level_1"}, inplace=True)
-        df.rename(columns={"stl2": "soil_temperature_level_2"}, inplace=True)
-        df.rename(columns={"stl3": "soil_temperature_level_3"}, inplace=True)
-        df.rename(columns={"stl4": "soil_temperature_level_4"}, inplace=True)
-        df.rename(columns={"ssr": "surface_net_solar_radiation"}, inplace=True)
-        df.rename(columns={"sp": "surface_pressure"}, inplace=True)
-        df.rename(columns={"swvl1": "volumetric_soil_water_layer_1"}, inplace=True)
-        df.rename(columns={"swvl2": "volumetric_soil_water_layer_2"}, inplace=True)
-        df.rename(columns={"swvl3": "volumetric_soil_water_layer_3"}, inplace=True)
-        df.rename(columns={"swvl4": "volumetric_soil_water_layer_4"}, inplace=True)
-        df.rename(columns={"lai_hv": "leaf_area_index_high_vegetation"}, inplace=True)
-        df.rename(columns={"lai_lv": "leaf_area_index_low_vegetation"}, inplace=True)
-
-        # if column is not in the dataframe then add it with a null value
-        columns = [
-            "lon",
-            "lat",
-            "dewpoint_temperature",
-            "temperature",
-            "evaporation_from_bare_soil",
-            "skin_reservoir_content",
-            "skin_temperature",
-            "snowmelt",
-            "soil_temperature_level_1",
-            "soil_temperature_level_2",
-            "soil_temperature_level_3",
-            "soil_temperature_level_4",
-            "surface_net_solar_radiation",
-            "surface_pressure",
-            "volumetric_soil_water_layer_1",
-            "volumetric_soil_water_layer_2",
-            "volumetric_soil_water_layer_3",
-            "volumetric_soil_water_layer_4",
-            "leaf_area_index_high_vegetation",
-            "leaf_area_index_low_vegetation",
-        ]
-
-        for column in columns:
-            if column not in df.columns:
-                df[column] = None
-
-        df[columns] = df[columns].astype(float)
-    except Exception as e:
-        updateLog(ERROR_FILE, f"Error formatting dataframe {e}\n")
-
-    return df
+    Requests data (waiting for the request to complete), processes it then stores the Copernicus Satellite data
 
+    Psuedocode:
+    - [Calculate the start time](https://www.geeksforgeeks.org/python-strftime-function/)
+    - [Make a single data request](https://cds.climate.copernicus.eu/cdsapp#!/dataset/reanalysis-era5-land?tab=form) for every day of the months (paced by the shared rate limiter)
+        - If a raw archive is configured, archive the downloaded file (or read it from the archive in replay mode)
+    - Process the download (see processDownload), replayed days replace the ones already in the table
+    - Log progress/errors
 
-def generateDailyAggregate(df: pd.DataFrame) -> pd.DataFrame:
+    Remarks:
+    - requests are planned by planRequests or planReplay (the same days of one or more months of a year)
+    - main queues the requests on the CDS without blocking instead (see CDSPipeline) unless replaying them
     """
-    Purpose:
-    Aggregate the Copernicus Satellite data by year, month, day, cr_num and district
+    limiter = getSharedLimiter()
+    limiter = limiter if limiter is not None else RateLimiter(REQUEST_RATE, 1)
+    archive = openArchive()
+    replay = archive is not None and archive.replay
 
-    Psuedocode:
-    - [Aggregate](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.agg.html) the columns by [year, month, day, cr_num and district](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.groupby.html)
-    - Load all columns
-    - [Realign labels and attribute](https://pandas.pydata.org/docs/reference/api/pandas.Index.html)
-    - [Cast all attributes as floats](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.astype.html)
-    - If an error is encountered, log it
-    """
+    label = f"{year}/{','.join(months)}/{','.join(days)}"
     try:
-        aggregate = (
-            df.groupby(["year", "month", "day", "cr_num", "district"])
-            .agg(
-                {
-                    "dewpoint_temperature": ["min", "max", "mean"],
-                    "temperature": ["min", "max", "mean"],
-                    "evaporation_from_bare_soil": ["min", "max", "mean"],
-                    "skin_reservoir_content": ["min", "max", "mean"],
-                    "skin_temperature": ["min", "max", "mean"],
-                    "snowmelt": ["min", "max", "mean"],
-                    "soil_temperature_level_1": ["min", "max", "mean"],
-                    "soil_temperature_level_2": ["min", "max", "mean"],
-                    "soil_temperature_level_3": ["min", "max", "mean"],
-                    "soil_temperature_level_4": ["min", "max", "mean"],
-                    "surface_net_solar_radiation": ["min", "max", "mean"],
-                    "surface_pressure": ["min", "max", "mean"],
-                    "volumetric_soil_water_layer_1": ["min", "max", "mean"],
-                    "volumetric_soil_water_layer_2": ["min", "max", "mean"],
-                    "volumetric_soil_water_layer_3": ["min", "max", "mean"],
-                    "volumetric_soil_water_layer_4": ["min", "max", "mean"],
-                    "leaf_area_index_high_vegetation": ["min", "max", "mean"],
-                    "leaf_area_index_low_vegetation": ["min", "max", "mean"],
-                }
-            )
-            .reset_index()
-        )
-
-        columns = [
-            "min_dewpoint_temperature",
-            "max_dewpoint_temperature",
-            "mean_dewpoint_temperature",
-            "min_temperature",
-            "max_temperature",
-            "mean_temperature",
-            "min_evaporation_from_bare_soil",
-            "max_evaporation_from_bare_soil",
-            "mean_evaporation_from_bare_soil",
-            "min_skin_reservoir_content",
-            "max_skin_reservoir_content",
-            "mean_skin_reservoir_content",
-            "min_skin_temperature",
-            "max_skin_temperature",
-            "mean_skin_temperature",
-            "min_snowmelt",
-            "max_snowmelt",
-            "mean_snowmelt",
-            "min_soil_temperature_level_1",
-            "max_soil_temperature_level_1",
-            "mean_soil_temperature_level_1",
-            "min_soil_temperature_level_2",
-            "max_soil_temperature_level_2",
-            "mean_soil_temperature_level_2",
-            "min_soil_temperature_level_3",
-            "max_soil_temperature_level_3",
-            "mean_soil_temperature_level_3",
-            "min_soil_temperature_level_4",
-            "max_soil_temperature_level_4",
-            "mean_soil_temperature_level_4",
-            "min_surface_net_solar_radiation",
-            "max_surface_net_solar_radiation",
-            "mean_surface_net_solar_radiation",
-            "min_surface_pressure",
-            "max_surface_pressure",
-            "mean_surface_pressure",
-            "min_volumetric_soil_water_layer_1",
-            "max_volumetric_soil_water_layer_1",
-            "mean_volumetric_soil_water_layer_1",
-            "min_volumetric_soil_water_layer_2",
-            "max_volumetric_soil_water_layer_2",
-            "mean_volumetric_soil_water_layer_2",
-            "min_volumetric_soil_water_layer_3",
-            "max_volumetric_soil_water_layer_3",
-            "mean_volumetric_soil_water_layer_3",
-            "min_volumetric_soil_water_layer_4",
-            "max_volumetric_soil_water_layer_4",
-            "mean_volumetric_soil_water_layer_4",
-            "min_leaf_area_index_high_vegetation",
-            "max_leaf_area_index_high_vegetation",
-            "mean_leaf_area_index_high_vegetation",
-            "min_leaf_area_index_low_vegetation",
-            "max_leaf_area_index_low_vegetation",
-            "mean_leaf_area_index_low_vegetation",
-        ]
-
-        all_columns = [
-            "year",
-            "month",
-            "day",
-            "cr_num",
-            "district",
-        ]
-
-        all_columns.extend(columns)
-        aggregate.columns = Index(all_columns)
-        aggregate[columns] = aggregate[columns].astype(float)
+        starttime = datetime.now().strftime("%Y%m%d%H%M%S")
+        updateLog(LOG_FILE, f"{starttime} Starting to pull data for {label}\n")
+
+        request = buildRequest(year, months, days)
+        if replay:
+            name = requestName(DATASET, request)
+            archive.restoreFile(ARCHIVE_SOURCE, name, f"{outputFile}.netcdf.zip")
+        else:
+            c = cdsapi.Client()
+            limiter.call(c.retrieve, DATASET, request, f"{outputFile}.netcdf.zip")
+            archiveDownload(archive, request, f"{outputFile}.netcdf.zip")
     except Exception as e:
-        updateLog(ERROR_FILE, f"Error generating daily aggregate {e}\n")
+        updateLog(ERROR_FILE, f"Error pulling data for {label} : {e}\n")
+        return
 
-    return aggregate
+    processDownload(agRegions, year, months, days, outputFile, replace=replay)
 
 
-def pullSatelliteData(
+def processDownload(
     agRegions: gpd.GeoDataFrame,
-    delay: int,
     year: str,
-    month: str,
-    days: list,
+    months: typing.List[str],
+    days: typing.List[str],
     outputFile: str,
+    replace: bool = False,
 ):
     """
     Purpose:
-    Requests data, processes it then stores the Copernicus Satellite data
+    Processes then stores a downloaded request, day by day
 
     Tables:
     - [agg_day_copernicus_satellite_data](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#agg_day_copernicus_satellite_data)
 
     Psuedocode:
-    - Adds a time delay (prevents being detected as a bot)
     - Connect to the database
-    - [Calculate the start time](https://www.geeksforgeeks.org/python-strftime-function/)
-    - [Make a data request](https://cds.climate.copernicus.eu/cdsapp#!/dataset/reanalysis-era5-land?tab=form)
-    - Load the data and preprocess it
-    - Add the region label
-    - Break down the date into its components
-    - Aggreate the data
-    - [Store the data](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.to_sql.html)
+    - Load the data, then for each of its days
+        - Aggregate the day by region from its arrays (see aggregateDataset)
+        - Store the day (bulk write), if replacing the rows already stored for the day are deleted in the same transaction
+        - A day which fails is logged and skipped (keeping the rows already stored for it)
     - [Remnove the accumulated files](https://www.geeksforgeeks.org/python-os-remove-method/)
     - Log progress/errors
+
+    Remarks:
+    - outputFile.netcdf.zip holds the download
+    - replace is used when replaying the archive, so that the days processed again are not stored twice
     """
     if (
         PG_DB is None
@@ -583,83 +649,60 @@ def pullSatelliteData(
         raise ValueError("Environment variables not set")
 
     db = DataService(PG_DB, PG_ADDR, int(PG_PORT), PG_USER, PG_PW)
-    time.sleep(delay)
+    queryHandler = CopernicusQueryBuilder()
 
-    conn = db.connect()
-    c = cdsapi.Client()
+    label = f"{year}/{','.join(months)}/{','.join(days)}"
+    try:
+        # Reads the NetCDF file straight from the zip
+        with openNetCDF(outputFile) as dataset:
+            for date, dayDataset in splitDays(dataset):
+                try:
+                    # Aggregates the hourly grid by day and crop district (cr_num and district) without flattening it
+                    df = aggregateDataset(dayDataset, agRegions)
+
+                    updateLog(
+                        LOG_FILE,
+                        f"Adding rows {len(df.index)} data from {date} to the Database\n",
+                    )
+                    # a replaced day is deleted in the transaction storing it again (kept if storing fails)
+                    preQueries = [queryHandler.deleteDayReq(date)] if replace else None
+                    db.bulkWrite(df, TABLE, preQueries=preQueries)
+                except Exception as e:
+                    updateLog(ERROR_FILE, f"Error processing data for {date} : {e}\n")
+    except Exception as e:
+        updateLog(ERROR_FILE, f"Error processing data for {label} : {e}\n")
 
-    for currDay in days:
-        currFile = f"{outputFile}_{currDay}"
-        try:
-            starttime = datetime.now().strftime("%Y%m%d%H%M%S")
-            updateLog(
-                LOG_FILE,
-                f"{starttime} Starting to pull data for {year}/{month}/{currDay}\n",
-            )
-            c.retrieve(
-                "reanalysis-era5-land",
-                {
-                    "format": "netcdf.zip",
-                    "variable": ATTRS,
-                    "year": year,
-                    "month": month,
-                    "day": currDay,
-                    "time": HOURS,
-                    "area": AREA,
-                },
-                f"{currFile}.netcdf.zip",
-            )
-
-            # Unzips the file, renames it to outputFile and then deletes the source .zip file
-            unzipFile(currFile)
-
-            df = readNetCDF(currFile)  # Converts the netcdf content into a dataframe
-            # Formats the data frame to process null values, add additional attributes and rename columns
-
-            df = formatDF(df)
-
-            updateLog(
-                LOG_FILE,
-                f"Starting to match regions for data in {year}/{month}/{currDay}\n",
-            )
-            # Links data to their crop district number (stored in cr_num)
-            df = addRegions(df, agRegions)
-            df = df.reset_index()
-            updateLog(
-                LOG_FILE,
-                f"Finished matching {len(df.index)} regions for data in {year}/{month}/{currDay}\n",
-            )
-
-            # Breaks down the date attributes into its components and saves them for storage
-            df = addDateAttrs(df)
-            updateLog(LOG_FILE, f"Added date attributes for {year}/{month}/{currDay}\n")
-
-            df = generateDailyAggregate(df)
-
-            updateLog(
-                LOG_FILE,
-                f"Adding rows {len(df.index)} data from {year}/{month}/{currDay} to the Database\n",
-            )
-
-            df.to_sql(TABLE, conn, schema="public", if_exists="append", index=False)
-            updateLog(
-                LOG_FILE,
-                f"{starttime} Finished data pull from {year}/{month}/{currDay}\n",
-            )
-        except Exception as e:
-            updateLog(
-                ERROR_FILE, f"Error pulling data for {year}/{month}/{currDay} : {e}\n"
-            )
-
-        # Clean up the environment after the transaction
-        try:
-            os.remove(f"{currFile}.nc")
-            os.remove(f"{currFile}.netcdf.zip")
-        except Exception as e:
-            updateLog(ERROR_FILE, f"Error cleaning up {year}/{month}/{currDay} : {e}\n")
+    # Clean up the environment after the transaction
+    try:
+        os.remove(f"{outputFile}.netcdf.zip")
+    except Exception as e:
+        updateLog(ERROR_FILE, f"Error cleaning up {label} : {e}\n")
 
     db.cleanup()
-    updateLog(LOG_FILE, f"Finished adding {year}/{month} to the Database\n")
+    updateLog(LOG_FILE, f"Finished adding {label} to the Database\n")
+
+
+def splitDays(
+    dataset: xr.Dataset,
+) -> typing.Iterator[typing.Tuple[str, xr.Dataset]]:
+    """
+    Purpose:
+    Splits a dataset holding several days into one dataset per (UTC) day
+
+    Pseudocode:
+    - Sort the dataset by time if it is not sorted
+    - Find where each day starts along the time axis
+    - Yield the date (i.e 2022-07-01) and the hours of each day (a view, the data is only read once aggregated)
+    """
+    if not dataset.indexes["time"].is_monotonic_increasing:
+        dataset = dataset.sortby("time")
+
+    dates = dataset["time"].values.astype("datetime64[D]")
+    days, starts = np.unique(dates, return_index=True)
+    ends = np.r_[starts[1:], len(dates)]
+
+    for day, start, end in zip(days, starts, ends):
+        yield str(day), dataset.isel(time=slice(start, end))
 
 
 if __name__ == "__main__":
@@ -24,6 +24,7 @@ except:
 
 sys.path.append("../")
 from Shared.DataService import DataService
+from Shared.schemaManager import SchemaManager
 from SoilMoistureQueryHandler import SoilMoistureQueryHandler  # type: ignore
 
 
@@ -99,7 +100,7 @@ def main():
                 df = readNetCDF(filePath)
                 df = formatData(df)
                 df = addRegions(df, agRegions)
-                df.to_sql(TABLE, conn, schema="public", if_exists="append", index=False)
+                db.bulkWrite(df, TABLE)
 
         except Exception as e:
             numErrors += 1
@@ -111,6 +112,9 @@ def main():
                 """,
             )
 
+    # Refresh the planner statistics after the bulk load
+    SchemaManager().analyze(db, TABLE)
+
     updateLog(
         LOG_FILE,
         f"[SUCCESS] loaded {len(folder_names) - numErrors}/{len(folder_names)} data from {folder_name} into {TABLE}",
@@ -242,7 +246,7 @@ def addRegions(df: pd.DataFrame, agRegions: gpd.GeoDataFrame) -> pd.DataFrame:
         - predicate=within joins the data based on which rows of moisture data fall into what regions
     - [Drop irrelevant columns](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.drop.html)
     - [Drop irregular data](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.notna.html)
-    - [Cast cr_num to an integer](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.astype.html)
+    - [Cast cr_num and district to integers](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.astype.html)
     """
     df = gpd.GeoDataFrame(
         df, crs="EPSG:4326", geometry=gpd.points_from_xy(df.lon, df.lat)
@@ -257,7 +261,7 @@ def addRegions(df: pd.DataFrame, agRegions: gpd.GeoDataFrame) -> pd.DataFrame:
     df = pd.DataFrame(df.drop(columns=["index_right", "geometry"]))
 
     df = df[df["cr_num"].notna()]  # Take rows that are valid numbers
-    df[["cr_num"]] = df[["cr_num"]].astype(int)
+    df[["cr_num", "district"]] = df[["cr_num", "district"]].astype(int)
 
     return df
 
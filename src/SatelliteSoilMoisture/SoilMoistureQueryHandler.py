@@ -9,6 +9,7 @@ import os, sys
 sys.path.append("../")
 from Shared.DataService import DataService
 from Shared.GenericQueryBuilder import GenericQueryBuilder
+from Shared.schemaManager import SchemaManager
 
 
 # Table name that stores the soil moisture data
@@ -27,6 +28,7 @@ class SoilMoistureQueryHandler(GenericQueryBuilder):
         Pseudocode:
         - Check if the table already exists
         - If it does not exist, create it
+        - Create its indexes (if they do not already exist)
 
         Remarks: Creating the table manually ensures the tables persist (usually due to the inability to locate a unique key)
         """
@@ -52,3 +54,5 @@ class SoilMoistureQueryHandler(GenericQueryBuilder):
             )
 
             db.execute(query)
+
+        SchemaManager().createIndexes(db, SOIL_MOISTURE_TABLE)
@@ -9,12 +9,15 @@
 #
 # Remarks:
 #  - This class is used by the setCreator
-#  - As weeks change per year, the weekly aggregation uses the year of 2001 (not a leap year)
+#  - The data is streamed and aggregated one chunk at a time (by day, week and month in a single pass) as per the
+#    [chunkAggregator](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions/blob/main/src/Shared/chunkAggregator.py)
+#  - As weeks change per year, the weekly aggregation uses the year of 2001 (not a leap year) as per the [harvestCalendar](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions/blob/main/src/Shared/harvestCalendar.py)
 # -------------------------------------------
 from dotenv import load_dotenv
 import sqlalchemy as sq
 import pandas as pd
-import os, sys, datetime
+import numpy as np
+import os, sys, typing
 
 try:
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
@@ -24,10 +27,31 @@ except:
 sys.path.append("../")
 from Shared.DataService import DataService
 from Shared.aggregatorHelper import AggregatorHelper  # type: ignore
+from Shared.chunkAggregator import ChunkAggregator
+from Shared.harvestCalendar import HarvestCalendar
 
 
 SOIL_MOISTURE_TABLE = "soil_moisture"  # table that contains the soil moisture data
 
+# The types the soil moisture data is loaded as (float32 halves the memory used by the attributes)
+MOISTURE_DTYPES = {
+    "lon": "float32",
+    "lat": "float32",
+    "district": "int16",
+    "soil_moisture": "float32",
+}
+
+# How the soil moisture is aggregated (see DataFrame.agg) and the names of the aggregated columns
+MOISTURE_AGGS = {"soil_moisture": ["min", "max", "mean"]}
+MOISTURE_AGG_COLS = ["soil_moisture_min", "soil_moisture_max", "soil_moisture_mean"]
+
+# The date columns the data is aggregated by (by day, week and month) along with the district
+AGG_DATE_COLS = {
+    "day": ["year", "month", "day"],
+    "week": ["year", "week"],
+    "month": ["year", "month"],
+}
+
 
 try:
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
@@ -56,72 +80,28 @@ class MoistureAggregator:
 
         # connicting to database
         db = DataService(PG_DB, PG_ADDR, int(PG_PORT), PG_USER, PG_PW)
-        conn = db.connect()
 
-        self.moistureData = self.__pullMoistureData(conn)
+        self.aggregates, self.districts = self.__aggregateMoistureData(db)
         db.cleanup()
 
         self.helper = AggregatorHelper()
 
-        # extracts day, month, year, week from the date then deletes the date altogether
-        self.moistureData["date"] = pd.to_datetime(self.moistureData["date"])
-        self.moistureData["day"] = self.moistureData["date"].dt.day
-        self.moistureData["month"] = self.moistureData["date"].dt.month
-        self.moistureData["year"] = self.moistureData["date"].dt.year
-
-        self.moistureData.drop(columns="date", inplace=True)
-
-        # setup for weekly aggregations
-        self.moistureData["week"] = None
-        dates = self.helper.getDatesInYr()
-
-        for date in dates:
-            dateComponents = date.split("-")
-            monthInt = int(dateComponents[0])
-            dayInt = int(dateComponents[1])
-
-            #  calculate the week number (52 weeks in a year)
-            weekInt = datetime.date(2001, monthInt, dayInt).isocalendar()[1]
-
-            #  Assign week numbers (week) based on the month and day in the DataFrame
-            self.moistureData.loc[
-                (self.moistureData["month"] == monthInt)
-                & (self.moistureData["day"] == dayInt),
-                "week",
-            ] = weekInt
-
     def aggregateByDay(self, pathToSave: str, byHarvest: bool = False):
         """
         Purpose:
         Aggregate the soil moisture data by district, year, month and day
 
         Psuedocode:
-        - Aggregate the columns by district, year, monthy, day
-        - Name the columns into the final DataFrame
+        - Get the columns aggregated by district, year, monthy, day (see __aggregateMoistureData)
         - Get the unique dates in a year formatted as MO-DA
         - Reshape the rows to transform them into columns where each attribute reappears for each date
         - Export to csv
         """
-        agg_df = (
-            self.moistureData.groupby(["district", "year", "month", "day"])
-            .agg({"soil_moisture": ["min", "max", "mean"]})
-            .reset_index()
-        )
-
-        # sets the column names for the aggregate dataframe
-        agg_df.columns = [  # type: ignore
-            "district",
-            "year",
-            "month",
-            "day",
-            "soil_moisture_min",
-            "soil_moisture_max",
-            "soil_moisture_mean",
-        ]
+        agg_df = self.aggregates["day"]
 
         dates = self.helper.getDatesInYr()
         final_df = self.helper.reshapeDataByDates(
-            dates, agg_df, self.moistureData, "dates", byHarvest
+            dates, agg_df, self.districts, "dates", byHarvest
         )
 
         try:
@@ -140,31 +120,16 @@ class MoistureAggregator:
         Aggregate the soil moisture data by district, year and week
 
         Psuedocode:
-        - Aggregate the columns by district, year and week
-        - Name the columns into the final DataFrame
+        - Get the columns aggregated by district, year and week (see __aggregateMoistureData)
         - Get the unique dates in a year formatted as W
         - Reshape the rows to transform them into columns where each attribute reappears for each date
         - Export to csv
         """
-        agg_df = (
-            self.moistureData.groupby(["district", "year", "week"])
-            .agg({"soil_moisture": ["min", "max", "mean"]})
-            .reset_index()
-        )
-
-        # sets the column names for the aggregate dataframe
-        agg_df.columns = [  # type: ignore
-            "district",
-            "year",
-            "week",
-            "soil_moisture_min",
-            "soil_moisture_max",
-            "soil_moisture_mean",
-        ]
+        agg_df = self.aggregates["week"]
 
         dates = self.helper.getWeeksInYr()
         final_df = self.helper.reshapeDataByDates(
-            dates, agg_df, self.moistureData, "weeks", byHarvest
+            dates, agg_df, self.districts, "weeks", byHarvest
         )
 
         try:
@@ -183,31 +148,16 @@ class MoistureAggregator:
         Aggregate the soil moisture data by district, year and month
 
         Psuedocode:
-        - Aggregate the columns by district, year and month
-        - Name the columns into the final DataFrame
+        - Get the columns aggregated by district, year and month (see __aggregateMoistureData)
         - Get the unique dates in a year formatted as M:
         - Reshape the rows to transform them into columns where each attribute reappears for each date
         - Export to csv
         """
-        agg_df = (
-            self.moistureData.groupby(["district", "year", "month"])
-            .agg({"soil_moisture": ["min", "max", "mean"]})
-            .reset_index()
-        )
-
-        # sets the column names for the aggregate dataframe
-        agg_df.columns = [  # type: ignore
-            "district",
-            "year",
-            "month",
-            "soil_moisture_min",
-            "soil_moisture_max",
-            "soil_moisture_mean",
-        ]
+        agg_df = self.aggregates["month"]
 
         dates = self.helper.getMonthsInYr()
         final_df = self.helper.reshapeDataByDates(
-            dates, agg_df, self.moistureData, "months", byHarvest
+            dates, agg_df, self.districts, "months", byHarvest
         )
 
         try:
@@ -220,17 +170,26 @@ class MoistureAggregator:
             print("[ERROR]")
             print(e)
 
-    def __pullMoistureData(self, conn: sq.engine.Connection) -> pd.DataFrame:
+    def __aggregateMoistureData(
+        self, db: DataService
+    ) -> typing.Tuple[typing.Dict[str, pd.DataFrame], pd.DataFrame]:
         """
         Purpose:
-        Loads the soil moisture data from the soil moisture table
+        Aggregates the soil moisture data by district and each of AGG_DATE_COLS as {period: aggregated data}, along with its districts
 
         Tables:
         - [soil_moisture](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#soil_moisture)
 
         Psuedocode:
         - Create the weather station data SQL query
-        - [Load the data from the database directly into a DataFrame](https://pandas.pydata.org/docs/reference/api/pandas.read_sql.html)
+        - Stream the data from the database in chunks typed as per MOISTURE_DTYPES
+        - For each chunk
+            - Extract the day, month and year from the date and label every row with its week number (for weekly aggregations)
+            - Reduce the chunk into the aggregations by day, week and month (see ChunkAggregator)
+            - Collect its districts (in the order they first appear)
+        - Merge the reduced chunks into the aggregated data
+
+        Remarks: only one chunk is loaded at a time, the data is never held in memory as a whole
         """
         moistureQuery = sq.text(
             f"""
@@ -239,4 +198,29 @@ class MoistureAggregator:
             """
         )
 
-        return pd.read_sql(moistureQuery, conn)
+        aggregators = {
+            period: ChunkAggregator(
+                ["district"] + dateCols, MOISTURE_AGGS, MOISTURE_AGG_COLS
+            )
+            for period, dateCols in AGG_DATE_COLS.items()
+        }
+        calendar = HarvestCalendar()
+        districts = np.array([], dtype=MOISTURE_DTYPES["district"])
+
+        for chunk in db.stream(moistureQuery, dtypes=MOISTURE_DTYPES):
+            dates = pd.to_datetime(chunk["date"])
+            chunk = chunk.drop(columns="date").assign(
+                day=dates.dt.day, month=dates.dt.month, year=dates.dt.year
+            )
+            chunk = calendar.addCalendarAttrs(chunk, {"week": "week"})
+
+            for aggregator in aggregators.values():
+                aggregator.add(chunk)
+
+            districts = pd.unique(np.concatenate([districts, chunk["district"]]))
+
+        aggregates = {
+            period: aggregator.result() for period, aggregator in aggregators.items()
+        }
+
+        return aggregates, pd.DataFrame({"district": districts})
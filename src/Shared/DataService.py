@@ -6,17 +6,106 @@
 # Typical usage example:
 #   db = DataService()
 #   conn = db.connect()
+#   with db.checkout() as conn: ...
 #   db.execute(query: str)
+#   db.bulkWrite(df: pd.DataFrame, table: str)
+#   db.replaceTable(df: pd.DataFrame, table: str, indexes=TABLE_INDEXES[table])
+#   for chunk in db.stream(query, chunkRows: int, dtypes: dict): ...
 #   db.cleanup()
+#
+# Remarks:
+# - Pooled DataServices (DataService(..., pooled=True)) share one engine (and its connection pool) per process and database,
+#   they do not connect until a connection is needed and cleanup returns their connection to the pool instead of closing it
+# - Every query is timed by the shared [queryProfiler](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions/blob/main/src/Shared/queryProfiler.py) while profiling is enabled
 # ----------------------------------------------------
-import atexit
+import pandas as pd
 import sqlalchemy as sq
+import atexit, contextlib, io, os, sys, time, typing
+
+sys.path.append("../")
+from Shared.queryProfiler import PROFILER
+
+
+# The number of rows sent to the database per COPY (bounds the size of the in-memory CSV buffer)
+COPY_CHUNK_ROWS = 100000
+
+# The string used to represent null values in the COPY CSV stream
+COPY_NULL = "\\N"
+
+# The number of rows read from the database per chunk when streaming
+STREAM_CHUNK_ROWS = 100000
+
+# The valid modes for bulkWrite
+WRITE_MODES = ["append", "replace", "upsert"]
+
+# The suffix of the table a replacement is loaded into before it is swapped in (see replaceTable)
+STAGING_SUFFIX = "_staging"
+
+# The index method declaring a unique B-tree index (allows upserting on its columns)
+UNIQUE_METHOD = "unique"
+
+# The maximum length of PostgreSQL identifiers
+MAX_IDENTIFIER_LEN = 63
+
+# The PostgreSQL column types that COPY only accepts whole numbers (without a decimal point) for
+INTEGER_TYPES = ["smallint", "integer", "bigint"]
+
+# The number of connections kept open by a pooled engine
+POOL_SIZE = 5
+
+# The number of connections a pooled engine may open beyond POOL_SIZE when every pooled connection is in use
+POOL_MAX_OVERFLOW = 10
+
+# The engines shared by pooled DataServices keyed by (process id, database URL, pool size, pre-ping)
+ENGINES: typing.Dict[tuple, sq.engine.base.Engine] = {}
+
+
+def disposeEngines():
+    """
+    Purpose:
+    Closes the connections of every pooled engine created by the current process
+
+    Remarks: engines inherited from a parent process are skipped, closing them would close the parent's connections
+    """
+    for key in list(ENGINES.keys()):
+        if key[0] == os.getpid():
+            ENGINES.pop(key).dispose()
+
+
+atexit.register(disposeEngines)  # Ensures that pooled connections eventually closed
+
+
+def indexName(table: str, method: str, cols: typing.List[str]) -> str:
+    """
+    Purpose:
+    Names an index after its table, method and columns (i.e ix_soil_moisture_brin_date)
+    """
+    return f"ix_{table}_{method}_{'_'.join(cols)}"[:MAX_IDENTIFIER_LEN]
+
+
+def createIndexReq(
+    table: str, method: str, cols: typing.List[str], schema: str = "public"
+) -> str:
+    """
+    Purpose:
+    Creates the SQL query to create an index on a table if it does not exist (unexecuted)
+
+    Remarks: method is an index method (i.e btree or brin) or unique (a unique B-tree index)
+    """
+    unique = "UNIQUE " if method == UNIQUE_METHOD else ""
+    using = "btree" if method == UNIQUE_METHOD else method
+
+    return f"""
+    CREATE {unique}INDEX IF NOT EXISTS {indexName(table, method, cols)}
+    ON {schema}.{table} USING {using} ({", ".join(cols)});
+    """
 
 
 class DataService:
     dbURL: str
+    pooled: bool
     engine: sq.engine.base.Engine
-    conn: sq.engine.base.Connection
+    conn: typing.Optional[sq.engine.base.Connection]
 
     def __init__(
         self,
@@ -25,27 +114,65 @@ class DataService:
         port: int = 5432,
         user: str = "postgres",
         pw: str = "password",
+        pooled: bool = False,
+        poolSize: int = POOL_SIZE,
+        prePing: bool = True,
     ):
         self.dbURL: str = f"postgresql://{user}:{pw}@{addr}:{port}/{db}"
-        self.engine: sq.engine.base.Engine = sq.create_engine(self.dbURL)
-        self.conn: sq.engine.base.Connection = self.connect()
-        atexit.register(self.cleanup)  # Ensures that connections eventually closed
+        self.pooled: bool = pooled
+        self.conn: typing.Optional[sq.engine.base.Connection] = None
+
+        if pooled:
+            self.engine = self.__getEngine(poolSize, prePing)
+        else:
+            self.engine = sq.create_engine(self.dbURL)
+            self.conn = self.connect()
+            atexit.register(self.cleanup)  # Ensures that connections eventually closed
+
+        PROFILER.attach(self.engine)
 
     def connect(self) -> sq.engine.base.Connection:
         """
         Purpose:
         Connect to PostgreSQL database
+
+        Remarks: pooled DataServices reuse their connection until it is returned to the pool
         """
+        if self.pooled and self.conn is not None and not self.conn.closed:
+            return self.conn
+
         self.conn = self.engine.connect()
         return self.conn
 
+    @contextlib.contextmanager
+    def checkout(self) -> typing.Iterator[sq.engine.base.Connection]:
+        """
+        Purpose:
+        Borrows a connection from the engine's pool for the duration of a with block
+
+        Pseudocode:
+        - Check out a connection from the pool (pooled engines validate it first with pre-ping)
+        - Hand the connection to the with block
+        - Return the connection to the pool once the with block exits (even if it raised)
+        """
+        conn = self.engine.connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
     def disconnect(self):
         """
         Purpose:
         Disconnect from PostgreSQL database
+
+        Remarks: pooled DataServices return their connection to the pool and keep the shared engine open
         """
-        self.conn.close()
-        self.engine.dispose()
+        if self.conn is not None:
+            self.conn.close()
+
+        if not self.pooled:
+            self.engine.dispose()
 
     def cleanup(self):
         """
@@ -60,4 +187,351 @@ class DataService:
         Purpose:
         Execute a query on the database
         """
-        return self.conn.execute(query)
+        if self.conn is None or self.conn.closed:
+            self.connect()
+
+        return self.conn.execute(query)  # type: ignore
+
+    def bulkWrite(
+        self,
+        df: pd.DataFrame,
+        table: str,
+        mode: str = "append",
+        schema: str = "public",
+        conflictCols: typing.Optional[typing.List[str]] = None,
+        preQueries: typing.Optional[typing.List[str]] = None,
+    ) -> int:
+        """
+        Purpose:
+        Writes a DataFrame to a table using [PostgreSQL COPY](https://www.postgresql.org/docs/current/sql-copy.html) (much faster than DataFrame.to_sql)
+
+        Pseudocode:
+        - Start a transaction (the table is only modified if every step succeeds)
+        - Create the table from the DataFrame's columns if it does not exist (replace drops and recreates it)
+        - Run preQueries (i.e deleting the rows being replaced) so they only take effect along with the new rows
+        - If upserting, create a temporary table shaped like the target table to COPY into
+        - Cast the float columns stored in integer columns of the table to integers (see __castIntegerCols)
+        - Write the DataFrame into an in-memory CSV buffer in chunks of COPY_CHUNK_ROWS rows and stream each chunk with COPY FROM STDIN
+        - If upserting, move the rows from the temporary table into the table, updating the rows that conflict on conflictCols
+
+        Remarks:
+        - mode is one of append, replace or upsert (upsert requires conflictCols to match a unique constraint of the table)
+        - Like DataFrame.to_sql(index=False), the index of the DataFrame is not stored
+        - preQueries run in the same transaction as the COPY, if the write fails (or is interrupted) they are rolled back
+        - Float columns written to integer columns must only hold whole numbers (or nulls), COPY rejects the others
+        - Returns the number of rows written
+        """
+        if mode not in WRITE_MODES:
+            raise ValueError(f"[ERROR] {mode} is an invalid write mode")
+        if mode == "upsert" and not conflictCols:
+            raise ValueError("[ERROR] upserting requires the conflicting columns")
+
+        target = f"{self.__quote(schema)}.{self.__quote(table)}"
+        cols = ", ".join([self.__quote(str(col)) for col in df.columns])
+
+        startTime = time.perf_counter()
+
+        with self.engine.begin() as conn:
+            # creates the table with the same types DataFrame.to_sql would use
+            ifExists = "replace" if mode == "replace" else "append"
+            df.head(0).to_sql(
+                table, conn, schema=schema, if_exists=ifExists, index=False
+            )
+
+            for query in preQueries if preQueries is not None else []:
+                conn.execute(sq.text(query))
+
+            copyTarget = target
+            if mode == "upsert":
+                copyTarget = self.__quote(f"tmp_{table}")
+                conn.execute(
+                    sq.text(
+                        f"""
+                        CREATE TEMP TABLE {copyTarget}
+                        (LIKE {target} INCLUDING DEFAULTS) ON COMMIT DROP;
+                        """
+                    )
+                )
+
+            df = self.__castIntegerCols(conn, df, table, schema)
+            numBytes = self.__copy(conn, df, copyTarget, cols)
+
+            if mode == "upsert":
+                conn.execute(
+                    sq.text(
+                        self.__upsertReq(
+                            target, copyTarget, list(df.columns), conflictCols  # type: ignore
+                        )
+                    )
+                )
+
+        PROFILER.record(
+            f"COPY {copyTarget} ({cols}) FROM STDIN",
+            time.perf_counter() - startTime,
+            len(df.index),
+            numBytes,
+        )
+
+        return len(df.index)
+
+    def replaceTable(
+        self,
+        df: pd.DataFrame,
+        table: str,
+        schema: str = "public",
+        columnTypes: typing.Optional[dict] = None,
+        indexes: typing.Optional[
+            typing.List[typing.Tuple[str, typing.List[str]]]
+        ] = None,
+    ) -> int:
+        """
+        Purpose:
+        Replaces a table with a DataFrame without readers ever finding the table missing or partially written
+
+        Pseudocode:
+        - Start a transaction (the table is only replaced if every step succeeds)
+        - Create a staging table with the declared column types (the types DataFrame.to_sql would use by default)
+        - Stream the DataFrame into the staging table with COPY (see bulkWrite)
+        - Build the indexes of the loaded table (faster than maintaining them while loading)
+        - Refresh the planner statistics of the staging table (kept when it is renamed)
+        - Drop the table and rename the staging table and its indexes in its place
+
+        Remarks:
+        - columnTypes declares the type of columns as SQLAlchemy types (see the dtype parameter of DataFrame.to_sql)
+        - indexes are declared as [(index method, columns)] like the SchemaManager's TABLE_INDEXES
+        - Readers see the old table until the transaction commits, the table is only locked while it is dropped and renamed
+        - The gain over bulkWrite comes from building the indexes after the load and swapping the table in atomically,
+          the rows are written to the WAL like any other COPY
+        - Returns the number of rows written
+        """
+        staging = f"{table}{STAGING_SUFFIX}"[:MAX_IDENTIFIER_LEN]
+        target = f"{self.__quote(schema)}.{self.__quote(table)}"
+        stagingTarget = f"{self.__quote(schema)}.{self.__quote(staging)}"
+        cols = ", ".join([self.__quote(str(col)) for col in df.columns])
+        indexes = indexes if indexes is not None else []
+
+        startTime = time.perf_counter()
+
+        with self.engine.begin() as conn:
+            # creates the staging table (left behind by an interrupted replacement if it exists)
+            df.head(0).to_sql(
+                staging,
+                conn,
+                schema=schema,
+                if_exists="replace",
+                index=False,
+                dtype=columnTypes,
+            )
+
+            df = self.__castIntegerCols(conn, df, staging, schema)
+            numBytes = self.__copy(conn, df, stagingTarget, cols)
+
+            for method, indexCols in indexes:
+                conn.execute(
+                    sq.text(createIndexReq(staging, method, indexCols, schema))
+                )
+
+            conn.execute(sq.text(f"ANALYZE {stagingTarget};"))
+
+            # swaps the tables (the indexes are renamed once the old table's indexes are dropped)
+            conn.execute(sq.text(f"DROP TABLE IF EXISTS {target};"))
+            conn.execute(
+                sq.text(f"ALTER TABLE {stagingTarget} RENAME TO {self.__quote(table)};")
+            )
+            for method, indexCols in indexes:
+                conn.execute(
+                    sq.text(
+                        f"""
+                        ALTER INDEX {self.__quote(schema)}.{indexName(staging, method, indexCols)}
+                        RENAME TO {indexName(table, method, indexCols)};
+                        """
+                    )
+                )
+
+        PROFILER.record(
+            f"COPY {stagingTarget} ({cols}) FROM STDIN",
+            time.perf_counter() - startTime,
+            len(df.index),
+            numBytes,
+        )
+
+        return len(df.index)
+
+    def stream(
+        self,
+        query,
+        chunkRows: int = STREAM_CHUNK_ROWS,
+        dtypes: typing.Optional[dict] = None,
+    ) -> typing.Iterator[pd.DataFrame]:
+        """
+        Purpose:
+        Reads the results of a query in chunks of chunkRows rows (callers that reduce each chunk before reading the next only hold one chunk in memory)
+
+        Pseudocode:
+        - Open a new connection and execute the query on a [server-side (named) cursor](https://docs.sqlalchemy.org/en/14/core/connections.html#using-server-side-cursors-a-k-a-stream-results)
+        - Fetch chunkRows rows at a time
+        - Load each chunk into a DataFrame and cast its columns to the types declared in dtypes (i.e {"year": "int16", "min_temp": "float32"})
+        - Yield each chunk as soon as it is loaded
+
+        Remarks:
+        - At least one chunk is always yielded (empty results yield an empty DataFrame with the query's columns)
+        - Columns that are not declared in dtypes keep the types inferred by pandas, declared columns that are not returned by the query are ignored
+        - Integer types cannot hold nulls, declare nullable columns with a pandas nullable type instead (i.e Int16)
+        """
+        profile = {"seconds": 0.0, "rows": 0, "bytes": 0}
+
+        try:
+            with self.engine.connect() as conn:
+                start = time.perf_counter()
+                results = conn.execution_options(
+                    stream_results=True, max_row_buffer=chunkRows
+                ).execute(query)
+                profile["seconds"] += time.perf_counter() - start
+
+                cols = list(results.keys())
+                colTypes = {
+                    col: dtype for col, dtype in (dtypes or {}).items() if col in cols
+                }
+
+                chunk = self.__fetchChunk(results, cols, colTypes, chunkRows, profile)
+                yield chunk
+
+                while len(chunk.index) == chunkRows:
+                    chunk = self.__fetchChunk(
+                        results, cols, colTypes, chunkRows, profile
+                    )
+                    if len(chunk.index) > 0:
+                        yield chunk
+
+                results.close()
+        finally:
+            PROFILER.record(
+                str(query), profile["seconds"], profile["rows"], profile["bytes"]
+            )
+
+    def __fetchChunk(
+        self, results, cols: list, colTypes: dict, chunkRows: int, profile: dict
+    ) -> pd.DataFrame:
+        """
+        Purpose:
+        Fetches the next chunk of a streamed query as a typed DataFrame and adds its time, rows and size to the profile
+        """
+        start = time.perf_counter()
+        rows = results.fetchmany(chunkRows)
+        chunk = pd.DataFrame.from_records(rows, columns=cols).astype(colTypes)
+
+        profile["seconds"] += time.perf_counter() - start
+        profile["rows"] += len(chunk.index)
+        profile["bytes"] += int(chunk.memory_usage(index=False).sum())
+
+        return chunk
+
+    def __getEngine(self, poolSize: int, prePing: bool) -> sq.engine.base.Engine:
+        """
+        Purpose:
+        Gets the pooled engine of the current process for this database, creating it on first use
+
+        Remarks: engines are keyed by process id since connections cannot be shared with forked processes (i.e multiprocessing workers)
+        """
+        key = (os.getpid(), self.dbURL, poolSize, prePing)
+
+        if key not in ENGINES:
+            ENGINES[key] = sq.create_engine(
+                self.dbURL,
+                pool_size=poolSize,
+                max_overflow=POOL_MAX_OVERFLOW,
+                pool_pre_ping=prePing,
+            )
+
+        return ENGINES[key]
+
+    def __castIntegerCols(
+        self, conn: sq.engine.base.Connection, df: pd.DataFrame, table: str, schema: str
+    ) -> pd.DataFrame:
+        """
+        Purpose:
+        Casts the float columns of a DataFrame that are stored in integer columns of a table to [nullable integers](https://pandas.pydata.org/docs/user_guide/integer_na.html)
+
+        Remarks:
+        - pandas stores integer columns with missing values as floats, which are written as 4.0 (rejected by COPY for integer columns)
+        - Only columns holding whole numbers are cast, the others are left for COPY to reject
+        """
+        query = sq.text(
+            """
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = :schema AND table_name = :table AND data_type = ANY(:types);
+            """
+        )
+        intCols = [
+            row[0]
+            for row in conn.execute(
+                query, {"schema": schema, "table": table, "types": INTEGER_TYPES}
+            )
+        ]
+
+        casts = {}
+        for col in df.columns:
+            if str(col) in intCols and pd.api.types.is_float_dtype(df[col]):
+                values = df[col].dropna()
+                if (values == values.round()).all():
+                    casts[col] = df[col].astype("Int64")
+
+        return df.assign(**casts) if len(casts) > 0 else df
+
+    def __copy(
+        self, conn: sq.engine.base.Connection, df: pd.DataFrame, target: str, cols: str
+    ) -> int:
+        """
+        Purpose:
+        Streams a DataFrame into a table with COPY FROM STDIN in chunks of COPY_CHUNK_ROWS rows, returning the number of bytes sent
+        """
+        numBytes = 0
+
+        cursor = conn.connection.cursor()
+        for start in range(0, len(df.index), COPY_CHUNK_ROWS):
+            buffer = io.StringIO()
+            df.iloc[start : start + COPY_CHUNK_ROWS].to_csv(
+                buffer, index=False, header=False, na_rep=COPY_NULL
+            )
+            numBytes += buffer.tell()
+            buffer.seek(0)
+
+            cursor.copy_expert(
+                f"COPY {target} ({cols}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+                buffer,
+            )
+        cursor.close()
+
+        return numBytes
+
+    def __upsertReq(
+        self, target: str, source: str, cols: list, conflictCols: list
+    ) -> str:
+        """
+        Purpose:
+        Generates a SQL query to move the rows of source into target, updating the rows of target that conflict on conflictCols
+        """
+        colNames = ", ".join([self.__quote(str(col)) for col in cols])
+        keys = ", ".join([self.__quote(str(col)) for col in conflictCols])
+        updates = ", ".join(
+            [
+                f"{self.__quote(str(col))} = EXCLUDED.{self.__quote(str(col))}"
+                for col in cols
+                if col not in conflictCols
+            ]
+        )
+
+        onConflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+
+        return f"""
+        INSERT INTO {target} ({colNames})
+        SELECT {colNames} FROM {source}
+        ON CONFLICT ({keys}) {onConflict};
+        """
+
+    def __quote(self, identifier: str) -> str:
+        """
+        Purpose:
+        Quotes a table/column name so that it can be used in a SQL query (column names such as 01-01:min_temp are not valid otherwise)
+        """
+        return '"' + identifier.replace('"', '""') + '"'
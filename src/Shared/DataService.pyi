@@ -6,15 +6,56 @@
 # Typical usage example:
 #   db = DataService()
 #   conn = db.connect()
+#   with db.checkout() as conn: ...
 #   db.execute(query: str)
+#   db.bulkWrite(df: pd.DataFrame, table: str)
+#   db.replaceTable(df: pd.DataFrame, table: str, indexes=TABLE_INDEXES[table])
+#   for chunk in db.stream(query, chunkRows: int, dtypes: dict): ...
 #   db.cleanup()
+#
+# Remarks:
+# - Pooled DataServices (DataService(..., pooled=True)) share one engine (and its connection pool) per process and database,
+#   they do not connect until a connection is needed and cleanup returns their connection to the pool instead of closing it
+# - Every query is timed by the shared [queryProfiler](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions/blob/main/src/Shared/queryProfiler.py) while profiling is enabled
 # ----------------------------------------------------
+import pandas as pd
 import sqlalchemy as sq
+import typing
+
+ENGINES: typing.Dict[tuple, sq.engine.base.Engine]
+
+def disposeEngines(): ...
+
+# ----------------------------------------------------
+# Purpose:
+# Closes the connections of every pooled engine created by the current process
+#
+# Remarks: engines inherited from a parent process are skipped, closing them would close the parent's connections
+# ----------------------------------------------------
+
+def indexName(table: str, method: str, cols: typing.List[str]) -> str: ...
+
+# ----------------------------------------------------
+# Purpose:
+# Names an index after its table, method and columns (i.e ix_soil_moisture_brin_date)
+# ----------------------------------------------------
+
+def createIndexReq(
+    table: str, method: str, cols: typing.List[str], schema: str = ...
+) -> str: ...
+
+# ----------------------------------------------------
+# Purpose:
+# Creates the SQL query to create an index on a table if it does not exist (unexecuted)
+#
+# Remarks: method is an index method (i.e btree or brin) or unique (a unique B-tree index)
+# ----------------------------------------------------
 
 class DataService:
     dbURL: str
+    pooled: bool
     engine: sq.engine.base.Engine
-    conn: sq.engine.base.Connection
+    conn: typing.Optional[sq.engine.base.Connection]
     def __init__(
         self,
         db: str = ...,
@@ -22,17 +63,35 @@ class DataService:
         port: int = ...,
         user: str = ...,
         pw: str = ...,
+        pooled: bool = ...,
+        poolSize: int = ...,
+        prePing: bool = ...,
     ) -> None: ...
     def connect(self) -> sq.engine.base.Connection: ...
     # ----------------------------------------------------
     # Purpose:
     # Connect to PostgreSQL database
+    #
+    # Remarks: pooled DataServices reuse their connection until it is returned to the pool
+    # ----------------------------------------------------
+
+    def checkout(self) -> typing.ContextManager[sq.engine.base.Connection]: ...
+    # ----------------------------------------------------
+    # Purpose:
+    # Borrows a connection from the engine's pool for the duration of a with block
+    #
+    # Pseudocode:
+    # - Check out a connection from the pool (pooled engines validate it first with pre-ping)
+    # - Hand the connection to the with block
+    # - Return the connection to the pool once the with block exits (even if it raised)
     # ----------------------------------------------------
 
     def disconnect(self): ...
     # ----------------------------------------------------
     # Purpose:
     # Disconnect from PostgreSQL database
+    #
+    # Remarks: pooled DataServices return their connection to the pool and keep the shared engine open
     # ----------------------------------------------------
 
     def cleanup(self): ...
@@ -46,3 +105,86 @@ class DataService:
     # Purpose:
     # Execute a query on the database
     # ----------------------------------------------------
+
+    def bulkWrite(
+        self,
+        df: pd.DataFrame,
+        table: str,
+        mode: str = ...,
+        schema: str = ...,
+        conflictCols: typing.Optional[typing.List[str]] = ...,
+        preQueries: typing.Optional[typing.List[str]] = ...,
+    ) -> int: ...
+    # ----------------------------------------------------
+    # Purpose:
+    # Writes a DataFrame to a table using [PostgreSQL COPY](https://www.postgresql.org/docs/current/sql-copy.html) (much faster than DataFrame.to_sql)
+    #
+    # Pseudocode:
+    # - Start a transaction (the table is only modified if every step succeeds)
+    # - Create the table from the DataFrame's columns if it does not exist (replace drops and recreates it)
+    # - Run preQueries (i.e deleting the rows being replaced) so they only take effect along with the new rows
+    # - If upserting, create a temporary table shaped like the target table to COPY into
+    # - Cast the float columns stored in integer columns of the table to integers (see __castIntegerCols)
+    # - Write the DataFrame into an in-memory CSV buffer in chunks of COPY_CHUNK_ROWS rows and stream each chunk with COPY FROM STDIN
+    # - If upserting, move the rows from the temporary table into the table, updating the rows that conflict on conflictCols
+    #
+    # Remarks:
+    # - mode is one of append, replace or upsert (upsert requires conflictCols to match a unique constraint of the table)
+    # - Like DataFrame.to_sql(index=False), the index of the DataFrame is not stored
+    # - preQueries run in the same transaction as the COPY, if the write fails (or is interrupted) they are rolled back
+    # - Float columns written to integer columns must only hold whole numbers (or nulls), COPY rejects the others
+    # - Returns the number of rows written
+    # ----------------------------------------------------
+
+    def replaceTable(
+        self,
+        df: pd.DataFrame,
+        table: str,
+        schema: str = ...,
+        columnTypes: typing.Optional[dict] = ...,
+        indexes: typing.Optional[
+            typing.List[typing.Tuple[str, typing.List[str]]]
+        ] = ...,
+    ) -> int: ...
+    # ----------------------------------------------------
+    # Purpose:
+    # Replaces a table with a DataFrame without readers ever finding the table missing or partially written
+    #
+    # Pseudocode:
+    # - Start a transaction (the table is only replaced if every step succeeds)
+    # - Create a staging table with the declared column types (the types DataFrame.to_sql would use by default)
+    # - Stream the DataFrame into the staging table with COPY (see bulkWrite)
+    # - Build the indexes of the loaded table (faster than maintaining them while loading)
+    # - Refresh the planner statistics of the staging table (kept when it is renamed)
+    # - Drop the table and rename the staging table and its indexes in its place
+    #
+    # Remarks:
+    # - columnTypes declares the type of columns as SQLAlchemy types (see the dtype parameter of DataFrame.to_sql)
+    # - indexes are declared as [(index method, columns)] like the SchemaManager's TABLE_INDEXES
+    # - Readers see the old table until the transaction commits, the table is only locked while it is dropped and renamed
+    # - The gain over bulkWrite comes from building the indexes after the load and swapping the table in atomically,
+    #   the rows are written to the WAL like any other COPY
+    # - Returns the number of rows written
+    # ----------------------------------------------------
+
+    def stream(
+        self,
+        query,
+        chunkRows: int = ...,
+        dtypes: typing.Optional[dict] = ...,
+    ) -> typing.Iterator[pd.DataFrame]: ...
+    # ----------------------------------------------------
+    # Purpose:
+    # Reads the results of a query in chunks of chunkRows rows (callers that reduce each chunk before reading the next only hold one chunk in memory)
+    #
+    # Pseudocode:
+    # - Open a new connection and execute the query on a [server-side (named) cursor](https://docs.sqlalchemy.org/en/14/core/connections.html#using-server-side-cursors-a-k-a-stream-results)
+    # - Fetch chunkRows rows at a time
+    # - Load each chunk into a DataFrame and cast its columns to the types declared in dtypes (i.e {"year": "int16", "min_temp": "float32"})
+    # - Yield each chunk as soon as it is loaded
+    #
+    # Remarks:
+    # - At least one chunk is always yielded (empty results yield an empty DataFrame with the query's columns)
+    # - Columns that are not declared in dtypes keep the types inferred by pandas, declared columns that are not returned by the query are ignored
+    # - Integer types cannot hold nulls, declare nullable columns with a pandas nullable type instead (i.e Int16)
+    # ----------------------------------------------------
@@ -17,4 +17,5 @@ class GenericQueryBuilder:
     #
     # Pseudocode:
     # - Check results has an attribute called [first](https://docs.sqlalchemy.org/en/14/orm/query.html#sqlalchemy.orm.Query.first)
+    # - Read the boolean returned by the query (a row is always returned, even if the table does not exist)
     # ----------------------------------------------------
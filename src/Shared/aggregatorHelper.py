@@ -9,7 +9,11 @@
 #   data = helper.reshapeDataByDates(dates, aggDF, df, "dates")
 # ----------------------------------------------------
 import pandas as pd
-import calendar
+import numpy as np
+import calendar, sys
+
+sys.path.append("../")
+from Shared.harvestCalendar import HARVEST_MONTH, HARVEST_WEEK
 
 
 MIN_MONTH = 1  # The month to start aggregating on
@@ -84,27 +88,35 @@ class AggregatorHelper:
         Reshapes columns of data by date (day, week or month) by the full year or harvest (as indicated by the byHarvest flag)
 
         Pseudocode:
-        - Calculate the yera range
+        - Calculate the year range
         - Gather all the unique districts
         - Collect the aggregated column names in a list
         - Remove the irrelevant columns (these are the columns we wont want to appear once our data has been reshaped)
-        - Collect the row of data that is relevant to the current date, district combination
-        - Grab all attributes and establish them as key in a dictionary i.e {"DATE:attribute": value}
-        - Once finished for the current date, district combination, store the dictionary into a list
+        - Encode each date and each row of agg_df as an integer key (MO-DA -> MO * 100 + DA, W -> W, M -> M)
+        - Calculate the output row (year, district) and output date slot of every row of agg_df in one vectorized pass
+            - If byHarvest, fall/winter rows are moved to the following year so that they apply to the following harvest
+        - Discard rows that fall outside the output (unknown district/date or year out of range) and ambiguous rows (more than one per cell)
+        - Scatter the remaining values into a preallocated block of zeros shaped (year/district, date, attribute)
+        - Flatten the block into the DATE:attribute columns
 
         Remark: for this function to work correctly the following columns must be present given their dateType
         - dateType=dates: year, district and month, day
         - dateType=weeks: year, district and week
         - dateType=months: year, district and month
 
-        Also note that we use a list of dictionaries since it is much faster to do so as opposed to the number of DataFrame manipulations we'd require otherwise
+        Cells without exactly one matching row in agg_df default to zero, columns that only hold defaults are stored as integers
         """
-        listForDF = []  # used for faster data processing
+        if dateType not in ("dates", "weeks", "months"):
+            raise ValueError(f"[ERROR] {dateType} is an invalid datetype")
 
         # the year range we want to pull data from - ints
-        years = [year for year in range(MIN_YEAR, MAX_YEAR + 1)]
+        years = np.arange(MIN_YEAR, MAX_YEAR + 1)
         uniqueDistricts = data["district"].unique()
 
+        numRows = len(years) * len(uniqueDistricts)
+        if numRows == 0:
+            return pd.DataFrame()
+
         # get the columns we will want to pull information from
         cols = agg_df.columns.tolist()  # type: ignore
         cols.remove("district")
@@ -118,120 +130,97 @@ class AggregatorHelper:
         elif dateType == "months":
             cols.remove("month")
 
-        for year in years:
-            print(f"Processing year: {year}")
-
-            for district in uniqueDistricts:
-                currData = {}  # for each year/district combination create a dictionary
-
-                # adds the year and district
-                currData["year"] = year
-                currData["district"] = district
-
-                # for each day we want to grab all attributes and establish them as columns i.e DATE:attribute
-                for date in dates:
-                    currRow = None
-
-                    if dateType == "dates":
-                        currRow = self.__getDataPerDates(
-                            year, district, date, agg_df, byHarvest
-                        )
-                    elif dateType == "weeks":
-                        currRow = self.__getDataPerWeeks(
-                            year, district, date, agg_df, byHarvest
-                        )
-                    elif dateType == "months":
-                        currRow = self.__getDataPerMonths(
-                            year, district, date, agg_df, byHarvest
-                        )
-                    else:
-                        raise ValueError(f"[ERROR] {dateType} is an invalid datetype")
-
-                    for col in cols:  # parse each of the desired columns
-                        currAttr = f"{date}:{col}"  # the current attribute which corresponds to the date and the column
-                        currVal = 0  # defaults as zero incase it does not exist
-
-                        if len(currRow[col]) == 1:
-                            # the current value from the loaded data
-                            currVal = currRow[col].item()
-
-                        currData[currAttr] = currVal
-
-                listForDF.append(currData)
-
-        return pd.DataFrame(listForDF)
-
-    def __getDataPerDates(self, year, district, date, agg_df, byHarvest):
+        dateKeys = np.array([self.__getDateKey(date, dateType) for date in dates])
+        rowKeys = self.__getRowKeys(agg_df, dateType)
+
+        # moves the fall/winter data to the next year so that it applies to the current harvest
+        rowYears = agg_df["year"].to_numpy(dtype=np.int64)
+        if byHarvest:
+            rowYears = rowYears + (rowKeys >= self.__getHarvestKey(dateType))
+
+        yearIdx = rowYears - MIN_YEAR
+        districtIdx = pd.Index(uniqueDistricts).get_indexer(agg_df["district"])
+        dateIdx = pd.Index(dateKeys).get_indexer(rowKeys)
+
+        valid = (
+            (yearIdx >= 0)
+            & (yearIdx < len(years))
+            & (districtIdx >= 0)
+            & (dateIdx >= 0)
+        )
+
+        rowIdx = yearIdx[valid] * len(uniqueDistricts) + districtIdx[valid]
+        dateIdx = dateIdx[valid]
+
+        # a cell is only filled when exactly one row matches it
+        cellIdx = pd.Series(rowIdx * len(dates) + dateIdx)
+        unique = ~cellIdx.duplicated(keep=False).to_numpy()
+        rowIdx = rowIdx[unique]
+        dateIdx = dateIdx[unique]
+
+        values = agg_df[cols].to_numpy()[valid][unique]
+        block = np.zeros((numRows, len(dates), len(cols)), dtype=values.dtype)
+        block[rowIdx, dateIdx] = values
+
+        attrs = [f"{date}:{col}" for date in dates for col in cols]
+        attrs_df = pd.DataFrame(block.reshape(numRows, -1), columns=attrs)
+
+        # columns with no values (all defaults) or integer values are kept as integers
+        filled = np.zeros((len(dates), len(cols)), dtype=bool)
+        filled[dateIdx] = True
+        isInt = np.array([pd.api.types.is_integer_dtype(agg_df[col]) for col in cols])
+        intAttrs = np.array(attrs)[(~filled | isInt).ravel()]
+        if len(intAttrs) > 0:
+            attrs_df = attrs_df.astype({attr: np.int64 for attr in intAttrs})
+
+        keys_df = pd.DataFrame(
+            {
+                "year": np.repeat(years, len(uniqueDistricts)),
+                "district": np.tile(uniqueDistricts, len(years)),
+            }
+        )
+        final_df = pd.concat([keys_df, attrs_df], axis=1)
+
+        return final_df
+
+    def __getDateKey(self, date: str, dateType: str) -> int:
         """
         Purpose:
-        Get the data for a given date
+        Encodes a date (MO-DA, W or M) as an integer key
 
         Psuedocode:
-        - Get the different date components (format is MO-DA)
+        - Get the different date components (format is MO-DA, W or M)
         - Convert them to integers
-        - If the date is from the fall, change it to the fall/winter of the previous year so that it applies to the current harvest
+        - Combine the month and day as MO * 100 + DA
         """
-        dateComponents = date.split("-")
-        monthInt = int(dateComponents[0])
-        dayInt = int(dateComponents[1])
-
-        if byHarvest and monthInt >= 9:
-            return agg_df.loc[
-                (agg_df["year"] == year - 1)
-                & (agg_df["month"] == monthInt)
-                & (agg_df["day"] == dayInt)
-                & (agg_df["district"] == district)
-            ]
-        else:
-            return agg_df.loc[
-                (agg_df["year"] == year)
-                & (agg_df["month"] == monthInt)
-                & (agg_df["day"] == dayInt)
-                & (agg_df["district"] == district)
-            ]
-
-    def __getDataPerWeeks(self, year, district, week, agg_df, byHarvest):
+        if dateType == "dates":
+            dateComponents = str(date).split("-")
+            return int(dateComponents[0]) * 100 + int(dateComponents[1])
+
+        return int(date)
+
+    def __getRowKeys(self, agg_df: pd.DataFrame, dateType: str) -> np.ndarray:
         """
         Purpose:
-        Get the data for a given date
-
-        Psuedocode:
-        - Get the different date components (format is W)
-        - Convert them to integers
-        - If the date is from the fall/winter, change it to the fall/winter of the previous year so that it applies to the current harvest
+        Encodes the date of every row of agg_df as an integer key (matches __getDateKey)
         """
-        if byHarvest and int(week) >= 33:
-            return agg_df.loc[
-                (agg_df["year"] == int(year) - 1)
-                & (agg_df["week"] == int(week))
-                & (agg_df["district"] == int(district))
-            ]
-        else:
-            return agg_df.loc[
-                (agg_df["year"] == int(year))
-                & (agg_df["week"] == int(week))
-                & (agg_df["district"] == int(district))
-            ]
-
-    def __getDataPerMonths(self, year, district, month, agg_df, byHarvest):
+        if dateType == "dates":
+            return agg_df["month"].to_numpy(dtype=np.int64) * 100 + agg_df[
+                "day"
+            ].to_numpy(dtype=np.int64)
+        elif dateType == "weeks":
+            return agg_df["week"].to_numpy(dtype=np.int64)
+
+        return agg_df["month"].to_numpy(dtype=np.int64)
+
+    def __getHarvestKey(self, dateType: str) -> int:
         """
         Purpose:
-        Get the data for a given date
-
-        Psuedocode:
-        - Get the different date components (format is M)
-        - Convert them to integers
-        - If the date is from the fall/winter, change it to the fall/winter of the previous year so that it applies to the current harvest
+        Gets the first key (matches __getDateKey) which belongs to the fall/winter of the previous harvest
         """
-        if byHarvest and int(month) >= 9:
-            return agg_df.loc[
-                (agg_df["year"] == int(year) - 1)
-                & (agg_df["month"] == int(month))
-                & (agg_df["district"] == int(district))
-            ]
-        else:
-            return agg_df.loc[
-                (agg_df["year"] == int(year))
-                & (agg_df["month"] == int(month))
-                & (agg_df["district"] == int(district))
-            ]
+        if dateType == "dates":
+            return HARVEST_MONTH * 100 + 1
+        elif dateType == "weeks":
+            return HARVEST_WEEK
+
+        return HARVEST_MONTH
@@ -46,25 +46,28 @@ class AggregatorHelper:
         agg_df: pd.DataFrame,
         data: pd.DataFrame,
         dateType: str,
-        bySeason: bool = ...,
+        byHarvest: bool = ...,
     ) -> pd.DataFrame: ...
     # ----------------------------------------------------
     # Purpose:
-    # Reshapes columns of data by date (day, week or month)
+    # Reshapes columns of data by date (day, week or month) by the full year or harvest (as indicated by the byHarvest flag)
     #
     # Pseudocode:
-    # - Calculate the yera range
+    # - Calculate the year range
     # - Gather all the unique districts
     # - Collect the aggregated column names in a list
     # - Remove the irrelevant columns (these are the columns we wont want to appear once our data has been reshaped)
-    # - Collect the row of data that is relevant to the current date, district combination
-    # - Grab all attributes and establish them as key in a dictionary i.e {"DATE:attribute": value}
-    # - Once finished for the current date, district combination, store the dictionary into a list
+    # - Encode each date and each row of agg_df as an integer key (MO-DA -> MO * 100 + DA, W -> W, M -> M)
+    # - Calculate the output row (year, district) and output date slot of every row of agg_df in one vectorized pass
+    #     - If byHarvest, fall/winter rows are moved to the following year so that they apply to the following harvest
+    # - Discard rows that fall outside the output (unknown district/date or year out of range) and ambiguous rows (more than one per cell)
+    # - Scatter the remaining values into a preallocated block of zeros shaped (year/district, date, attribute)
+    # - Flatten the block into the DATE:attribute columns
     #
     # Remark: for this function to work correctly the following columns must be present given their dateType
     # - dateType=dates: year, district and month, day
     # - dateType=weeks: year, district and week
     # - dateType=months: year, district and month
     #
-    # Also note that we use a list of dictionaries since it is much faster to do so as opposed to the number of DataFrame manipulations we'd require otherwise
+    # Cells without exactly one matching row in agg_df default to zero, columns that only hold defaults are stored as integers
     # ----------------------------------------------------
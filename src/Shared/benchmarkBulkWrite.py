@@ -0,0 +1,112 @@
+# ----------------------------------------------------
+# benchmarkBulkWrite.py
+#
+# Compares the time taken to store a DataFrame with DataFrame.to_sql against DataService.bulkWrite (COPY)
+#
+# Typical usage example:
+#   python benchmarkBulkWrite.py [number of rows]
+#
+# Remarks:
+# - Uses the database specified in the docker folder's .env, only run this against a local/development database
+# - The synthetic data is shaped like agg_day_copernicus_satellite_data (5 key columns and 54 attributes)
+# - The benchmark tables are dropped once the benchmark completes
+# ----------------------------------------------------
+from dotenv import load_dotenv
+import sqlalchemy as sq
+import pandas as pd
+import numpy as np
+import os, sys, time
+
+try:
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+except:
+    pass
+
+sys.path.append("../")
+from Shared.DataService import DataService
+
+
+NUM_ROWS = 100000  # The default number of rows to store
+NUM_ATTRS = 54  # The number of float attributes per row
+
+TO_SQL_TABLE = "benchmark_to_sql"  # The table written to by DataFrame.to_sql
+# The table written to by DataService.bulkWrite
+BULK_WRITE_TABLE = "benchmark_bulk_write"
+
+
+# Load the database connection environment variables located in the docker folder
+load_dotenv("../docker/.env")
+PG_DB = os.getenv("POSTGRES_DB")
+PG_ADDR = os.getenv("POSTGRES_ADDR")
+PG_PORT = os.getenv("POSTGRES_PORT")
+PG_USER = os.getenv("POSTGRES_USER")
+PG_PW = os.getenv("POSTGRES_PW")
+
+
+def main():
+    if (
+        PG_DB is None
+        or PG_ADDR is None
+        or PG_PORT is None
+        or PG_USER is None
+        or PG_PW is None
+    ):
+        raise ValueError("Environment variables not set")
+
+    numRows = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_ROWS
+
+    db = DataService(PG_DB, PG_ADDR, int(PG_PORT), PG_USER, PG_PW)
+    conn = db.connect()
+    df = createData(numRows)
+
+    start = time.perf_counter()
+    df.to_sql(TO_SQL_TABLE, conn, schema="public", if_exists="replace", index=False)
+    toSqlTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    db.bulkWrite(df, BULK_WRITE_TABLE, "replace")
+    bulkWriteTime = time.perf_counter() - start
+
+    for table in [TO_SQL_TABLE, BULK_WRITE_TABLE]:
+        db.execute(sq.text(f"DROP TABLE IF EXISTS public.{table}; COMMIT;"))
+
+    db.cleanup()
+
+    print(f"Stored {numRows} rows x {len(df.columns)} columns")
+    print(
+        f"\tDataFrame.to_sql:       {toSqlTime:.2f}s ({numRows / toSqlTime:.0f} rows/s)"
+    )
+    print(
+        f"\tDataService.bulkWrite:  {bulkWriteTime:.2f}s ({numRows / bulkWriteTime:.0f} rows/s)"
+    )
+    print(f"\tSpeedup:                {toSqlTime / bulkWriteTime:.1f}x")
+
+
+def createData(numRows: int) -> pd.DataFrame:
+    """
+    Purpose:
+    Creates a synthetic DataFrame shaped like the aggregated Copernicus data
+
+    Pseudocode:
+    - Create the key columns (year, month, day, cr_num and district)
+    - Create the attribute columns filled with random floats
+    """
+    rng = np.random.default_rng(0)
+
+    df = pd.DataFrame()
+    df["year"] = rng.integers(1995, 2024, numRows)
+    df["month"] = rng.integers(1, 13, numRows)
+    df["day"] = rng.integers(1, 29, numRows)
+    df["cr_num"] = rng.integers(1, 20, numRows)
+    df["district"] = df["cr_num"] + 4600
+
+    attrs = pd.DataFrame(
+        rng.random((numRows, NUM_ATTRS)),
+        columns=[f"attr_{i}" for i in range(NUM_ATTRS)],
+    )
+
+    return pd.concat([df, attrs], axis=1)
+
+
+if __name__ == "__main__":
+    main()
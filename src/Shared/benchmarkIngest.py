@@ -0,0 +1,511 @@
+# ----------------------------------------------------
+# benchmarkIngest.py
+#
+# Measures the throughput of the scrapers end-to-end (download, preprocessing and storage) against local stand-ins
+# for the external data services (see stubServices.py), reporting requests/s, rows/s and CPU time per row
+#   - daily weather station data: scrapeDaily.pullStation
+#   - hourly weather station data: scrapeHourlyParallel.pullStationYear (on a pool of workers)
+#   - Copernicus satellite data: pullCopernicusData's request pipeline (only with recorded fixtures)
+#
+# Typical usage example:
+#   python benchmarkIngest.py [number of stations] [latency in seconds] [error rate]
+#
+#   # to replay downloads recorded from the real services (RAW_ARCHIVE_DIR while scraping)
+#   BENCHMARK_FIXTURES_DIR=/path/to/raw/archive python benchmarkIngest.py 0 0.05 0.01
+#
+# Remarks:
+# - Uses the database specified in the docker folder's .env, only run this against a local/development database
+# - Without recorded fixtures, synthetic fixtures shaped like the real files are created (a year of daily and hourly
+#   data per station, under station IDs starting with BENCH), the Copernicus benchmark needs recorded NetCDF files
+# - Rows are counted as stored (the hourly data is stored as daily aggregates)
+# - CPU time includes the worker processes but not the stub server, which runs in its own process
+# - The benchmark tables (and the changes recorded for them) are dropped and the ledger rows of the benchmarked stations
+#   restored once the benchmark completes
+# ----------------------------------------------------
+from dotenv import load_dotenv
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
+import sqlalchemy as sq
+import pandas as pd
+import numpy as np
+import calendar, json, os, shutil, sys, tempfile, time, typing
+
+try:
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+except:
+    pass
+
+sys.path.append("../")
+sys.path.append("../WeatherStation")
+sys.path.append("../SatelliteCopernicus")
+from Shared.DataService import DataService
+from Shared.rateLimiter import RateLimiter, shareLimiter
+from Shared.rawArchive import RawArchive, ARCHIVE_DIR_ENV
+from Shared.stubServices import StubServer, StubClient
+from Shared.cdsPipeline import CDSPipeline
+from ClimateDataRequester import ClimateDataRequester, PAGE_SIZE  # type: ignore
+from ClimateDataRequester import DAILY_URL, HOURLY_URL, DAILY_URL_ENV, HOURLY_URL_ENV  # type: ignore
+from ClimateDataRequester import DAILY_SOURCE, HOURLY_SOURCE, LISTING_SOURCE  # type: ignore
+from WeatherQueryBuilder import WeatherQueryBuilder, CHANGES_TABLE  # type: ignore
+from scrapingProcessor import ScrapingProcessor, DAILY_SCHEMA, HOURLY_SCHEMA  # type: ignore
+import scrapeDaily, scrapeHourlyParallel  # type: ignore
+
+
+NUM_STATIONS = 10  # The default number of synthetic stations
+LATENCY = 0  # The default number of seconds added to every request
+ERROR_RATE = 0  # The default fraction of requests failing
+
+# The environment variable holding the raw archive to replay (synthetic fixtures are created otherwise)
+FIXTURES_ENV = "BENCHMARK_FIXTURES_DIR"
+
+NUM_WORKERS = 4  # The number of workers pulling hourly/Copernicus data
+REQUEST_RATE = 1000  # The number of requests per second (high enough not to slow down the scrapers)
+MAX_CONCURRENT = 4  # The number of requests sent at once
+POLL_INTERVAL = (
+    0.05  # The number of seconds between polls of the queued Copernicus requests
+)
+
+PROVINCE = "AB"  # The province of the synthetic stations
+STATION_PREFIX = "BENCH"  # The start of the synthetic station IDs
+YEAR = 2022  # The year of synthetic data
+MISSING_RATE = 0.05  # The fraction of missing values in the synthetic data
+
+# Columns of the real files that are not kept (the scrapers should skip them)
+DAILY_EXTRA_COLS = [
+    "Longitude (x)",
+    "Latitude (y)",
+    "Heat Deg Days (°C)",
+    "Cool Deg Days (°C)",
+    "Spd of Max Gust (km/h)",
+]
+HOURLY_EXTRA_COLS = ["x", "y", "WIND_DIRECTION", "WIND_SPEED", "WINDCHILL"]
+
+# The tables written to by the benchmarks
+DAILY_TABLE = "benchmark_dly_station_data"
+HOURLY_TABLE = "benchmark_hly_station_data"
+COPERNICUS_TABLE = "benchmark_copernicus_data"
+
+# The source the Copernicus downloads are archived under (pullCopernicusData.ARCHIVE_SOURCE, imported only when needed)
+COPERNICUS_SOURCE = "era5-land"
+
+
+# Load the database connection environment variables located in the docker folder
+load_dotenv("../docker/.env")
+PG_DB = os.getenv("POSTGRES_DB")
+PG_ADDR = os.getenv("POSTGRES_ADDR")
+PG_PORT = os.getenv("POSTGRES_PORT")
+PG_USER = os.getenv("POSTGRES_USER")
+PG_PW = os.getenv("POSTGRES_PW")
+
+
+def main():
+    if (
+        PG_DB is None
+        or PG_ADDR is None
+        or PG_PORT is None
+        or PG_USER is None
+        or PG_PW is None
+    ):
+        raise ValueError("Environment variables not set")
+
+    numStations = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_STATIONS
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else LATENCY
+    errorRate = float(sys.argv[3]) if len(sys.argv) > 3 else ERROR_RATE
+
+    # Replays the recorded downloads if provided, otherwise creates synthetic ones
+    fixturesDir = os.getenv(FIXTURES_ENV)
+    tempDir = None
+    if fixturesDir:
+        archive = RawArchive(fixturesDir)
+    else:
+        tempDir = tempfile.mkdtemp()
+        archive = RawArchive(tempDir)
+        createFixtures(archive, numStations)
+
+    # The benchmark's downloads are not archived (the scrapers would otherwise archive them from the .env settings)
+    os.environ.pop(ARCHIVE_DIR_ENV, None)
+
+    db = DataService(PG_DB, PG_ADDR, int(PG_PORT), PG_USER, PG_PW)
+    results = []
+
+    # The scrapers record the station days they store as changed
+    db.execute(sq.text(WeatherQueryBuilder().createChangesTableReq()))
+
+    try:
+        with StubServer(archive, latency, errorRate) as server:
+            # Points the requesters to the stub server (the paths of the real services are kept)
+            os.environ[DAILY_URL_ENV] = DAILY_URL.replace(
+                originOf(DAILY_URL), server.url
+            )
+            os.environ[HOURLY_URL_ENV] = HOURLY_URL.replace(
+                originOf(HOURLY_URL), server.url
+            )
+
+            results.append(
+                measure(
+                    "scrapeDaily",
+                    server.getRequestCount,
+                    lambda: benchmarkDaily(archive, db),
+                )
+            )
+            results.append(
+                measure(
+                    "scrapeHourlyParallel",
+                    server.getRequestCount,
+                    lambda: benchmarkHourly(archive, db),
+                )
+            )
+
+        if len(archive.entries(COPERNICUS_SOURCE)) > 0:
+            client = StubClient(archive, COPERNICUS_SOURCE, latency, errorRate)
+            results.append(
+                measure(
+                    "pullSatelliteData",
+                    client.getRequestCount,
+                    lambda: benchmarkCopernicus(archive, client, db),
+                )
+            )
+    finally:
+        for table in [DAILY_TABLE, HOURLY_TABLE, COPERNICUS_TABLE]:
+            db.execute(sq.text(f"DROP TABLE IF EXISTS public.{table}; COMMIT;"))
+        query = f"DELETE FROM public.{CHANGES_TABLE} WHERE source_table IN ('{DAILY_TABLE}', '{HOURLY_TABLE}'); COMMIT;"
+        db.execute(sq.text(query))
+        db.cleanup()
+
+        if tempDir is not None:
+            shutil.rmtree(tempDir)
+
+    print(
+        f"Pulled data through the stub services ({latency * 1000:.0f}ms latency, {errorRate:.0%} of requests failing)"
+    )
+    for name, numRequests, numErrors, numRows, elapsed, cpu in results:
+        print(
+            f"\t{name + ':':<22} {numRequests / elapsed:.1f} requests/s, {numRows / elapsed:.0f} rows/s, "
+            f"{cpu / max(numRows, 1) * 1e6:.0f}µs CPU/row ({numRequests} requests, {numErrors} failed, {numRows} rows in {elapsed:.2f}s)"
+        )
+
+
+def measure(
+    name: str, getRequestCount: typing.Callable, func: typing.Callable
+) -> typing.Tuple[str, int, int, int, float, float]:
+    """
+    Purpose:
+    Runs a benchmark, returning its name, the number of requests sent (and failed), the number of rows stored,
+    the elapsed time and the CPU time
+
+    Remarks: the CPU time of the child processes is only counted once they have exited (the pools are closed within func)
+    """
+    startRequests, startErrors = getRequestCount()
+    startTimes = os.times()
+    start = time.perf_counter()
+
+    numRows = func()
+
+    elapsed = time.perf_counter() - start
+    endTimes = os.times()
+    endRequests, endErrors = getRequestCount()
+
+    # user, system, children user and children system
+    cpu = sum(endTimes[:4]) - sum(startTimes[:4])
+
+    return (
+        name,
+        endRequests - startRequests,
+        endErrors - startErrors,
+        numRows,
+        elapsed,
+        cpu,
+    )
+
+
+def benchmarkDaily(archive: RawArchive, db: DataService) -> int:
+    """
+    Purpose:
+    Pulls the daily data of every archived station as scrapeDaily does, returning the number of rows stored
+
+    Pseudocode:
+    - List the archived stations and the years of their daily files
+    - Pull and store every station one after the other (as scrapeDaily does) within a single requester
+    """
+    db.execute(sq.text(f"DROP TABLE IF EXISTS public.{DAILY_TABLE}; COMMIT;"))
+
+    requester = ClimateDataRequester(RateLimiter(REQUEST_RATE, MAX_CONCURRENT))
+    processor = ScrapingProcessor()
+    readOptions = processor.readOptions(DAILY_SCHEMA)
+
+    numRows = 0
+    for _, row in getDailyStations(archive).iterrows():
+        _, stationRows = scrapeDaily.pullStation(
+            row["province"], row, DAILY_TABLE, requester, processor, db, readOptions
+        )
+        numRows += stationRows
+
+    return numRows
+
+
+def benchmarkHourly(archive: RawArchive, db: DataService) -> int:
+    """
+    Purpose:
+    Pulls every archived hourly station year on a pool of workers as scrapeHourlyParallel does, returning the number of rows stored
+
+    Pseudocode:
+    - List the archived station years
+    - Create the benchmark table and save the ledger rows of the stations (pulling them marks the ledger)
+    - Pull every station year on a pool of workers sharing a rate limiter
+    - Restore the ledger rows of the stations
+    """
+    queryHandler = WeatherQueryBuilder()
+    tasks = scrapeHourlyParallel.getArchivedYears(archive)
+    if len(tasks) == 0:
+        return 0
+
+    stationIDs = ", ".join(
+        f"'{stationID}'" for stationID in {task[0] for task in tasks}
+    )
+
+    db.execute(sq.text(f"DROP TABLE IF EXISTS public.{HOURLY_TABLE}; COMMIT;"))
+    db.execute(sq.text(queryHandler.createHrlyProvStationTableReq(HOURLY_TABLE)))
+
+    query = sq.text(queryHandler.tableExistsReq(scrapeHourlyParallel.LEDGER_TABLE))
+    if not queryHandler.readTableExists(db.execute(query)):
+        db.execute(sq.text(queryHandler.createHlyLedgerTableReq()))
+
+    ledgerQuery = f"FROM public.{scrapeHourlyParallel.LEDGER_TABLE} WHERE station_id IN ({stationIDs})"
+    with db.checkout() as conn:
+        ledger = pd.read_sql(sq.text(f"SELECT * {ledgerQuery}"), conn)
+
+    limiter = RateLimiter(REQUEST_RATE, MAX_CONCURRENT)
+
+    try:
+        with ProcessPoolExecutor(
+            NUM_WORKERS, initializer=shareLimiter, initargs=(limiter,)
+        ) as executor:
+            futures = [
+                executor.submit(
+                    scrapeHourlyParallel.pullStationYear, HOURLY_TABLE, stationID, year
+                )
+                for stationID, year in sorted(tasks)
+            ]
+
+            numRows = sum(future.result()[1] for future in futures)
+    finally:
+        db.execute(sq.text(f"DELETE {ledgerQuery}; COMMIT;"))
+        if len(ledger.index) > 0:
+            db.bulkWrite(ledger, scrapeHourlyParallel.LEDGER_TABLE)
+
+    return numRows
+
+
+def benchmarkCopernicus(
+    archive: RawArchive, client: StubClient, db: DataService
+) -> int:
+    """
+    Purpose:
+    Pulls every archived Copernicus request as pullCopernicusData does, returning the number of rows stored
+
+    Pseudocode:
+    - Point pullCopernicusData to the benchmark table
+    - Recreate the archived requests from their periods (one job per request, see pullCopernicusData.planRequests)
+    - Queue every request on the stub client without blocking, processing the downloads on a pool of workers (see CDSPipeline)
+    - Count the rows stored
+
+    Remarks: pullCopernicusData is only imported here, as it needs the NetCDF dependencies (xarray and cdsapi)
+    """
+    import pullCopernicusData  # type: ignore
+
+    pullCopernicusData.TABLE = COPERNICUS_TABLE
+    db.execute(sq.text(f"DROP TABLE IF EXISTS public.{COPERNICUS_TABLE}; COMMIT;"))
+
+    with db.checkout() as conn:
+        agRegions = pullCopernicusData.loadGeometry(conn)
+
+    # periods are stored as year-months-days (i.e 2022-7,8-1,2,3)
+    jobs = []
+    for entry in sorted(archive.entries(COPERNICUS_SOURCE), key=lambda e: e["period"]):
+        year, months, days = [part.split(",") for part in entry["period"].split("-")]
+        outputFile = f"data/benchmark_{year[0]}_{months[0]}_{days[0]}"
+        request = pullCopernicusData.buildRequest(year[0], months, days)
+        args = (agRegions, year[0], months, days, outputFile)
+        jobs.append((request, f"{outputFile}.netcdf.zip", args))
+
+    limiter = RateLimiter(REQUEST_RATE, MAX_CONCURRENT)
+    pool = mp.Pool(NUM_WORKERS, initializer=shareLimiter, initargs=(limiter,))
+    pipeline = CDSPipeline(
+        client,
+        pullCopernicusData.DATASET,
+        limiter,
+        pullCopernicusData.MAX_QUEUED,
+        POLL_INTERVAL,
+    )
+    pipeline.run(jobs, pool, pullCopernicusData.processDownload)
+    pool.close()
+    pool.join()
+
+    query = sq.text(f"SELECT COUNT(*) FROM public.{COPERNICUS_TABLE}")
+    with db.checkout() as conn:
+        return int(conn.execute(query).scalar())
+
+
+def getDailyStations(archive: RawArchive) -> pd.DataFrame:
+    """
+    Purpose:
+    Lists the stations of the archived daily files, shaped like the stations scrapeDaily pulls
+
+    Remarks: every station is pulled as if it was never pulled before (between the first and last year of its files)
+    """
+    years: typing.Dict[typing.Tuple[str, str], list] = {}
+    for entry in archive.entries(DAILY_SOURCE):
+        # The province is part of the file name (i.e climate_daily_AB_3010010_2004-07_P1D.csv)
+        province = entry["name"].split("/")[-1].split("_")[2]
+        years.setdefault((province, entry["key"]), []).append(int(entry["period"][:4]))
+
+    return pd.DataFrame(
+        [
+            {
+                "province": province,
+                "station_id": stationID,
+                "dly_first_year": min(stationYears),
+                "dly_last_year": max(stationYears),
+                "last_updated": None,
+            }
+            for (province, stationID), stationYears in sorted(years.items())
+        ],
+        columns=[
+            "province",
+            "station_id",
+            "dly_first_year",
+            "dly_last_year",
+            "last_updated",
+        ],
+    )
+
+
+def createFixtures(archive: RawArchive, numStations: int):
+    """
+    Purpose:
+    Archives synthetic downloads for numStations stations, named after the URLs of the real services
+
+    Pseudocode:
+    - For every station
+        - Archive a daily file per month of YEAR
+        - Archive the number of hourly rows of YEAR and the pages of hourly data
+    - Archive the province's listing of daily files
+    """
+    rng = np.random.default_rng(0)
+    requester = ClimateDataRequester()
+    fileNames = []
+
+    for i in range(numStations):
+        stationID = f"{STATION_PREFIX}{i:05d}"
+
+        for month in range(1, 13):
+            fileName = (
+                f"climate_daily_{PROVINCE}_{stationID}_{YEAR}-{month:02d}_P1D.csv"
+            )
+            days = pd.date_range(
+                f"{YEAR}-{month:02d}-01",
+                periods=calendar.monthrange(YEAR, month)[1],
+                freq="D",
+            )
+            df = createData(
+                DAILY_SCHEMA, DAILY_EXTRA_COLS, stationID, days, "%Y-%m-%d", rng
+            )
+
+            url = requester.listing_url(PROVINCE) + fileName
+            archive.put(
+                df.to_csv(index=False).encode("ISO-8859-1"),
+                DAILY_SOURCE,
+                stationID,
+                f"{YEAR}-{month:02d}",
+                url,
+            )
+            fileNames.append(fileName)
+
+        hours = pd.date_range(f"{YEAR}-01-01", f"{YEAR}-12-31 23:00", freq="h")
+        df = createData(
+            HOURLY_SCHEMA, HOURLY_EXTRA_COLS, stationID, hours, "%Y-%m-%d %H:%M:%S", rng
+        )
+
+        url = requester.hourly_url(stationID, YEAR, YEAR)
+        period = f"{YEAR}-{YEAR}"
+        count = json.dumps(
+            {
+                "type": "FeatureCollection",
+                "numberMatched": len(df.index),
+                "features": [],
+            }
+        )
+        archive.put(
+            count.encode(), HOURLY_SOURCE, stationID, period, requester.count_url(url)
+        )
+
+        for startIndex in range(0, len(df.index), PAGE_SIZE):
+            page = df.iloc[startIndex : startIndex + PAGE_SIZE].to_csv(index=False)
+            archive.put(
+                page.encode(),
+                HOURLY_SOURCE,
+                stationID,
+                period,
+                requester.page_url(url, startIndex),
+            )
+
+    links = "".join(f'<a href="{fileName}">{fileName}</a>\n' for fileName in fileNames)
+    listing = f"<html><body><h1>Index of /climate/observations/daily/csv/{PROVINCE}</h1>\n{links}</body></html>"
+    archive.put(
+        listing.encode(), LISTING_SOURCE, PROVINCE, "", requester.listing_url(PROVINCE)
+    )
+
+
+def createData(
+    schema: dict,
+    extraCols: list,
+    stationID: str,
+    dates: pd.DatetimeIndex,
+    dateFormat: str,
+    rng: np.random.Generator,
+) -> pd.DataFrame:
+    """
+    Purpose:
+    Creates the synthetic content of a file of the weather station services (a row per date)
+
+    Pseudocode:
+    - Fill the columns that are not kept with random floats
+    - Fill the columns of the schema: the station, the date and its parts and random floats (some of them missing)
+    """
+    dateParts = {
+        "year": dates.year,
+        "month": dates.month,
+        "day": dates.day,
+        "hour": dates.hour,
+    }
+    df = pd.DataFrame(
+        {col: rng.normal(0, 10, len(dates)).round(1) for col in extraCols}
+    )
+
+    for source, (name, dtype) in schema.items():
+        if name == "station_id":
+            df[source] = stationID
+        elif dtype.startswith("datetime"):
+            df[source] = dates.strftime(dateFormat)
+        elif name in dateParts:
+            df[source] = dateParts[name]
+        else:
+            values = rng.normal(10, 10, len(dates)).round(1)
+            values[rng.random(len(dates)) < MISSING_RATE] = np.nan
+            df[source] = values
+
+    return df
+
+
+def originOf(url: str) -> str:
+    """
+    Purpose:
+    Returns the scheme and host of a URL (i.e https://dd.weather.gc.ca)
+    """
+    scheme, _, host = url.split("/")[:3]
+
+    return f"{scheme}//{host}"
+
+
+if __name__ == "__main__":
+    main()
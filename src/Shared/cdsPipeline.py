@@ -0,0 +1,200 @@
+# ----------------------------------------------------
+# cdsPipeline.py
+#
+# Pulls data from the Copernicus Climate Data Store (CDS) without blocking on its request queue: requests are submitted
+# up to the account's quota, polled until they complete, downloaded on threads and processed on a pool of workers,
+# so waiting in the queue, downloading and processing all overlap
+#
+# Typical usage example:
+#   client = cdsapi.Client(wait_until_complete=False, delete=False)  # or StubClient(archive, "era5-land")
+#   pipeline = CDSPipeline(client, "reanalysis-era5-land", limiter)
+#
+#   # a job is (request, target file, arguments of process)
+#   numProcessed = pipeline.run(jobs, pool, process)
+#
+# Remarks:
+# - The client is expected to behave like cdsapi.Client(wait_until_complete=False): retrieve(dataset, request)
+#   returns a result with update(), reply["state"] (queued, running, completed or failed), download(target) and delete()
+# - Submissions and polls are paced by the rate limiter (and retried when the CDS pushes back)
+# - process is called on the pool with the arguments of the job once its target is downloaded
+# - Failed requests, downloads, handoffs (onDownloaded) and processing are reported (printed unless a log is given) and
+#   skipped, the other jobs carry on
+# ----------------------------------------------------
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from multiprocessing.pool import Pool, AsyncResult
+import collections, time, typing
+
+from Shared.rateLimiter import RateLimiter
+
+
+MAX_QUEUED = 4  # The number of requests queued on the CDS at once (the account's concurrency quota)
+POLL_INTERVAL = 10  # The number of seconds between polls of the queued requests
+MAX_DOWNLOADS = 2  # The number of results downloaded at once
+
+COMPLETED_STATE = "completed"
+FAILED_STATE = "failed"
+
+
+class CDSPipeline:
+    def __init__(
+        self,
+        client,
+        dataset: str,
+        limiter: RateLimiter,
+        maxQueued: int = MAX_QUEUED,
+        pollInterval: float = POLL_INTERVAL,
+        maxDownloads: int = MAX_DOWNLOADS,
+        log: typing.Callable[[str], None] = print,
+    ):
+        """
+        Purpose:
+        Creates a pipeline submitting requests for a dataset through a non-blocking CDS client
+
+        Remarks: log reports the requests and downloads that failed (printed by default)
+        """
+        self.client = client
+        self.dataset = dataset
+        self.limiter = limiter
+        self.maxQueued = maxQueued
+        self.pollInterval = pollInterval
+        self.maxDownloads = maxDownloads
+        self.log = log
+
+    def run(
+        self,
+        jobs: typing.List[typing.Tuple[dict, str, tuple]],
+        pool: Pool,
+        process: typing.Callable,
+        onDownloaded: typing.Optional[typing.Callable[[dict, str], None]] = None,
+    ) -> int:
+        """
+        Purpose:
+        Submits, polls, downloads and processes every job, returning the number of jobs processed without errors
+
+        Pseudocode:
+        - Until every job is processed (or failed)
+            - Submit jobs until maxQueued requests are queued on the CDS
+            - Poll the queued requests, completed requests start downloading (on a thread) and free their slot
+            - Hand the downloaded jobs to the pool (onDownloaded is called first, i.e to archive the file)
+                - A job whose handoff fails is reported and skipped, so the queued requests are still polled and deleted
+            - Wait for the next poll (or until a download finishes)
+        - Wait for the pool to process every downloaded job, counting the jobs processed without errors
+
+        Remarks: jobs are (request, target file, arguments of process)
+        """
+        pending = collections.deque(jobs)
+        queued: typing.List[typing.Tuple[tuple, typing.Any]] = []
+        downloading: typing.List[typing.Tuple[tuple, Future]] = []
+        processing: typing.List[typing.Tuple[tuple, AsyncResult]] = []
+        nextPoll = time.monotonic()
+
+        with ThreadPoolExecutor(self.maxDownloads) as downloads:
+            while len(pending) > 0 or len(queued) > 0 or len(downloading) > 0:
+                while len(pending) > 0 and len(queued) < self.maxQueued:
+                    job = pending.popleft()
+                    result = self.submit(job)
+                    if result is not None:
+                        queued.append((job, result))
+
+                if time.monotonic() >= nextPoll:
+                    for job, result in self.poll(queued):
+                        downloading.append(
+                            (job, downloads.submit(self.download, result, job[1]))
+                        )
+                    queued = [item for item in queued if self.isQueued(item[1])]
+                    nextPoll = time.monotonic() + self.pollInterval
+
+                # the downloaded jobs are handed to the pool from this thread
+                for job, future in [item for item in downloading if item[1].done()]:
+                    downloading.remove((job, future))
+                    if future.exception() is not None:
+                        self.log(
+                            f"[ERROR] Failed to download {job[1]}: {future.exception()}"
+                        )
+                        continue
+
+                    try:
+                        if onDownloaded is not None:
+                            onDownloaded(job[0], job[1])
+                        processing.append((job, pool.apply_async(process, job[2])))
+                    except Exception as e:
+                        self.log(f"[ERROR] Failed to hand off {job[1]}: {e}")
+
+                # waits for the next poll or until a download finishes
+                untilPoll = max(0, nextPoll - time.monotonic())
+                if len(downloading) > 0:
+                    wait(
+                        [future for _, future in downloading],
+                        timeout=untilPoll if len(queued) > 0 else None,
+                        return_when=FIRST_COMPLETED,
+                    )
+                elif len(queued) > 0:
+                    time.sleep(untilPoll)
+
+        numProcessed = 0
+        for job, task in processing:
+            try:
+                task.get()
+                numProcessed += 1
+            except Exception as e:
+                self.log(f"[ERROR] Failed to process {job[1]}: {e}")
+
+        return numProcessed
+
+    def submit(self, job: tuple) -> typing.Optional[typing.Any]:
+        """
+        Purpose:
+        Submits the request of a job without waiting for it to complete (None if the submission failed)
+        """
+        try:
+            return self.limiter.call(self.client.retrieve, self.dataset, job[0])
+        except Exception as e:
+            self.log(f"[ERROR] Failed to submit {job[1]}: {e}")
+            return None
+
+    def poll(
+        self, queued: typing.List[typing.Tuple[tuple, typing.Any]]
+    ) -> typing.List[typing.Tuple[tuple, typing.Any]]:
+        """
+        Purpose:
+        Refreshes the state of the queued requests and returns the ones that completed
+
+        Remarks: requests that failed (or could not be polled) are reported and marked as failed
+        """
+        completed = []
+
+        for job, result in queued:
+            try:
+                self.limiter.call(result.update)
+            except Exception as e:
+                result.reply["state"] = FAILED_STATE
+                result.reply["error"] = str(e)
+
+            state = result.reply.get("state")
+            if state == COMPLETED_STATE:
+                completed.append((job, result))
+            elif state == FAILED_STATE:
+                self.log(
+                    f"[ERROR] Request for {job[1]} failed: {result.reply.get('error')}"
+                )
+
+        return completed
+
+    def isQueued(self, result) -> bool:
+        """
+        Purpose:
+        Checks whether a request is still waiting in the CDS queue (or running)
+        """
+        return result.reply.get("state") not in [COMPLETED_STATE, FAILED_STATE]
+
+    def download(self, result, target: str):
+        """
+        Purpose:
+        Downloads a completed request to target then deletes it from the CDS (freeing its slot in the quota)
+        """
+        result.download(target)
+
+        try:
+            result.delete()
+        except Exception:
+            pass
@@ -0,0 +1,140 @@
+# ----------------------------------------------------
+# chunkAggregator.py
+#
+# Aggregates data that is read in chunks (i.e streamed with DataService.stream) by reducing each chunk as it arrives,
+# so tables larger than memory can be aggregated: only the partial results (one row per group) are kept
+#
+# Typical usage example:
+#   aggregator = ChunkAggregator(["district", "year"], {"min_temp": "min", "total_precip": ["min", "max", "mean"]})
+#   for chunk in db.stream(query):
+#       aggregator.add(chunk)
+#   agg_df = aggregator.result()  # the same rows as df.groupby(["district", "year"]).agg(aggs).reset_index()
+#
+# Remarks:
+# - aggs uses the format of DataFrame.agg with the min, max and mean functions
+# - Each chunk is reduced to its partial min, max, sum and count per group, the partials are merged as they accumulate
+# - Peak memory is bounded by one chunk plus the partial results (the number of groups) rather than the size of the table
+# ----------------------------------------------------
+import pandas as pd
+import numpy as np
+import typing
+
+
+# The number of partial rows accumulated before they are merged (merging less often avoids regrouping every chunk)
+MERGE_ROWS = 1000000
+
+# The partial results each aggregation function is calculated from
+PARTIALS = {"min": ["min"], "max": ["max"], "mean": ["sum", "count"]}
+
+# How the partial results of several chunks are merged
+MERGES = {"min": "min", "max": "max", "sum": "sum", "count": "sum"}
+
+
+class ChunkAggregator:
+    def __init__(
+        self,
+        keys: typing.List[str],
+        aggs: dict,
+        aggCols: typing.Optional[typing.List[str]] = None,
+    ):
+        """
+        Purpose:
+        Creates an aggregator grouping the chunks by keys and aggregating their attributes as per aggs
+
+        Remarks: aggCols names the aggregated columns (by default they are named attribute_function)
+        """
+        self.keys = keys
+        self.funcs = [
+            (attr, func)
+            for attr, funcs in aggs.items()
+            for func in ([funcs] if isinstance(funcs, str) else funcs)
+        ]
+        for _, func in self.funcs:
+            if func not in PARTIALS:
+                raise ValueError(f"[ERROR] {func} cannot be aggregated in chunks")
+
+        self.aggCols = (
+            aggCols
+            if aggCols is not None
+            else [f"{attr}_{func}" for attr, func in self.funcs]
+        )
+        if len(self.aggCols) != len(self.funcs):
+            raise ValueError("[ERROR] aggCols must name every aggregated column")
+
+        # the partial results as {partial column: (attribute, partial function)}
+        self.partialCols = {
+            f"{attr}:{partial}": (attr, partial)
+            for attr, func in self.funcs
+            for partial in PARTIALS[func]
+        }
+
+        self.partials: typing.List[pd.DataFrame] = []
+        self.numPartialRows = 0
+        self.numMergedRows = 0
+
+    def add(self, chunk: pd.DataFrame):
+        """
+        Purpose:
+        Reduces a chunk to its partial results per group and keeps them
+
+        Pseudocode:
+        - Sum the attributes as float64 (narrower types lose precision over many rows)
+        - Calculate the partial min, max, sum and count of each group of the chunk
+        - Merge the partial results once more than MERGE_ROWS (or the rows of the last merge) have accumulated
+        """
+        sumAttrs = {
+            attr
+            for attr, partial in self.partialCols.values()
+            if partial == "sum" and chunk[attr].dtype != np.float64
+        }
+        if len(sumAttrs) > 0:
+            chunk = chunk.astype({attr: np.float64 for attr in sumAttrs})
+
+        partial = chunk.groupby(self.keys, sort=False).agg(**self.partialCols)
+        self.partials.append(partial)
+        self.numPartialRows += len(partial.index)
+
+        if self.numPartialRows > max(MERGE_ROWS, 2 * self.numMergedRows):
+            self.__merge()
+
+    def result(self) -> pd.DataFrame:
+        """
+        Purpose:
+        Merges the partial results into the aggregated data (one row per group sorted by the keys like DataFrame.groupby)
+
+        Pseudocode:
+        - Merge the partial results of every chunk
+        - Calculate each aggregated column from its partial results (the mean is the sum over the count)
+        - Name the columns as per aggCols
+        """
+        merged = self.__merge().sort_index()
+
+        agg_df = pd.DataFrame(index=merged.index)
+        for col, (attr, func) in zip(self.aggCols, self.funcs):
+            if func == "mean":
+                agg_df[col] = merged[f"{attr}:sum"] / merged[f"{attr}:count"]
+            else:
+                agg_df[col] = merged[f"{attr}:{func}"]
+
+        return agg_df.reset_index()
+
+    def __merge(self) -> pd.DataFrame:
+        """
+        Purpose:
+        Merges the accumulated partial results into one partial result per group
+        """
+        if len(self.partials) == 0:
+            return pd.DataFrame(
+                columns=self.keys + list(self.partialCols.keys())
+            ).set_index(self.keys)
+
+        partials = pd.concat(self.partials)
+        merged = partials.groupby(level=self.keys, sort=False).agg(
+            {col: MERGES[partial] for col, (_, partial) in self.partialCols.items()}
+        )
+
+        self.partials = [merged]
+        self.numPartialRows = len(merged.index)
+        self.numMergedRows = len(merged.index)
+
+        return merged
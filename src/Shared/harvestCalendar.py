@@ -0,0 +1,103 @@
+# ----------------------------------------------------
+# harvestCalendar.py
+#
+# Labels daily data with its day of the year, week, month and harvest year offset using a single lookup table
+#
+# Typical usage example:
+#   harvestCalendar = HarvestCalendar()
+#   df = harvestCalendar.addCalendarAttrs(df, {"week": "week"})
+#
+# Remarks:
+# - As weeks change per year, weeks are calculated using the year of 2001 (not a leap year), the 29th of February uses the week of the 28th
+# - The day of the year is calculated using the year of 2000 (a leap year) so that each (month, day) pair has its own day of the year
+# ----------------------------------------------------
+import pandas as pd
+import numpy as np
+import calendar, datetime
+
+
+HARVEST_MONTH = 9  # The month from which data applies to the following harvest
+HARVEST_WEEK = 33  # The week from which data applies to the following harvest
+
+WEEK_YEAR = 2001  # The year used to calculate week numbers (not a leap year)
+DAY_OF_YEAR_YEAR = 2000  # The year used to calculate the day of the year (a leap year)
+
+# The attributes stored in the lookup table (in order)
+CALENDAR_ATTRS = ["day_of_year", "week", "month", "harvest_year_offset"]
+
+# The value stored in the lookup table for (month, day) pairs that do not exist
+INVALID_DATE = -1
+
+
+class HarvestCalendar:
+    lookupTable: np.ndarray = None  # type: ignore
+
+    def __init__(self):
+        # the lookup table is only built once and then shared by every instance
+        if HarvestCalendar.lookupTable is None:
+            HarvestCalendar.lookupTable = self.__buildLookupTable()
+
+    def getLookupTable(self) -> np.ndarray:
+        """
+        Purpose:
+        Returns the (month, day) -> (day_of_year, week, month, harvest_year_offset) lookup table
+
+        Remarks: the table is indexed as [month, day, attribute] where the attributes are ordered as per CALENDAR_ATTRS
+        """
+        return HarvestCalendar.lookupTable
+
+    def addCalendarAttrs(
+        self,
+        df: pd.DataFrame,
+        attrs: dict,
+        monthCol: str = "month",
+        dayCol: str = "day",
+    ) -> pd.DataFrame:
+        """
+        Purpose:
+        Labels each row of a DataFrame with the requested calendar attributes based on its month and day
+
+        Pseudocode:
+        - Load the month and day of every row as integers
+        - Gather the calendar attributes of every row from the lookup table in a single vectorized pass
+        - Store each requested attribute under its requested column name
+
+        Remarks: attrs maps the calendar attributes (see CALENDAR_ATTRS) to the names of the columns they are stored in i.e {"week": "week_of_year"}
+        """
+        months = df[monthCol].to_numpy(dtype=np.int64)
+        days = df[dayCol].to_numpy(dtype=np.int64)
+        labels = HarvestCalendar.lookupTable[months, days]
+
+        for attr, col in attrs.items():
+            df[col] = labels[:, CALENDAR_ATTRS.index(attr)]
+
+        return df
+
+    def __buildLookupTable(self) -> np.ndarray:
+        """
+        Purpose:
+        Builds the (month, day) -> (day_of_year, week, month, harvest_year_offset) lookup table
+
+        Pseudocode:
+        - Create a table of invalid dates with room for every month (1-12) and day (1-31)
+        - For each day of the leap year, calculate the day of the year, week, month and harvest year offset
+            - The 29th of February is given the week of the 28th since it does not exist in WEEK_YEAR
+        """
+        table = np.full((13, 32, len(CALENDAR_ATTRS)), INVALID_DATE, dtype=np.int64)
+
+        for month in range(1, 13):
+            numDays = calendar.monthrange(DAY_OF_YEAR_YEAR, month)[1]
+
+            for day in range(1, numDays + 1):
+                dayOfYear = datetime.date(DAY_OF_YEAR_YEAR, month, day).timetuple()
+                weekDay = min(day, calendar.monthrange(WEEK_YEAR, month)[1])
+                week = datetime.date(WEEK_YEAR, month, weekDay).isocalendar()[1]
+
+                table[month, day] = [
+                    dayOfYear.tm_yday,
+                    week,
+                    month,
+                    int(month >= HARVEST_MONTH),
+                ]
+
+        return table
@@ -0,0 +1,234 @@
+# ----------------------------------------------------
+# queryProfiler.py
+#
+# Records how long each database query takes, how many rows it reads/writes and roughly how many bytes it moves
+#
+# Typical usage example:
+#   PROFILER.enable("data/query_profile.json")  # or set the QUERY_PROFILE environment variable to the path
+#   with PROFILER.stage("generateNoErgotTables"):
+#       db.execute(query)
+#   PROFILER.export()  # also done automatically when the program exits
+#
+# Remarks:
+# - Queries executed through SQLAlchemy are recorded by event hooks on every DataService engine,
+#   COPY writes (DataService.bulkWrite) and streamed reads (DataService.stream) are recorded by DataService itself
+# - Stats are aggregated per (stage, caller, statement) where the caller is the first function outside of Shared, SQLAlchemy and pandas
+# - Bytes are approximate: the CSV sent for COPY writes, the DataFrame size for streamed reads and rows x columns x 8 otherwise
+# ----------------------------------------------------
+import sqlalchemy as sq
+import atexit, contextlib, json, os, sys, threading, time, typing
+
+
+# The environment variable holding the path profiles are exported to (profiling is enabled when it is set)
+PROFILE_ENV_VAR = "QUERY_PROFILE"
+
+# The approximate number of bytes per value used when the size of a result is unknown
+BYTES_PER_VALUE = 8
+
+# The maximum number of characters of a statement kept in the profile
+MAX_STATEMENT_LEN = 300
+
+# The stage used for queries executed outside of a stage
+DEFAULT_STAGE = "untagged"
+
+# Frames from these packages are skipped when looking for the caller of a query
+SKIPPED_MODULES = ["Shared.", "sqlalchemy", "pandas", "contextlib"]
+
+
+class QueryProfiler:
+    def __init__(self):
+        self.enabled: bool = False
+        self.path: typing.Optional[str] = None
+        self.stats: typing.Dict[tuple, dict] = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def enable(self, path: typing.Optional[str] = None):
+        """
+        Purpose:
+        Starts recording queries, the profile is exported to path (if provided) when the program exits
+        """
+        if path is not None and self.path is None:
+            atexit.register(self.export)
+
+        self.enabled = True
+        self.path = path if path is not None else self.path
+
+    def disable(self):
+        """
+        Purpose:
+        Stops recording queries (the stats recorded so far are kept)
+        """
+        self.enabled = False
+
+    def reset(self):
+        """
+        Purpose:
+        Clears the stats recorded so far
+        """
+        with self.lock:
+            self.stats = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> typing.Iterator[None]:
+        """
+        Purpose:
+        Tags every query executed by the current thread within a with block with the name of the pipeline stage
+
+        Remarks: stages can be nested, the innermost stage is used
+        """
+        stages = self.__getStages()
+        stages.append(name)
+        try:
+            yield
+        finally:
+            stages.pop()
+
+    def attach(self, engine: sq.engine.base.Engine):
+        """
+        Purpose:
+        Adds the event hooks that time every query executed by an engine
+
+        Pseudocode:
+        - Enable profiling if the QUERY_PROFILE environment variable is set (scripts load it from docker/.env before connecting)
+        - Before a query runs, store its start time on the connection
+        - After a query runs, record its duration, the number of rows it returned/modified and its approximate size
+
+        Remarks: the hooks do nothing while profiling is disabled, attaching the same engine twice has no effect
+        """
+        if not self.enabled and os.getenv(PROFILE_ENV_VAR):
+            self.enable(os.getenv(PROFILE_ENV_VAR))
+
+        if sq.event.contains(engine, "before_cursor_execute", self.__beforeExecute):
+            return
+
+        sq.event.listen(engine, "before_cursor_execute", self.__beforeExecute)
+        sq.event.listen(engine, "after_cursor_execute", self.__afterExecute)
+
+    def record(self, statement: str, seconds: float, rows: int, numBytes: int):
+        """
+        Purpose:
+        Adds a query to the stats of its stage, caller and statement
+        """
+        if not self.enabled:
+            return
+
+        statement = " ".join(str(statement).split())[:MAX_STATEMENT_LEN]
+        key = (self.__getStage(), self.__getCaller(), statement)
+
+        with self.lock:
+            stat = self.stats.setdefault(
+                key,
+                {"calls": 0, "seconds": 0.0, "maxSeconds": 0.0, "rows": 0, "bytes": 0},
+            )
+            stat["calls"] += 1
+            stat["seconds"] += seconds
+            stat["maxSeconds"] = max(stat["maxSeconds"], seconds)
+            stat["rows"] += max(rows, 0)
+            stat["bytes"] += max(numBytes, 0)
+
+    def getStats(self) -> typing.List[dict]:
+        """
+        Purpose:
+        Returns the recorded stats sorted from the slowest to the fastest query
+        """
+        with self.lock:
+            stats = [
+                {"stage": stage, "caller": caller, "statement": statement, **stat}
+                for (stage, caller, statement), stat in self.stats.items()
+            ]
+
+        return sorted(stats, key=lambda stat: stat["seconds"], reverse=True)
+
+    def export(self, path: typing.Optional[str] = None):
+        """
+        Purpose:
+        Writes the recorded stats as JSON to path (defaults to the path given to enable)
+
+        Pseudocode:
+        - Sort the stats from the slowest to the fastest query
+        - Total the time, rows and bytes of each stage
+        - Write both to the JSON file
+        """
+        path = path if path is not None else self.path
+        if path is None or len(self.stats) == 0:
+            return
+
+        stats = self.getStats()
+        stages: typing.Dict[str, dict] = {}
+        for stat in stats:
+            total = stages.setdefault(
+                stat["stage"], {"calls": 0, "seconds": 0.0, "rows": 0, "bytes": 0}
+            )
+            for attr in total.keys():
+                total[attr] += stat[attr]
+
+        with open(path, "w") as file:
+            json.dump({"stages": stages, "queries": stats}, file, indent=2)
+
+    def __beforeExecute(self, conn, cursor, statement, params, context, executemany):
+        """
+        Purpose:
+        Stores the start time of a query on its connection (SQLAlchemy before_cursor_execute event)
+        """
+        if self.enabled:
+            conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    def __afterExecute(self, conn, cursor, statement, params, context, executemany):
+        """
+        Purpose:
+        Records a query once it has finished executing (SQLAlchemy after_cursor_execute event)
+
+        Remarks: rows are only known for client-side cursors, server-side cursors (DataService.stream) are recorded by DataService
+        """
+        startTimes = conn.info.get("query_start_time", [])
+        if len(startTimes) == 0:
+            return
+
+        # server-side (named) cursors only declare the query here, DataService.stream records them once fetched
+        if not self.enabled or getattr(cursor, "name", None) is not None:
+            startTimes.pop()
+            return
+
+        seconds = time.perf_counter() - startTimes.pop()
+        rows = cursor.rowcount if cursor.rowcount is not None else 0
+        numCols = len(cursor.description) if cursor.description else 0
+
+        self.record(statement, seconds, rows, rows * numCols * BYTES_PER_VALUE)
+
+    def __getStages(self) -> typing.List[str]:
+        """
+        Purpose:
+        Returns the stack of stages of the current thread
+        """
+        if not hasattr(self.local, "stages"):
+            self.local.stages = []
+
+        return self.local.stages
+
+    def __getStage(self) -> str:
+        """
+        Purpose:
+        Returns the innermost stage of the current thread
+        """
+        stages = self.__getStages()
+        return stages[-1] if len(stages) > 0 else DEFAULT_STAGE
+
+    def __getCaller(self) -> str:
+        """
+        Purpose:
+        Returns the first function (as module.function) on the call stack that is not part of Shared, SQLAlchemy or pandas
+        """
+        frame = sys._getframe(1)
+
+        while frame is not None:
+            module = frame.f_globals.get("__name__", "")
+            if not any(module.startswith(skipped) for skipped in SKIPPED_MODULES):
+                return f"{module}.{frame.f_code.co_name}"
+
+            frame = frame.f_back  # type: ignore
+
+        return "unknown"
+
+
+PROFILER = QueryProfiler()  # The profiler shared by every DataService
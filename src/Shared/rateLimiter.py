@@ -0,0 +1,230 @@
+# ----------------------------------------------------
+# rateLimiter.py
+#
+# Limits how fast and how many requests at once are sent to the external data services (shared by every worker process)
+#
+# Typical usage example:
+#   limiter = RateLimiter(rate=2, maxConcurrent=12)
+#   pool = mp.Pool(NUM_WORKERS, initializer=shareLimiter, initargs=(limiter,))
+#
+#   # within a worker process
+#   res = getSharedLimiter().call(session.get, url)
+#
+# Remarks:
+# - The limiter is a token bucket: requests are sent as soon as a token is available (up to rate per second on average)
+# - The rate adapts to the service: it is halved whenever the service pushes back (HTTP 429/5xx, timeouts
+#   or full request queues) and recovers step by step after every successful request
+# - When the service pushes back, every process waits out the same pause (the Retry-After header if provided,
+#   otherwise an exponential backoff) before the request is retried
+# ----------------------------------------------------
+import multiprocessing as mp
+import requests as rq
+import contextlib, time, typing
+
+
+MIN_RATE = 0.01  # The lowest rate (requests per second) the limiter backs off to
+
+# The rate is multiplied by this factor when the service pushes back
+DECREASE_FACTOR = 0.5
+
+# The fraction of the target rate recovered after each successful request
+INCREASE_STEP = 0.1
+
+BASE_BACKOFF = 5  # The number of seconds to pause after the first push back (doubles with every consecutive push back)
+MAX_BACKOFF = 300  # The maximum number of seconds to pause
+MAX_RETRIES = 5  # The number of times a request is retried when the service pushes back
+
+# The HTTP status codes meaning the service is overloaded (as well as every 5xx code)
+RETRY_STATUSES = [429]
+
+# Errors whose message contains one of these are treated as the service pushing back (i.e the CDS request queue)
+RETRY_MESSAGES = ["too many requests", "queue", "temporarily unavailable", "rate limit"]
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        rate: float,
+        maxConcurrent: int,
+        burst: int = 1,
+        baseBackoff: float = BASE_BACKOFF,
+        maxBackoff: float = MAX_BACKOFF,
+        maxRetries: int = MAX_RETRIES,
+    ):
+        """
+        Purpose:
+        Creates a limiter sending at most rate requests per second on average and at most maxConcurrent requests at once
+
+        Remarks: burst is the number of requests that can be sent back to back after the limiter has been idle
+        """
+        self.targetRate = rate
+        self.burst = burst
+        self.baseBackoff = baseBackoff
+        self.maxBackoff = maxBackoff
+        self.maxRetries = maxRetries
+
+        # the state is stored in shared memory so that every worker process draws from the same bucket
+        self.lock = mp.Lock()
+        self.slots = mp.BoundedSemaphore(maxConcurrent)
+        self.rate = mp.Value("d", rate, lock=False)
+        self.tokens = mp.Value("d", burst, lock=False)
+        self.updated = mp.Value("d", time.time(), lock=False)
+        self.pausedUntil = mp.Value("d", 0.0, lock=False)
+        self.failures = mp.Value("i", 0, lock=False)
+
+    def call(self, func: typing.Callable, *args, **kwargs):
+        """
+        Purpose:
+        Calls func (a request to a service) once the limiter allows it, retrying it when the service pushes back
+
+        Pseudocode:
+        - Wait for a free slot and a token
+        - Call the function
+            - If the service pushed back, slow down, pause every process and retry (up to maxRetries times)
+            - Otherwise raise the error
+        - Speed back up after a successful request
+        """
+        for attempt in range(self.maxRetries + 1):
+            with self.slot():
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    if not isRetryable(e) or attempt == self.maxRetries:
+                        raise e
+
+                    self.backoff(getRetryAfter(e))
+                    continue
+
+            self.succeed()
+            return result
+
+    @contextlib.contextmanager
+    def slot(self) -> typing.Iterator[None]:
+        """
+        Purpose:
+        Holds one of the concurrent request slots (and one token) for the duration of a with block
+        """
+        with self.slots:
+            self.wait()
+            yield
+
+    def wait(self):
+        """
+        Purpose:
+        Blocks until a token is available and takes it
+
+        Pseudocode:
+        - Refill the bucket based on the time elapsed since it was last refilled (up to burst tokens)
+        - If the limiter is paused or the bucket is empty, calculate how long to wait
+        - Otherwise take a token
+        - Sleep outside of the lock (so other processes can keep going) and try again
+        """
+        while True:
+            with self.lock:
+                now = time.time()
+                elapsed = max(now - self.updated.value, 0)
+                self.tokens.value = min(
+                    self.burst, self.tokens.value + elapsed * self.rate.value
+                )
+                self.updated.value = now
+
+                if now < self.pausedUntil.value:
+                    delay = self.pausedUntil.value - now
+                elif self.tokens.value >= 1:
+                    self.tokens.value -= 1
+                    return
+                else:
+                    delay = (1 - self.tokens.value) / self.rate.value
+
+            time.sleep(delay)
+
+    def backoff(self, retryAfter: typing.Optional[float] = None):
+        """
+        Purpose:
+        Slows every process down after the service pushed back
+
+        Pseudocode:
+        - Halve the rate (down to MIN_RATE)
+        - Pause every process for retryAfter seconds if provided, otherwise for an exponential backoff
+        """
+        with self.lock:
+            delay = min(self.maxBackoff, self.baseBackoff * 2**self.failures.value)
+            delay = retryAfter if retryAfter is not None else delay
+
+            self.failures.value += 1
+            self.rate.value = max(MIN_RATE, self.rate.value * DECREASE_FACTOR)
+            self.pausedUntil.value = max(self.pausedUntil.value, time.time() + delay)
+
+    def succeed(self):
+        """
+        Purpose:
+        Speeds back up (up to the target rate) after a successful request
+        """
+        with self.lock:
+            self.failures.value = 0
+            self.rate.value = min(
+                self.targetRate, self.rate.value + self.targetRate * INCREASE_STEP
+            )
+
+    def getRate(self) -> float:
+        """
+        Purpose:
+        Returns the current rate (requests per second)
+        """
+        return self.rate.value
+
+
+def isRetryable(e: Exception) -> bool:
+    """
+    Purpose:
+    Checks if an error means the service pushed back (so the request should be retried later)
+
+    Pseudocode:
+    - HTTP errors are retried if their status is 429 or 5xx
+    - Timeouts are retried (connection errors are not, as they usually mean the service cannot be reached at all)
+    - Other errors are retried if their message mentions a full queue/rate limit (i.e cdsapi errors)
+    """
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    if status is not None:
+        return status in RETRY_STATUSES or status >= 500
+
+    if isinstance(e, (rq.Timeout, TimeoutError)):
+        return True
+
+    message = str(e).lower()
+    return any(retryMessage in message for retryMessage in RETRY_MESSAGES)
+
+
+def getRetryAfter(e: Exception) -> typing.Optional[float]:
+    """
+    Purpose:
+    Returns the number of seconds the service asked to wait before retrying (None if it did not)
+    """
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+SHARED_LIMITER: typing.Optional[
+    RateLimiter
+] = None  # The limiter shared with the worker processes
+
+
+def shareLimiter(limiter: RateLimiter):
+    """
+    Purpose:
+    Shares a limiter with the current process (used as the initializer of multiprocessing pools)
+    """
+    global SHARED_LIMITER
+    SHARED_LIMITER = limiter
+
+
+def getSharedLimiter() -> typing.Optional[RateLimiter]:
+    """
+    Purpose:
+    Returns the limiter shared with the current process (None if none was shared)
+    """
+    return SHARED_LIMITER
@@ -0,0 +1,240 @@
+# ----------------------------------------------------
+# rawArchive.py
+#
+# Keeps a local copy of every raw file downloaded from the external data services so that preprocessing
+# can be rerun from disk instead of downloading the data again
+#
+# Typical usage example:
+#   archive = openArchive()  # None unless RAW_ARCHIVE_DIR is set (i.e in the docker folder's .env)
+#
+#   # record mode (RAW_ARCHIVE_MODE=record, the default)
+#   archive.put(res.content, "climate-daily", stationID, "2004-07", url)
+#
+#   # replay mode (RAW_ARCHIVE_MODE=replay)
+#   content = archive.load("climate-daily", url)
+#
+# Remarks:
+# - Files are stored once under the SHA-256 hash of their content (objects/<first 2 characters>/<hash>.gz)
+# - The manifest (manifest.jsonl) holds a line per download: hash, source, station/area (key), period and name (URL/request)
+# - When the same name was downloaded more than once, the latest download is replayed
+# - Files that are already compressed (i.e NetCDF zips) should be stored with compress=False
+# ----------------------------------------------------
+from datetime import datetime
+import hashlib, gzip, json, os, typing
+
+
+# The environment variables holding the archive folder and mode
+ARCHIVE_DIR_ENV = "RAW_ARCHIVE_DIR"
+ARCHIVE_MODE_ENV = "RAW_ARCHIVE_MODE"
+
+RECORD_MODE = "record"  # Downloads are made as usual and archived
+REPLAY_MODE = "replay"  # Downloads are read from the archive (no requests are made)
+
+OBJECTS_FOLDER = "objects"  # The folder (within the archive) holding the files
+MANIFEST_FILE = "manifest.jsonl"  # The file (within the archive) listing the downloads
+
+
+class RawArchive:
+    def __init__(self, root: str, replay: bool = False):
+        """
+        Purpose:
+        Opens (creates if needed) the archive stored in the root folder
+
+        Remarks: replay specifies whether downloads should be read from the archive instead of being requested
+        """
+        self.root = root
+        self.replay = replay
+        self.objectsPath = os.path.join(root, OBJECTS_FOLDER)
+        self.manifestPath = os.path.join(root, MANIFEST_FILE)
+
+        # The latest download of each name as {(source, name): entry}, loaded from the manifest when first needed
+        self.index: typing.Optional[typing.Dict[typing.Tuple[str, str], dict]] = None
+
+        os.makedirs(self.objectsPath, exist_ok=True)
+
+    def put(
+        self,
+        data: bytes,
+        source: str,
+        key: str,
+        period: str,
+        name: str,
+        compress: bool = True,
+    ) -> str:
+        """
+        Purpose:
+        Archives a downloaded file and returns the hash of its content
+
+        Pseudocode:
+        - Hash the content
+        - If the content is not archived yet, write it (compressed) to a temporary file then move it in place
+        - Append the download to the manifest (a single write so that processes can archive at the same time)
+
+        Remarks:
+        - source is the service (i.e climate-hourly), key the station/area, period the dates and name the URL/request
+        - Moving the file in place ensures a partially written file is never read
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.objectPath(digest, compress)
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tempPath = f"{path}.{os.getpid()}.tmp"
+
+            with open(tempPath, "wb") as file:
+                file.write(gzip.compress(data) if compress else data)
+            os.replace(tempPath, path)
+
+        entry = {
+            "hash": digest,
+            "source": source,
+            "key": str(key),
+            "period": str(period),
+            "name": name,
+            "size": len(data),
+            "compressed": compress,
+            "archived_at": datetime.now().isoformat(timespec="seconds"),
+        }
+
+        fd = os.open(self.manifestPath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(entry) + "\n").encode())
+        finally:
+            os.close(fd)
+
+        if self.index is not None:
+            self.index[(source, name)] = entry
+
+        return digest
+
+    def putFile(
+        self,
+        filePath: str,
+        source: str,
+        key: str,
+        period: str,
+        name: str,
+        compress: bool = True,
+    ) -> str:
+        """
+        Purpose:
+        Archives a downloaded file stored on disk and returns the hash of its content (see put)
+        """
+        with open(filePath, "rb") as file:
+            return self.put(file.read(), source, key, period, name, compress)
+
+    def load(self, source: str, name: str) -> bytes:
+        """
+        Purpose:
+        Reads the latest archived download of a name
+
+        Remarks: raises FileNotFoundError if the name was never archived
+        """
+        entry = self.find(source, name)
+        if entry is None:
+            raise FileNotFoundError(f"{source} {name} is not in the raw archive")
+
+        with open(self.objectPath(entry["hash"], entry["compressed"]), "rb") as file:
+            data = file.read()
+
+        return gzip.decompress(data) if entry["compressed"] else data
+
+    def restoreFile(self, source: str, name: str, filePath: str):
+        """
+        Purpose:
+        Writes the latest archived download of a name to filePath (as if it had just been downloaded)
+        """
+        data = self.load(source, name)
+
+        with open(filePath, "wb") as file:
+            file.write(data)
+
+    def find(self, source: str, name: str) -> typing.Optional[dict]:
+        """
+        Purpose:
+        Returns the manifest entry of the latest download of a name (None if it was never archived)
+        """
+        return self.loadIndex().get((source, name))
+
+    def entries(
+        self,
+        source: typing.Optional[str] = None,
+        key: typing.Optional[str] = None,
+        period: typing.Optional[str] = None,
+    ) -> typing.List[dict]:
+        """
+        Purpose:
+        Lists the latest download of each name, optionally only those of a source, station/area and/or period
+        """
+        return [
+            entry
+            for entry in self.loadIndex().values()
+            if (source is None or entry["source"] == source)
+            and (key is None or entry["key"] == str(key))
+            and (period is None or entry["period"] == str(period))
+        ]
+
+    def loadIndex(self) -> typing.Dict[typing.Tuple[str, str], dict]:
+        """
+        Purpose:
+        Loads the manifest into an index of the latest download of each name (only read once)
+
+        Remarks: a line that is not valid JSON (i.e cut short by a crash) is skipped
+        """
+        if self.index is not None:
+            return self.index
+
+        self.index = {}
+        if os.path.exists(self.manifestPath):
+            with open(self.manifestPath, "r") as manifest:
+                for line in manifest:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+
+                    self.index[(entry["source"], entry["name"])] = entry
+
+        return self.index
+
+    def objectPath(self, digest: str, compressed: bool) -> str:
+        """
+        Purpose:
+        Returns where the content with the given hash is stored
+        """
+        extension = ".gz" if compressed else ".raw"
+
+        return os.path.join(self.objectsPath, digest[:2], digest + extension)
+
+
+def openArchive() -> typing.Optional[RawArchive]:
+    """
+    Purpose:
+    Opens the archive configured by the environment (RAW_ARCHIVE_DIR and RAW_ARCHIVE_MODE)
+
+    Pseudocode:
+    - If no archive folder is configured, archiving is disabled (None)
+    - Check the mode is either record (default) or replay
+    - Open the archive
+    """
+    root = os.getenv(ARCHIVE_DIR_ENV)
+    if not root:
+        return None
+
+    mode = os.getenv(ARCHIVE_MODE_ENV) or RECORD_MODE
+    if mode not in [RECORD_MODE, REPLAY_MODE]:
+        raise ValueError(f"{ARCHIVE_MODE_ENV} must be {RECORD_MODE} or {REPLAY_MODE}")
+
+    return RawArchive(root, mode == REPLAY_MODE)
+
+
+def requestName(dataset: str, request: dict) -> str:
+    """
+    Purpose:
+    Names a data request (i.e to the Copernicus CDS) by its dataset and the hash of its parameters
+
+    Remarks: changing any parameter (i.e the variables requested) changes the name, so older downloads are not replayed
+    """
+    params = json.dumps(request, sort_keys=True)
+
+    return f"{dataset}:{hashlib.sha256(params.encode()).hexdigest()[:16]}"
@@ -0,0 +1,264 @@
+# ----------------------------------------------------
+# regionLookup.py
+#
+# Labels gridded data (i.e the ERA5-Land grid of the Copernicus data) with the agriculture regions it falls into
+# without a spatial join: the region of every grid cell is found once, cached on disk and then looked up by index
+#
+# Typical usage example:
+#   lookup = loadRegionLookup(np.sort(lats), np.sort(lons), agRegions, "data/region_lookup")  # the axes of the grid
+#   df = lookup.label(df)  # adds cr_num and district, drops the rows outside of every region
+#   cells, starts, crNums, districts = lookup.zones(lats, lons)  # groups the cells of a grid by region
+#
+# Remarks:
+# - A lookup is cached under a key hashing the grid (its latitudes and longitudes) and the region geometries, so a new
+#   grid/area or new regions build a new lookup while every other run reads the cached one
+# - The region geometries are only hashed once per loaded regions, the hash is kept in agRegions.attrs (which are
+#   pickled along with the regions, i.e to the workers) so the regions must not be modified once they are hashed
+# - Cells are matched to regions with the same spatial join as before (points within the regions, in EPSG:3347)
+# - A cell on the boundary of two regions is labeled with the first of them
+# ----------------------------------------------------
+import geopandas as gpd  # type: ignore
+import pandas as pd
+import numpy as np
+import hashlib, os, typing
+
+
+NO_REGION = -1  # The region code of cells outside of every region
+KEY_LEN = 16  # The number of characters of the hash naming a cached lookup
+REGIONS_KEY_ATTR = "regionLookupKey"  # The attribute of the regions (in their attrs) holding the hash of their geometries
+
+# The lookups loaded by the current process as {key: lookup}
+LOOKUPS: typing.Dict[str, "RegionLookup"] = {}
+
+
+class RegionLookup:
+    def __init__(
+        self,
+        lats: np.ndarray,
+        lons: np.ndarray,
+        crNums: np.ndarray,
+        districts: np.ndarray,
+    ):
+        """
+        Purpose:
+        Creates a lookup of the region of every cell of a grid
+
+        Remarks:
+        - lats and lons are the sorted coordinates of the grid (EPSG:4326)
+        - crNums and districts hold the region of the cell (lat, lon) at index latIndex * len(lons) + lonIndex (NO_REGION if none)
+        """
+        self.lats = lats
+        self.lons = lons
+        self.crNums = crNums
+        self.districts = districts
+
+    def cellsOf(
+        self,
+        lats: typing.Union[pd.Series, np.ndarray],
+        lons: typing.Union[pd.Series, np.ndarray],
+    ) -> np.ndarray:
+        """
+        Purpose:
+        Finds the index of the grid cell of each coordinate
+
+        Pseudocode:
+        - Find the index of each latitude and longitude among the sorted grid coordinates (binary search)
+        - Check every coordinate is on the grid
+        - Combine the indexes into the index of the cell
+
+        Remarks: raises a ValueError if a coordinate is not on the grid (the data comes from another grid)
+        """
+        lats, lons = np.asarray(lats), np.asarray(lons)
+        latIndexes = np.searchsorted(self.lats, lats)
+        lonIndexes = np.searchsorted(self.lons, lons)
+
+        latIndexes = np.minimum(latIndexes, len(self.lats) - 1)
+        lonIndexes = np.minimum(lonIndexes, len(self.lons) - 1)
+        if not (
+            np.array_equal(self.lats[latIndexes], lats)
+            and np.array_equal(self.lons[lonIndexes], lons)
+        ):
+            raise ValueError("The coordinates are not on the grid of the region lookup")
+
+        return latIndexes * len(self.lons) + lonIndexes
+
+    def label(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Purpose:
+        Labels the rows of a DataFrame with the region (cr_num and district) of their grid cell
+
+        Pseudocode:
+        - Find the grid cell of each row (see cellsOf)
+        - Look up the region of each cell
+        - Drop the rows outside of every region along with their coordinates (lat and lon)
+        """
+        cells = self.cellsOf(df["lat"], df["lon"])
+        crNums = self.crNums[cells]
+        inRegion = crNums != NO_REGION
+
+        df = df.loc[inRegion].drop(columns=["lat", "lon"])
+        df["cr_num"] = crNums[inRegion]
+        df["district"] = self.districts[cells[inRegion]]
+
+        return df
+
+    def zones(
+        self, lats: np.ndarray, lons: np.ndarray
+    ) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Purpose:
+        Groups the cells of a grid by region (for reductions over each region with [reduceat](https://numpy.org/doc/stable/reference/generated/numpy.ufunc.reduceat.html))
+
+        Pseudocode:
+        - Find the region of every cell of the grid (see cellsOf)
+        - Drop the cells outside of every region and sort the others by cr_num then district
+        - Find where each region starts among the sorted cells
+
+        Remarks:
+        - lats and lons are the axes of the grid in their stored order (i.e descending latitudes), cells are numbered
+          latIndex * len(lons) + lonIndex like a flattened (lat, lon) array
+        - Returns the sorted cells, where each region starts among them and the cr_num and district of each region
+        """
+        cellLats, cellLons = np.meshgrid(lats, lons, indexing="ij")
+        gridCells = self.cellsOf(cellLats.ravel(), cellLons.ravel())
+        crNums = self.crNums[gridCells]
+        districts = self.districts[gridCells]
+
+        inRegion = np.flatnonzero(crNums != NO_REGION)
+        cells = inRegion[np.lexsort((districts[inRegion], crNums[inRegion]))]
+        crNums, districts = crNums[cells], districts[cells]
+
+        changed = (crNums[1:] != crNums[:-1]) | (districts[1:] != districts[:-1])
+        starts = np.flatnonzero(np.r_[len(cells) > 0, changed])
+
+        return cells, starts, crNums[starts], districts[starts]
+
+    def save(self, path: str):
+        """
+        Purpose:
+        Writes the lookup to disk (to a temporary file moved in place so a partially written lookup is never read)
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tempPath = f"{path}.{os.getpid()}.tmp.npz"
+
+        np.savez(
+            tempPath,
+            lats=self.lats,
+            lons=self.lons,
+            crNums=self.crNums,
+            districts=self.districts,
+        )
+        os.replace(tempPath, path)
+
+
+def buildRegionLookup(
+    lats: np.ndarray, lons: np.ndarray, agRegions: gpd.GeoDataFrame
+) -> RegionLookup:
+    """
+    Purpose:
+    Finds the region of every cell of a grid
+
+    Pseudocode:
+    - [Create a point for each cell](https://geopandas.org/en/stable/docs/reference/api/geopandas.points_from_xy.html)
+    - [Set the coordinate system](https://geopandas.org/en/stable/docs/reference/api/geopandas.GeoDataFrame.to_crs.html) to the one of the regions (EPSG:3347)
+    - Label the cells [by joining them to the regions](https://geopandas.org/en/stable/docs/reference/api/geopandas.sjoin.html) they fall within
+    - Keep the first region of each cell (NO_REGION if none)
+    """
+    cellLats, cellLons = np.meshgrid(lats, lons, indexing="ij")
+    cells = gpd.GeoDataFrame(
+        geometry=gpd.points_from_xy(cellLons.ravel(), cellLats.ravel()),
+        crs="EPSG:4326",
+    )
+    cells.to_crs(crs="EPSG:3347", inplace=True)  # type: ignore
+
+    joined = gpd.sjoin(
+        cells, agRegions[["cr_num", "district", "geometry"]], predicate="within"
+    )
+    joined = joined[~joined.index.duplicated(keep="first")]
+
+    crNums = np.full(len(cells.index), NO_REGION, dtype=np.int64)
+    districts = np.full(len(cells.index), NO_REGION, dtype=np.int64)
+    crNums[joined.index] = joined["cr_num"].astype(int)
+    districts[joined.index] = joined["district"].astype(int)
+
+    return RegionLookup(lats, lons, crNums, districts)
+
+
+def readRegionLookup(path: str) -> RegionLookup:
+    """
+    Purpose:
+    Reads a lookup written by RegionLookup.save
+    """
+    with np.load(path) as arrays:
+        return RegionLookup(
+            arrays["lats"], arrays["lons"], arrays["crNums"], arrays["districts"]
+        )
+
+
+def regionsKey(agRegions: gpd.GeoDataFrame) -> str:
+    """
+    Purpose:
+    Hashes the region geometries, only the first time the loaded regions are seen
+
+    Pseudocode:
+    - Return the hash kept in the attrs of the regions if they were hashed before
+    - Otherwise hash the cr_num, district and geometry (as WKB) of every region and keep it in their attrs
+    """
+    if REGIONS_KEY_ATTR not in agRegions.attrs:
+        digest = hashlib.sha256()
+        for crNum, district, wkb in zip(
+            agRegions["cr_num"], agRegions["district"], agRegions.geometry.to_wkb()
+        ):
+            digest.update(f"{crNum},{district},".encode())
+            digest.update(wkb)
+
+        agRegions.attrs[REGIONS_KEY_ATTR] = digest.hexdigest()
+
+    return agRegions.attrs[REGIONS_KEY_ATTR]
+
+
+def lookupKey(lats: np.ndarray, lons: np.ndarray, agRegions: gpd.GeoDataFrame) -> str:
+    """
+    Purpose:
+    Hashes a grid and the region geometries (see regionsKey) into the key of their lookup
+    """
+    digest = hashlib.sha256()
+    digest.update(lats.astype(np.float64).tobytes())
+    digest.update(lons.astype(np.float64).tobytes())
+    digest.update(regionsKey(agRegions).encode())
+
+    return digest.hexdigest()[:KEY_LEN]
+
+
+def loadRegionLookup(
+    gridLats: np.ndarray,
+    gridLons: np.ndarray,
+    agRegions: gpd.GeoDataFrame,
+    cacheDir: str,
+) -> RegionLookup:
+    """
+    Purpose:
+    Returns the lookup of a grid, only building it the first time the grid is seen
+
+    Pseudocode:
+    - Find the key of the grid and the regions (see lookupKey)
+    - Return the lookup if the current process already loaded it
+    - Read the lookup from the cache folder if it was built before
+    - Otherwise build the lookup and cache it
+
+    Remarks: gridLats and gridLons are the sorted axes of the grid (i.e the sorted coordinates of a dataset)
+    """
+    key = lookupKey(gridLats, gridLons, agRegions)
+
+    if key in LOOKUPS:
+        return LOOKUPS[key]
+
+    path = os.path.join(cacheDir, f"region_lookup_{key}.npz")
+    if os.path.exists(path):
+        lookup = readRegionLookup(path)
+    else:
+        lookup = buildRegionLookup(gridLats, gridLons, agRegions)
+        lookup.save(path)
+
+    LOOKUPS[key] = lookup
+    return lookup
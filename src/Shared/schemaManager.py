@@ -0,0 +1,247 @@
+# ----------------------------------------------------
+# schemaManager.py
+#
+# Declares and creates the secondary indexes of the station, satellite and moisture tables, refreshes their planner
+# statistics after bulk loads and can range partition the largest tables by year
+#
+# Typical usage example:
+#   python schemaManager.py [--partition]
+#
+#   schema = SchemaManager()
+#   schema.createIndexes(db, table)
+#   schema.analyze(db, table)
+#   schema.partitionByYear(db, table)
+#
+# Remarks:
+# - Composite B-tree indexes cover the columns the tables are filtered/joined on (station and date or date and district)
+# - BRIN indexes are used for dates on tables that are loaded in chronological order (tiny and cheap to maintain)
+# - Indexes are created with IF NOT EXISTS so they can be declared again every time a table is checked
+# ----------------------------------------------------
+from dotenv import load_dotenv
+import sqlalchemy as sq
+import os, sys, typing
+
+sys.path.append("../")
+from Shared.GenericQueryBuilder import GenericQueryBuilder
+from Shared.DataService import (
+    DataService,
+    createIndexReq,
+    UNIQUE_METHOD,
+    MAX_IDENTIFIER_LEN,
+)
+
+
+# The columns the weather station data is filtered by
+STATION_KEYS = ["station_id", "year", "month", "day"]
+
+# The columns the district level data is filtered by
+DISTRICT_KEYS = ["year", "month", "day", "district"]
+
+# The indexes of each table as (index method, columns)
+TABLE_INDEXES: typing.Dict[str, typing.List[typing.Tuple[str, typing.List[str]]]] = {
+    "ab_hly_station_data": [("btree", STATION_KEYS)],
+    "mb_hly_station_data": [("btree", STATION_KEYS)],
+    "sk_hly_station_data": [("btree", STATION_KEYS)],
+    "ab_dly_station_data": [("btree", STATION_KEYS)],
+    "mb_dly_station_data": [("btree", STATION_KEYS)],
+    "sk_dly_station_data": [("btree", STATION_KEYS)],
+    "agg_weather_combined": [(UNIQUE_METHOD, DISTRICT_KEYS)],
+    "agg_day_copernicus_satellite_data": [
+        ("btree", DISTRICT_KEYS),
+        ("brin", ["year", "month", "day"]),
+    ],
+    "soil_moisture": [("brin", ["date"])],
+    "agg_soil_moisture": [("btree", DISTRICT_KEYS)],
+}
+
+# The tables large enough to be worth partitioning by year
+PARTITIONED_TABLES = [
+    "ab_hly_station_data",
+    "mb_hly_station_data",
+    "sk_hly_station_data",
+    "ab_dly_station_data",
+    "mb_dly_station_data",
+    "sk_dly_station_data",
+    "agg_day_copernicus_satellite_data",
+]
+
+# The suffix given to a table while its rows are moved into partitions
+UNPARTITIONED_SUFFIX = "_unpartitioned"
+
+
+def main():
+    # Load the database connection environment variables located in the docker folder
+    # (only when ran as a script since this module is imported by the table creation code)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    load_dotenv("../docker/.env")
+    PG_DB = os.getenv("POSTGRES_DB")
+    PG_ADDR = os.getenv("POSTGRES_ADDR")
+    PG_PORT = os.getenv("POSTGRES_PORT")
+    PG_USER = os.getenv("POSTGRES_USER")
+    PG_PW = os.getenv("POSTGRES_PW")
+
+    if (
+        PG_DB is None
+        or PG_ADDR is None
+        or PG_PORT is None
+        or PG_USER is None
+        or PG_PW is None
+    ):
+        raise ValueError("Environment variables not set")
+
+    db = DataService(PG_DB, PG_ADDR, int(PG_PORT), PG_USER, PG_PW)
+    schema = SchemaManager()
+    partition = "--partition" in sys.argv[1:]
+
+    for table in TABLE_INDEXES.keys():
+        if not schema.tableExists(db, table):
+            print(f"[SKIPPED] {table} does not exist")
+            continue
+
+        if partition and table in PARTITIONED_TABLES:
+            schema.partitionByYear(db, table)
+
+        schema.createIndexes(db, table)
+        schema.analyze(db, table)
+        print(f"[SUCCESS] indexed and analyzed {table}")
+
+    db.cleanup()
+
+
+class SchemaManager(GenericQueryBuilder):
+    def createIndexesReq(self, table: str) -> str:
+        """
+        Purpose:
+        Creates the SQL query to create the indexes declared for a table (unexecuted)
+
+        Remarks: returns an empty string if the table has no declared indexes
+        """
+        queries = [
+            createIndexReq(table, method, cols)
+            for method, cols in TABLE_INDEXES.get(table, [])
+        ]
+
+        return "".join(queries)
+
+    def analyzeReq(self, table: str) -> str:
+        """
+        Purpose:
+        Creates the SQL query to refresh the planner statistics of a table (unexecuted)
+        """
+        return f"""
+        ANALYZE public.{table};
+        COMMIT;
+        """
+
+    def createIndexes(self, db: DataService, table: str):
+        """
+        Purpose:
+        Creates the indexes declared for a table (if they do not already exist)
+
+        Pseudocode:
+        - Create the SQL query for every index declared in TABLE_INDEXES
+        - Execute and commit it
+        """
+        query = self.createIndexesReq(table)
+
+        if query != "":
+            db.execute(sq.text(query + "COMMIT;"))
+
+    def analyze(self, db: DataService, table: str):
+        """
+        Purpose:
+        Refreshes the planner statistics of a table, should be ran after bulk loads so that the planner uses the indexes
+        """
+        db.execute(sq.text(self.analyzeReq(table)))
+
+    def tableExists(self, db: DataService, table: str) -> bool:
+        """
+        Purpose:
+        Checks if a table exists in the public schema
+        """
+        query = sq.text(f"SELECT to_regclass('public.{table}') IS NOT NULL;")
+        return bool(db.execute(query).scalar())  # type: ignore
+
+    def partitionByYear(self, db: DataService, table: str):
+        """
+        Purpose:
+        Converts a table into a table [range partitioned](https://www.postgresql.org/docs/current/ddl-partitioning.html) by year
+
+        Pseudocode:
+        - Skip tables that are already partitioned
+        - Start a transaction (the table is only replaced if every step succeeds)
+        - Rename the table and create the partitioned table with the same columns and defaults
+        - Create one partition per year present in the table and a default partition for any other year
+        - Move the rows into the partitioned table
+        - Hand the id sequence (if any) over to the partitioned table then drop the original table
+
+        Remarks:
+        - Primary keys on partitioned tables must include the partition key, so the id primary key is not carried over
+        - Rows for years outside of the range present when partitioning are stored in the default partition
+        """
+        original = f"{table}{UNPARTITIONED_SUFFIX}"
+
+        with db.engine.begin() as conn:
+            isPartitioned = conn.execute(
+                sq.text(
+                    f"SELECT EXISTS (SELECT FROM pg_partitioned_table WHERE partrelid = to_regclass('public.{table}'));"
+                )
+            ).scalar()
+
+            if isPartitioned:
+                return
+
+            conn.execute(sq.text(f"ALTER TABLE public.{table} RENAME TO {original};"))
+            conn.execute(
+                sq.text(
+                    f"""
+                    CREATE TABLE public.{table} (LIKE public.{original} INCLUDING DEFAULTS)
+                    PARTITION BY RANGE (year);
+                    """
+                )
+            )
+
+            years = conn.execute(
+                sq.text(f"SELECT MIN(year), MAX(year) FROM public.{original};")
+            ).first()
+
+            if years is not None and years[0] is not None:
+                for year in range(int(years[0]), int(years[1]) + 1):
+                    conn.execute(
+                        sq.text(
+                            f"""
+                            CREATE TABLE public.{table}_{year} PARTITION OF public.{table}
+                            FOR VALUES FROM ({year}) TO ({year + 1});
+                            """
+                        )
+                    )
+
+            conn.execute(
+                sq.text(
+                    f"CREATE TABLE public.{table}_default PARTITION OF public.{table} DEFAULT;"
+                )
+            )
+            conn.execute(
+                sq.text(f"INSERT INTO public.{table} SELECT * FROM public.{original};")
+            )
+
+            sequence = conn.execute(
+                sq.text(
+                    f"""
+                    SELECT pg_get_serial_sequence('public.{original}', column_name)
+                    FROM information_schema.columns
+                    WHERE table_schema = 'public' AND table_name = '{original}' AND column_name = 'id';
+                    """
+                )
+            ).scalar()
+
+            if sequence is not None:
+                conn.execute(
+                    sq.text(f"ALTER SEQUENCE {sequence} OWNED BY public.{table}.id;")
+                )
+
+            conn.execute(sq.text(f"DROP TABLE public.{original};"))
+
+
+if __name__ == "__main__":
+    main()
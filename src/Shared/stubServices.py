@@ -0,0 +1,314 @@
+# ----------------------------------------------------
+# stubServices.py
+#
+# Local stand-ins for the external data services, serving downloads recorded in a raw archive (see rawArchive.py)
+# so that the scrapers can be ran (and benchmarked) without sending a single request to the real services
+#
+# Typical usage example:
+#   archive = RawArchive("data/fixtures")
+#
+#   # the Climate Data Online services (dd.weather.gc.ca and api.weather.gc.ca)
+#   with StubServer(archive, latency=0.05, errorRate=0.01) as server:
+#       os.environ["CLIMATE_HOURLY_URL"] = server.url + "/collections/climate-hourly/items"
+#       df = ClimateDataRequester().get_hourly_data(stationID, 2022, 2022)
+#
+#   # the Copernicus CDS (a replacement for cdsapi.Client)
+#   client = StubClient(archive, "era5-land", latency=2)
+#   client.retrieve("reanalysis-era5-land", request, "data/copernicus.netcdf.zip")
+#
+#   # without a target, requests are queued as with cdsapi.Client(wait_until_complete=False)
+#   result = client.retrieve("reanalysis-era5-land", request)
+#   result.update(); result.reply["state"]  # queued, running, completed or failed
+#   result.download("data/copernicus.netcdf.zip")
+#
+# Remarks:
+# - Downloads are matched by the path and query of their URL, so files recorded from any host are served
+# - URLs that were never recorded are answered with HTTP 404
+# - latency is the number of seconds added to every request and errorRate the fraction of requests failing the way the
+#   service does when it pushes back (HTTP 503 with a Retry-After header, or a full CDS queue)
+# - The server runs in its own process (forked) so that serving the files does not count towards the scraper's CPU time
+# - The request counters are kept in shared memory so they can be read from any process
+# ----------------------------------------------------
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+import multiprocessing as mp
+import random, threading, time, typing
+
+from Shared.rawArchive import RawArchive, requestName
+
+
+HOST = "127.0.0.1"  # The stub server only listens locally
+# The number of seconds the stub asks to wait before retrying a failed request
+RETRY_AFTER = 0.1
+
+# The error the CDS raises when its request queue is full
+CDS_QUEUE_ERROR = "Too many queued requests"
+
+
+class StubServer:
+    def __init__(
+        self,
+        archive: RawArchive,
+        latency: float = 0,
+        errorRate: float = 0,
+        seed: int = 0,
+        retryAfter: float = RETRY_AFTER,
+    ):
+        """
+        Purpose:
+        Creates a server answering every archived download (any source) by the path and query of its URL
+
+        Remarks: seed makes the injected errors reproducible
+        """
+        self.archive = archive
+        self.latency = latency
+        self.errorRate = errorRate
+        self.retryAfter = retryAfter
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+        self.numRequests = mp.Value("i", 0)
+        self.numErrors = mp.Value("i", 0)
+
+        # The downloads as {path and query: (source, name)}
+        self.routes = {
+            routeOf(entry["name"]): (entry["source"], entry["name"])
+            for entry in archive.entries()
+        }
+
+        self.server: typing.Optional[ThreadingHTTPServer] = None
+        self.process: typing.Optional[mp.process.BaseProcess] = None
+        self.url = ""
+
+    def start(self) -> str:
+        """
+        Purpose:
+        Starts serving the archive and returns the server's URL (i.e http://127.0.0.1:41234)
+
+        Pseudocode:
+        - Bind the server to a free port
+        - Serve requests from a forked process (each request is handled on its own thread)
+        """
+        handler = type("BoundStubHandler", (StubHandler,), {"stub": self})
+        self.server = ThreadingHTTPServer((HOST, 0), handler)
+        self.server.daemon_threads = True
+
+        self.process = mp.get_context("fork").Process(
+            target=self.server.serve_forever, daemon=True
+        )
+        self.process.start()
+
+        self.url = f"http://{HOST}:{self.server.server_port}"
+        return self.url
+
+    def stop(self):
+        """
+        Purpose:
+        Stops the server and releases its port
+        """
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+        if self.server is not None:
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self) -> "StubServer":
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def respond(self, path: str) -> typing.Tuple[int, bytes]:
+        """
+        Purpose:
+        Answers a request (called from the server's threads)
+
+        Pseudocode:
+        - Wait for the configured latency
+        - Fail the request if an error is injected
+        - Return the archived download matching the path and query (404 if there is none)
+        """
+        time.sleep(self.latency)
+
+        with self.numRequests.get_lock():
+            self.numRequests.value += 1
+
+        with self.lock:
+            failed = self.rng.random() < self.errorRate
+
+        if failed:
+            with self.numErrors.get_lock():
+                self.numErrors.value += 1
+            return 503, b""
+
+        route = self.routes.get(path)
+        if route is None:
+            return 404, b""
+
+        return 200, self.archive.load(*route)
+
+    def getRequestCount(self) -> typing.Tuple[int, int]:
+        """
+        Purpose:
+        Returns the number of requests answered and how many of them failed on purpose
+        """
+        return self.numRequests.value, self.numErrors.value
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers GET requests with the downloads of the StubServer it is bound to"""
+
+    stub: StubServer
+    protocol_version = "HTTP/1.1"  # Keeps connections alive like the real services
+
+    def do_GET(self):
+        status, content = self.stub.respond(self.path)
+
+        self.send_response(status)
+        if status == 503:
+            self.send_header("Retry-After", str(self.stub.retryAfter))
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubClient:
+    def __init__(
+        self,
+        archive: RawArchive,
+        source: str,
+        latency: float = 0,
+        errorRate: float = 0,
+        seed: int = 0,
+    ):
+        """
+        Purpose:
+        Creates a stand-in for cdsapi.Client retrieving the requests archived under source
+
+        Remarks: latency stands for the time a request spends in the CDS queue and being prepared
+        """
+        self.archive = archive
+        self.source = source
+        self.latency = latency
+        self.errorRate = errorRate
+        self.rng = random.Random(seed)
+
+        self.numRequests = mp.Value("i", 0)
+        self.numErrors = mp.Value("i", 0)
+
+    def retrieve(
+        self, name: str, request: dict, target: typing.Optional[str] = None
+    ) -> typing.Optional["StubResult"]:
+        """
+        Purpose:
+        Writes the archived download of a request to target (as cdsapi.Client.retrieve does)
+
+        Pseudocode:
+        - Without a target, queue the request and return its result right away (see StubResult)
+        - Wait for the configured latency
+        - Raise the CDS's full queue error if an error is injected
+        - Write the archived download to target (raises FileNotFoundError if the request was never archived)
+        """
+        if target is None:
+            return self.submit(name, request)
+
+        time.sleep(self.latency)
+
+        with self.numRequests.get_lock():
+            self.numRequests.value += 1
+
+        if self.rng.random() < self.errorRate:
+            with self.numErrors.get_lock():
+                self.numErrors.value += 1
+            raise Exception(CDS_QUEUE_ERROR)
+
+        self.archive.restoreFile(self.source, requestName(name, request), target)
+        return None
+
+    def submit(self, name: str, request: dict) -> "StubResult":
+        """
+        Purpose:
+        Queues a request without waiting for it (as cdsapi.Client(wait_until_complete=False).retrieve does)
+
+        Remarks: the request completes once latency seconds have passed, errors are injected when it is submitted
+        """
+        with self.numRequests.get_lock():
+            self.numRequests.value += 1
+
+        if self.rng.random() < self.errorRate:
+            with self.numErrors.get_lock():
+                self.numErrors.value += 1
+            raise Exception(CDS_QUEUE_ERROR)
+
+        return StubResult(self, requestName(name, request))
+
+    def getRequestCount(self) -> typing.Tuple[int, int]:
+        """
+        Purpose:
+        Returns the number of requests retrieved and how many of them failed on purpose
+        """
+        return self.numRequests.value, self.numErrors.value
+
+
+class StubResult:
+    def __init__(self, client: StubClient, name: str):
+        """
+        Purpose:
+        Creates a queued request of a StubClient, shaped like the results of cdsapi.Client(wait_until_complete=False)
+
+        Remarks: reply holds the state of the request (queued, running, completed or failed) as of the last update
+        """
+        self.client = client
+        self.name = name
+        self.submittedAt = time.monotonic()
+        self.reply = {"state": "queued"}
+
+    def update(self):
+        """
+        Purpose:
+        Refreshes the state of the request
+
+        Pseudocode:
+        - The request runs once half of the latency has passed and completes once all of it has
+        - Requests that were never archived fail once completed (as if the CDS could not fulfill them)
+        """
+        elapsed = time.monotonic() - self.submittedAt
+
+        if elapsed < self.client.latency / 2:
+            self.reply = {"state": "queued"}
+        elif elapsed < self.client.latency:
+            self.reply = {"state": "running"}
+        elif self.client.archive.find(self.client.source, self.name) is None:
+            self.reply = {"state": "failed", "error": f"{self.name} is not archived"}
+        else:
+            self.reply = {"state": "completed"}
+
+    def download(self, target: str):
+        """
+        Purpose:
+        Writes the archived download of the request to target (raises an error if the request is not completed)
+        """
+        if self.reply["state"] != "completed":
+            raise Exception(f"Request is {self.reply['state']}")
+
+        self.client.archive.restoreFile(self.client.source, self.name, target)
+
+    def delete(self):
+        pass
+
+
+def routeOf(url: str) -> str:
+    """
+    Purpose:
+    Returns the path and query of a URL (what the stub server matches downloads by)
+    """
+    parts = urlsplit(url)
+
+    return parts.path + (f"?{parts.query}" if parts.query else "")
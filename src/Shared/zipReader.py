@@ -0,0 +1,102 @@
+# ----------------------------------------------------
+# zipReader.py
+#
+# Reads a file stored in a zip archive (i.e the NetCDF file of a Copernicus download) straight from the archive,
+# without extracting it to disk
+#
+# Typical usage example:
+#   with openMember("data/copernicus.netcdf.zip") as member:
+#       dataset = xr.open_dataset(member, engine="scipy")
+#
+# Remarks:
+# - Members stored without compression are read on demand through a memory map of the archive (never loaded whole)
+# - Compressed members are decompressed into memory once, as readers seek back and forth through the file
+# - The returned file is read-only and seekable
+# ----------------------------------------------------
+import io, mmap, typing, zipfile
+
+
+class MappedMember(io.RawIOBase):
+    def __init__(self, mapped: mmap.mmap, start: int, size: int):
+        """
+        Purpose:
+        Creates a read-only file over the bytes [start, start + size) of a memory mapped archive
+
+        Remarks: the file owns the memory map, closing the file closes it
+        """
+        self.mapped = mapped
+        self.start = start
+        self.size = size
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        origins = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}
+        self.position = max(0, origins[whence] + offset)
+
+        return self.position
+
+    def readinto(self, buffer: typing.Any) -> int:
+        """
+        Purpose:
+        Copies the next bytes of the member into buffer, returning how many were copied (0 at the end of the member)
+        """
+        end = min(self.position + len(buffer), self.size)
+        numBytes = max(0, end - self.position)
+
+        buffer[:numBytes] = self.mapped[
+            self.start + self.position : self.start + self.position + numBytes
+        ]
+        self.position += numBytes
+
+        return numBytes
+
+    def close(self):
+        if not self.closed:
+            self.mapped.close()
+        super().close()
+
+
+def openMember(zipPath: str, name: typing.Optional[str] = None) -> typing.BinaryIO:
+    """
+    Purpose:
+    Opens a member of a zip archive as a read-only file
+
+    Pseudocode:
+    - Find the member (the first one if no name is given)
+    - If it is stored without compression, map the archive into memory and find where the member's data starts
+      (after its local header, whose file name and extra field lengths can differ from the central directory's)
+    - Otherwise decompress the member into memory
+
+    Remarks: raises a KeyError if the archive has no such member
+    """
+    with zipfile.ZipFile(zipPath, "r") as archive:
+        infos = archive.infolist()
+        if len(infos) == 0:
+            raise KeyError(f"{zipPath} is empty")
+
+        info = infos[0] if name is None else archive.getinfo(name)
+        if info.compress_type != zipfile.ZIP_STORED:
+            return io.BytesIO(archive.read(info))
+
+    with open(zipPath, "rb") as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # the local header is 30 bytes followed by the file name and extra field (their lengths are stored at bytes 26-29)
+    header = info.header_offset
+    nameLen = int.from_bytes(mapped[header + 26 : header + 28], "little")
+    extraLen = int.from_bytes(mapped[header + 28 : header + 30], "little")
+    start = header + 30 + nameLen + extraLen
+
+    return typing.cast(
+        typing.BinaryIO,
+        io.BufferedReader(MappedMember(mapped, start, info.file_size)),
+    )
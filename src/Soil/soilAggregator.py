@@ -76,11 +76,8 @@ class SoilAggregator:
             soil_data, surronding_soil, soil_components, soil_geometry
         )
 
-        # Add the resulting table to database, commit it then close the connection
-        merge_df.to_sql(
-            TABLENAME, conn, schema="public", if_exists="replace", index=False
-        )
-        conn.commit()
+        # Swap the resulting table in place of the previous one (committed once written) then close the connection
+        db.replaceTable(merge_df, TABLENAME)
         db.cleanup()
 
     def pullSoilData(self, conn: sq.engine.Connection) -> pd.DataFrame:
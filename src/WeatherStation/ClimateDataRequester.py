@@ -7,18 +7,60 @@
 #   req = ClimateDataRequester()
 #   dlyDF = req.get_data(stationName: str)
 #   hlyDF = req.get_hourly_data(stationName: str)
+#
+# Remarks:
+# - Every request made by a requester reuses the same pooled (keep-alive, gzip) session
+# - Every request goes through a rate limiter (pass the same limiter to every requester to share its budget)
+# - The daily file listing of each province is only downloaded once per requester (then indexed by station and year)
+# - When a raw archive is provided, every downloaded file is archived (record mode) or read back from it (replay mode)
+# - The service URLs can be overridden with CLIMATE_DAILY_URL and CLIMATE_HOURLY_URL (i.e to point to a local stub server)
 # -------------------------------------------
+from concurrent.futures import ThreadPoolExecutor
 import requests as rq
 import pandas as pd
 import lxml.html
 import urllib3
-import typing
+import typing, json, sys, io, os
+
+sys.path.append("../")
+from Shared.rateLimiter import RateLimiter
+from Shared.rawArchive import RawArchive
+
+
+# The services used to request daily and hourly data
+DAILY_URL = "https://dd.weather.gc.ca/climate/observations/"
+HOURLY_URL = "https://api.weather.gc.ca/collections/climate-hourly/items"
+
+# The environment variables overriding the service URLs
+DAILY_URL_ENV = "CLIMATE_DAILY_URL"
+HOURLY_URL_ENV = "CLIMATE_HOURLY_URL"
+
+PAGE_SIZE = 10000  # The number of rows the hourly data service returns per request
+MAX_WORKERS = 4  # The number of pages downloaded at once
+TIMEOUT = 60  # The number of seconds to wait for a response
+REQUEST_RATE = (
+    5  # The default number of requests per second (when no limiter is provided)
+)
+
+# The sources the downloads are archived under
+HOURLY_SOURCE = "climate-hourly"
+DAILY_SOURCE = "climate-daily"
+LISTING_SOURCE = "climate-daily-listing"
+
+# The position of the station ID and date in the names of the daily files (i.e climate_daily_AB_3010010_2004-07_P1D.csv)
+STATION_POS = 3
+DATE_POS = 4
 
 
 class ClimateDataRequester:
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        limiter: typing.Optional[RateLimiter] = None,
+        archive: typing.Optional[RawArchive] = None,
+    ) -> None:
         urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-        self.apiBaseURL = "https://dd.weather.gc.ca/climate/observations/"
+        self.apiBaseURL = os.getenv(DAILY_URL_ENV) or DAILY_URL
+        self.hourlyURL = os.getenv(HOURLY_URL_ENV) or HOURLY_URL
         self.defaultPath = "daily/csv/"
         self.headers = {
             "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
@@ -34,103 +76,317 @@ class ClimateDataRequester:
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:96.0) Gecko/20100101 Firefox/96.0",
         }
 
+        # Keeps connections alive between requests (one connection per concurrent page download)
+        self.session = rq.Session()
+        adapter = rq.adapters.HTTPAdapter(pool_maxsize=MAX_WORKERS)
+        self.session.mount("https://", adapter)
+
+        # Limits how fast requests are sent and retries them when the service pushes back
+        self.limiter = (
+            limiter if limiter is not None else RateLimiter(REQUEST_RATE, MAX_WORKERS)
+        )
+
+        # Keeps a copy of every downloaded file (or replays them without any request in replay mode)
+        self.archive = archive
+
+        # The daily files of each province indexed as {province: {stationID: {year: [files]}}}
+        self.listings: typing.Dict[str, typing.Dict[str, typing.Dict[int, list]]] = {}
+
     def get_hourly_data(
-        self, stationID: str, startYear: int = 2022, endYear: int = 2022
+        self,
+        stationID: str,
+        startYear: int = 2022,
+        endYear: int = 2022,
+        readOptions: typing.Optional[dict] = None,
     ) -> pd.DataFrame:
         """
         Purpose:
         Requests hourly data from the [Climate Data Online web service](https://dd.weather.gc.ca/climate/observations/)
 
         Pseudocode:
-        - Load the base URL (used for downloading the data), injecting it with both the start ane end year
-        - Load the URL extension (used for downloading the data)
-        - Specify how much data can be read at once
-        - Download data and add it to the DataFrame until it has all been downloaded
+        - Load the URL of the station's data between the start and end year
+        - Request the number of matching rows, to know how many pages of data there are
+        - Download every page concurrently over the shared session (parsing each page once)
+            - If the number of rows is unknown, download pages in batches until a page is not full
+        - Concatenate the pages once all of them have been downloaded
+
+        Remarks:
+        - failed requests raise an exception rather than returning partial data
+        - readOptions are passed to read_csv (i.e ScrapingProcessor.readOptions(HOURLY_SCHEMA) to only parse the columns that are kept)
         """
-        baseUrl = f"https://api.weather.gc.ca/collections/climate-hourly/items?datetime={startYear}-01-01%2000:00:00/{endYear}-12-31%2000:00:00&CLIMATE_IDENTIFIER="
-        midUrl = "&sortby=PROVINCE_CODE,CLIMATE_IDENTIFIER,LOCAL_DATE&f=csv&limit=10000&startindex="
-        offset = 10000  # How much information can be read in a single request
+        url = self.hourly_url(stationID, startYear, endYear)
+        period = f"{startYear}-{endYear}"
+        numRows = self.get_hourly_count(url, stationID, period)
 
-        df = pd.DataFrame()  # Creates a dataframe to load the information into
-        # The current position to read data from (since each request can only contain so much information)
-        currIndex = 0
+        with ThreadPoolExecutor(MAX_WORKERS) as executor:
+            if numRows is not None:
+                offsets = range(0, numRows, PAGE_SIZE)
+                pages = list(
+                    executor.map(
+                        lambda i: self.pull_page(
+                            url, i, readOptions, stationID, period
+                        ),
+                        offsets,
+                    )
+                )
+            else:
+                pages = []
+                while len(pages) == 0 or len(pages[-1].index) == PAGE_SIZE:
+                    offsets = range(
+                        len(pages) * PAGE_SIZE,
+                        (len(pages) + MAX_WORKERS) * PAGE_SIZE,
+                        PAGE_SIZE,
+                    )
+                    pages += list(
+                        executor.map(
+                            lambda i: self.pull_page(
+                                url, i, readOptions, stationID, period
+                            ),
+                            offsets,
+                        )
+                    )
 
-        try:
-            newData = pd.read_csv(baseUrl + stationID + midUrl + str(currIndex))
-            while len(newData.index) > 0:
-                df = pd.concat([df, newData])
-                currIndex += offset
+                    # stop at the first page that is not full (the following pages are empty)
+                    for i, page in enumerate(pages):
+                        if len(page.index) < PAGE_SIZE:
+                            pages = pages[: i + 1]
+                            break
 
-                newData = pd.read_csv(baseUrl + stationID + midUrl + str(currIndex))
-        except Exception:
-            pass
+        pages = [page for page in pages if len(page.index) > 0]
+        if len(pages) == 0:
+            return pd.DataFrame()
 
-        return df
+        return pd.concat(pages, ignore_index=True)
+
+    def get_hourly_count(
+        self, url: str, stationID: str = "", period: str = ""
+    ) -> typing.Optional[int]:
+        """
+        Purpose:
+        Requests the number of rows matching an hourly data query (None if the service does not report it)
+
+        Pseudocode:
+        - Request a single row of the query as JSON
+        - Return the number of rows the service reports as matching the query
+
+        Remarks: stationID and period are only used to label the download in the raw archive
+        """
+        content = self.fetch(self.count_url(url), HOURLY_SOURCE, stationID, period)
+
+        numRows = json.loads(content).get("numberMatched")
+        return int(numRows) if numRows is not None else None
+
+    def pull_page(
+        self,
+        url: str,
+        startIndex: int,
+        readOptions: typing.Optional[dict] = None,
+        stationID: str = "",
+        period: str = "",
+    ) -> pd.DataFrame:
+        """
+        Purpose:
+        Downloads a single page (PAGE_SIZE rows starting at startIndex) of an hourly data query
+
+        Pseudocode:
+        - Request the page as CSV
+        - If the page holds data, [load it into a DataFrame](https://pandas.pydata.org/docs/reference/api/pandas.read_csv.html)
+
+        Remarks: stationID and period are only used to label the download in the raw archive
+        """
+        content = self.fetch(
+            self.page_url(url, startIndex), HOURLY_SOURCE, stationID, period
+        )
+
+        if len(content.strip()) == 0:
+            return pd.DataFrame()
+
+        return pd.read_csv(io.BytesIO(content), **(readOptions or {}))
+
+    def hourly_url(self, stationID: str, startYear: int, endYear: int) -> str:
+        """
+        Purpose:
+        Creates the URL of a station's hourly data between the start and end year (sorted by station and date)
+        """
+        return (
+            f"{self.hourlyURL}?datetime={startYear}-01-01%2000:00:00/{endYear}-12-31%2000:00:00"
+            f"&CLIMATE_IDENTIFIER={stationID}&sortby=PROVINCE_CODE,CLIMATE_IDENTIFIER,LOCAL_DATE"
+        )
+
+    def count_url(self, url: str) -> str:
+        """
+        Purpose:
+        Creates the URL requesting the number of rows of an hourly data query
+        """
+        return f"{url}&f=json&limit=1"
+
+    def page_url(self, url: str, startIndex: int) -> str:
+        """
+        Purpose:
+        Creates the URL requesting a page (PAGE_SIZE rows starting at startIndex) of an hourly data query
+        """
+        return f"{url}&f=csv&limit={PAGE_SIZE}&startindex={startIndex}"
+
+    def daily_url(self, url: str) -> str:
+        """
+        Purpose:
+        Creates the URL of a daily file from its path in the listing (i.e AB/climate_daily_AB_3010010_2004-07_P1D.csv)
+        """
+        return self.apiBaseURL + self.defaultPath + url
+
+    def listing_url(self, province: str) -> str:
+        """
+        Purpose:
+        Creates the URL of the page listing the daily files of a province
+        """
+        return self.apiBaseURL + self.defaultPath + province + "/"
+
+    def fetch(self, url: str, source: str, key: str, period: str, **kwargs) -> bytes:
+        """
+        Purpose:
+        Downloads a file, going through the raw archive when one is provided
+
+        Pseudocode:
+        - In replay mode, read the file from the archive (raises FileNotFoundError if it was never archived)
+        - Otherwise request the file
+        - Archive the file if an archive is provided
+
+        Remarks: source, key (station/province) and period label the download in the archive's manifest
+        """
+        if self.archive is not None and self.archive.replay:
+            return self.archive.load(source, url)
+
+        content = self.request(url, **kwargs).content
+
+        if self.archive is not None:
+            self.archive.put(content, source, key, period, url)
+
+        return content
+
+    def request(self, url: str, **kwargs) -> rq.Response:
+        """
+        Purpose:
+        Sends a GET request over the shared session once the rate limiter allows it
+
+        Pseudocode:
+        - Wait for the rate limiter
+        - Send the request, raising an exception if it failed
+            - Requests the service pushed back on (HTTP 429/5xx) are retried by the rate limiter
+        """
+
+        def get() -> rq.Response:
+            res = self.session.get(url, timeout=TIMEOUT, **kwargs)
+            res.raise_for_status()
+            return res
+
+        return self.limiter.call(get)
 
     def get_data(
-        self, province: str, stationID: str, startYear: int = 2022, endYear: int = 2022
+        self,
+        province: str,
+        stationID: str,
+        startYear: int = 2022,
+        endYear: int = 2022,
+        readOptions: typing.Optional[dict] = None,
     ) -> pd.DataFrame:
         """
         Purpose:
         Requests daily data from the [Climate Data Online web service](https://dd.weather.gc.ca/climate/observations/)
 
         Psuedocode:
-        - Get the list of potential daily files to download (if none exit)
-        - Remove irrelevant files to download - does not fall within startYear - endYear (if none exit)
-        - For each remaining URL, load the data into a list of DataFrames
+        - Get the station's daily files between startYear - endYear from the province's indexed listing (if none exit)
+            - In replay mode, only keep the files in the raw archive
+        - For each file, load the data into a list of DataFrames
         - Concatenate all DataFrames into one: https://pandas.pydata.org/docs/reference/api/pandas.concat.html
+
+        Remarks: readOptions are passed to read_csv (i.e ScrapingProcessor.readOptions(DAILY_SCHEMA) to only parse the columns that are kept)
         """
         df = pd.DataFrame()
 
-        urlList = self.get_url_list(province, stationID)
-        if len(urlList) == 0:
-            return df
+        years = self.get_listing(province).get(stationID, {})
+        trimmedList = [
+            url for year in range(startYear, endYear + 1) for url in years.get(year, [])
+        ]
+
+        # In replay mode, only the files that were archived can be read (the others were not pulled when recording)
+        if self.archive is not None and self.archive.replay:
+            trimmedList = [
+                url
+                for url in trimmedList
+                if self.archive.find(DAILY_SOURCE, self.daily_url(province + "/" + url))
+                is not None
+            ]
 
-        trimmedList = self.trim_by_date(urlList, startYear, endYear)
         if len(trimmedList) == 0:
             return df
 
         dfList = []
         for url in trimmedList:
-            dfList.append(self.pull_data(province + "/" + url))
+            dfList.append(self.pull_data(province + "/" + url, readOptions))
 
         df = pd.concat(dfList)
         return df
 
-    @typing.no_type_check
     def get_url_list(self, province: str, stationID: str = "") -> list:
         """
         Purpose:
         Gets the list of potential daily files to download
 
         Psuedocode:
+        - Get the province's indexed listing
+        - Add each file of the provided stationID
+
+        Remarks: If no stationID is provided, all files of the province are added
+        """
+        listing = self.get_listing(province)
+        stations = listing.values() if not stationID else [listing.get(stationID, {})]
+
+        return [url for years in stations for urls in years.values() for url in urls]
+
+    @typing.no_type_check
+    def get_listing(self, province: str) -> typing.Dict[str, typing.Dict[int, list]]:
+        """
+        Purpose:
+        Gets the daily files of a province indexed by station and year (only downloaded once per requester)
+
+        Psuedocode:
+        - Return the index if the province was already loaded
         - Loads the download html page
         - [Get the list of files that can be downloaded](lxml.html.fromstring)
-        - Add each link that ends with .csv and matches the provided stationID
+        - Add each link that ends with .csv under its station and year
 
-        Remarks: If no stationID is provided, all links that end with .csv are added
+        Remarks: the listing is not kept if it could not be downloaded, so that it is requested again
         """
-        result = []
+        if province in self.listings:
+            return self.listings[province]
 
-        res = rq.get(
-            self.apiBaseURL + self.defaultPath + province + "/",
-            headers=self.headers,
-            verify=False,
-        )
+        listing: typing.Dict[str, typing.Dict[int, list]] = {}
+
+        try:
+            content = self.fetch(
+                self.listing_url(province),
+                LISTING_SOURCE,
+                province,
+                "",
+                headers=self.headers,
+                verify=False,
+            )
+        except Exception as e:
+            print(f"[Error]: {e}")
+            return listing
 
-        if res.status_code == 200:
-            tree = lxml.html.fromstring(res.text)
+        tree = lxml.html.fromstring(content)
 
-            for link in tree.xpath("//a/@href"):
-                if link.endswith(".csv"):
-                    # If no stationID was provided when the function was called, add everything
-                    if not stationID:
-                        result.append(link)
-                    # Otherwise add only the links that correspond to the given stationID
-                    elif link.find(stationID) > -1:
-                        result.append(link)
+        for link in tree.xpath("//a/@href"):
+            entry = link.split("_")
+            if link.endswith(".csv") and len(entry) > DATE_POS:
+                year = int(str(entry[DATE_POS])[:4])
+                listing.setdefault(entry[STATION_POS], {}).setdefault(year, []).append(
+                    link
+                )
 
-        return result
+        self.listings[province] = listing
+        return listing
 
     def trim_by_date(self, csvList: list, startYear: int, endYear: int) -> list:
         """
@@ -155,19 +411,38 @@ class ClimateDataRequester:
 
         return result
 
-    def pull_data(self, url: str) -> pd.DataFrame:
+    def pull_data(
+        self, url: str, readOptions: typing.Optional[dict] = None
+    ) -> pd.DataFrame:
         """
         Purpose:
         Given a csv download links, download the file
 
         Psuedocode:
-        - Try to request the data given the default URL schema, and if possible, [load it directly into a DataFrame](https://pandas.pydata.org/docs/reference/api/pandas.read_csv.html)
+        - Try to request the data given the default URL schema over the shared session
+        - If possible, [load it directly into a DataFrame](https://pandas.pydata.org/docs/reference/api/pandas.read_csv.html)
         """
         df = pd.DataFrame()
 
+        # The station and month of the file (i.e AB/climate_daily_AB_3010010_2004-07_P1D.csv)
+        entry = url.split("/")[-1].split("_")
+        stationID = entry[STATION_POS] if len(entry) > DATE_POS else ""
+        period = entry[DATE_POS] if len(entry) > DATE_POS else ""
+
         try:
-            path = self.apiBaseURL + self.defaultPath + url
-            df = pd.read_csv(path, encoding="ISO-8859-1")
+            path = self.daily_url(url)
+            content = self.fetch(
+                path,
+                DAILY_SOURCE,
+                stationID,
+                period,
+                headers=self.headers,
+                verify=False,
+            )
+
+            df = pd.read_csv(
+                io.BytesIO(content), encoding="ISO-8859-1", **(readOptions or {})
+            )
         except Exception as e:
             print(f"[Error]: {e}")
 
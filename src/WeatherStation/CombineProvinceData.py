@@ -10,11 +10,20 @@
 #
 # Output:
 #   - [agg_weather_combined](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#agg_weather_combined)
+#   - weather_station_changes: the changes recorded by the scrapers are removed once aggregated
+#
+# Typical usage example:
+#   python CombineProvinceData.py [--full]
+#
+# Remarks:
+# - Once the table has been built, only the district days whose weather station data was written or deleted since the last
+#   run (as recorded in weather_station_changes by the scrapers) are aggregated again and replaced (--full rebuilds the whole table)
+# - Changes to the districts of the stations need a full rebuild
 # -------------------------------------------
 from dotenv import load_dotenv
 import sqlalchemy as sq
 import pandas as pd
-import os, sys
+import os, sys, typing
 
 try:
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
@@ -23,6 +32,9 @@ except:
 
 sys.path.append("../")
 from Shared.DataService import DataService
+from Shared.chunkAggregator import ChunkAggregator
+from Shared.schemaManager import SchemaManager, TABLE_INDEXES
+from WeatherStation.WeatherQueryBuilder import WeatherQueryBuilder, CHANGES_TABLE
 
 
 DLY_STATIONS = "stations_dly"  # table that contains the hourly stations
@@ -38,6 +50,127 @@ SK_HLY_TABLE = "sk_hly_station_data"  # table that contains Saskatchewans data
 
 TABLENAME = "agg_weather_combined"  # The name of the table that will hold the results
 
+HLY_TABLES = [AB_HLY_TABLE, MB_HLY_TABLE, SK_HLY_TABLE]
+DLY_TABLES = [AB_DLY_TABLE, MB_DLY_TABLE, SK_DLY_TABLE]
+
+# The attributes of the hourly weather station data
+HLY_ATTRS = [
+    "min_temp",
+    "max_temp",
+    "mean_temp",
+    "min_dew_point_temp",
+    "max_dew_point_temp",
+    "mean_dew_point_temp",
+    "min_humidex",
+    "max_humidex",
+    "mean_humidex",
+    "total_precip",
+    "min_rel_humid",
+    "max_rel_humid",
+    "mean_rel_humid",
+    "min_stn_press",
+    "max_stn_press",
+    "mean_stn_press",
+    "min_visibility",
+    "max_visibility",
+    "mean_visibility",
+]
+
+# The attributes of the daily weather station data that are aggregated
+DLY_ATTRS = [
+    "max_temp",
+    "min_temp",
+    "mean_temp",
+    "total_rain",
+    "total_snow",
+    "total_precip",
+    "snow_on_grnd",
+]
+
+# How each attribute is aggregated (see DataFrame.agg) and the names of the aggregated columns
+HLY_AGGS = {
+    "min_temp": "min",
+    "max_temp": "max",
+    "mean_temp": "mean",
+    "min_dew_point_temp": "min",
+    "max_dew_point_temp": "max",
+    "mean_dew_point_temp": "mean",
+    "min_humidex": "min",
+    "max_humidex": "max",
+    "mean_humidex": "mean",
+    "total_precip": ["min", "max", "mean"],
+    "min_rel_humid": "min",
+    "max_rel_humid": "max",
+    "mean_rel_humid": "mean",
+    "min_stn_press": "min",
+    "max_stn_press": "max",
+    "mean_stn_press": "mean",
+    "min_visibility": "min",
+    "max_visibility": "max",
+    "mean_visibility": "mean",
+}
+HLY_AGG_COLS = [
+    "min_temp",
+    "max_temp",
+    "mean_temp",
+    "min_dew_point_temp",
+    "max_dew_point_temp",
+    "mean_dew_point_temp",
+    "min_humidex",
+    "max_humidex",
+    "mean_humidex",
+    "min_precip",
+    "max_precip",
+    "mean_precip",
+    "min_rel_humid",
+    "max_rel_humid",
+    "mean_rel_humid",
+    "min_stn_press",
+    "max_stn_press",
+    "mean_stn_press",
+    "min_visibility",
+    "max_visibility",
+    "mean_visibility",
+]
+
+DLY_AGGS = {
+    "max_temp": "max",
+    "min_temp": "min",
+    "mean_temp": "mean",
+    "total_rain": ["min", "max", "mean"],
+    "total_snow": ["min", "max", "mean"],
+    "total_precip": ["min", "max", "mean"],
+    "snow_on_grnd": ["min", "max", "mean"],
+}
+DLY_AGG_COLS = [
+    "max_temp",
+    "min_temp",
+    "mean_temp",
+    "min_total_rain",
+    "max_total_rain",
+    "mean_total_rain",
+    "min_total_snow",
+    "max_total_snow",
+    "mean_total_snow",
+    "min_total_precip",
+    "max_total_precip",
+    "mean_total_precip",
+    "min_snow_on_grnd",
+    "max_snow_on_grnd",
+    "mean_snow_on_grnd",
+]
+
+# The columns the weather station data is aggregated by
+AGG_KEYS = ["district", "year", "month", "day"]
+
+# Aggregate the data in PostgreSQL (GROUP BY) so only the aggregated rows are loaded instead of every row
+AGGREGATE_IN_DB = True
+
+# The types the weather station data is loaded as (float32 halves the memory used by the attributes)
+KEY_DTYPES = {"year": "int16", "month": "int16", "day": "int16"}
+HLY_DTYPES = {**KEY_DTYPES, **{attr: "float32" for attr in HLY_ATTRS}}
+DLY_DTYPES = {**KEY_DTYPES, **{attr: "float32" for attr in DLY_ATTRS}}
+
 
 # Load the database connection environment variables located in the docker folder
 try:
@@ -64,30 +197,29 @@ def main():
         raise ValueError("Environment variables not set")
 
     db = DataService(PG_DB, PG_ADDR, int(PG_PORT), PG_USER, PG_PW)
-    conn = db.connect()
-
-    weatherDataHly = pullHlyWeatherData(conn)
-    weatherDataDly = pullDlyWeatherData(conn)
-    stationData = pullStationData(conn)
-
-    # merge both the weather station data and the station data together
-    dfHly = weatherDataHly.merge(stationData, on="station_id")
-    dfDly = weatherDataDly.merge(stationData, on="station_id")
-
-    # drop station_id column
-    dfHly = dfHly.drop(columns=["station_id"])
-    dfDly = dfDly.drop(columns=["station_id"])
-
-    agg_dfHly = aggregateHlyData(dfHly)
-    agg_dfDly = aggregateDlyData(dfDly)
-
-    # merge on year month day district
-    dfCombined = agg_dfHly.merge(agg_dfDly, on=["year", "month", "day", "district"])
+    queryHandler = WeatherQueryBuilder()
+    schema = SchemaManager()
+    full = "--full" in sys.argv[1:]
+
+    # Changes recorded from now on are aggregated by the next run (taken before reading any data)
+    tracked = schema.tableExists(db, CHANGES_TABLE)
+    db.execute(sq.text(queryHandler.createChangesTableReq()))
+    with db.checkout() as conn, conn.begin():
+        query = sq.text(queryHandler.lastChangeReq())
+        lastChange = int(conn.execute(query).scalar())  # type: ignore
+
+    # Only the database can tell which rows changed, data written before the changes were recorded needs a full rebuild
+    incremental = (
+        not full and AGGREGATE_IN_DB and tracked and schema.tableExists(db, TABLENAME)
+    )
 
     try:
-        dfCombined.to_sql(
-            TABLENAME, conn, schema="public", if_exists="replace", index=False
-        )
+        if incremental:
+            updateCombinedData(db, queryHandler, schema, lastChange)
+        else:
+            rebuildCombinedData(db)
+            with db.checkout() as conn, conn.begin():
+                conn.execute(sq.text(queryHandler.deleteChangesReq(lastChange)))
     except Exception as e:
         print("An error occurred while writing to the database {}".format(e))
         raise e
@@ -95,178 +227,179 @@ def main():
     db.cleanup()
 
 
-def pullHlyWeatherData(conn: sq.engine.Connection) -> pd.DataFrame:
+def rebuildCombinedData(db: DataService):
     """
     Purpose:
-    Loads the weather station data per province from the weather station data tables
+    Aggregates all of the weather station data and replaces agg_weather_combined with it
 
     Tables:
-    - [ab_hly_station_data](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#ab_hly_station_data)
-    - [mb_hly_station_data](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#mb_hly_station_data)
-    - [sk_hly_station_data](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#sk_hly_station_data)
+    - [agg_weather_combined](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#agg_weather_combined)
 
-    Psuedocode:
-    - Create the weather station data SQL query
-    - [Load the data from the database directly into a DataFrame](https://pandas.pydata.org/docs/reference/api/pandas.read_sql.html)
+    Pseudocode:
+    - Aggregate the hourly and daily data by district and day (see combineData)
+    - Swap the results in place of the table, indexed and analyzed (readers keep the old table until the swap)
     """
-    weatherDataQuery = sq.text(
-        f"""
-        SELECT * FROM public.{AB_HLY_TABLE}
-        UNION
-        SELECT * FROM public.{MB_HLY_TABLE}
-        UNION
-        SELECT * FROM public.{SK_HLY_TABLE};
-        """
-    )
+    dfCombined = combineData(db)
+    db.replaceTable(dfCombined, TABLENAME, indexes=TABLE_INDEXES[TABLENAME])
 
-    return pd.read_sql(weatherDataQuery, conn)
+    print(f"[SUCCESS] Rebuilt {TABLENAME} with {len(dfCombined.index)} district days")
 
 
-def pullDlyWeatherData(conn: sq.engine.Connection) -> pd.DataFrame:
+def updateCombinedData(
+    db: DataService,
+    queryHandler: WeatherQueryBuilder,
+    schema: SchemaManager,
+    lastChange: int,
+):
     """
     Purpose:
-    Loads the weather station data per province from the weather station data tables
+    Aggregates the district days whose weather station data changed since the last run and replaces them in agg_weather_combined
 
     Tables:
-    - [ab_dly_station_data](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#ab_dly_station_data)
-    - [mb_dly_station_data](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#mb_dly_station_data)
-    - [sk_dly_station_data](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#sk_dly_station_data)
+    - [agg_weather_combined](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#agg_weather_combined)
+    - weather_station_changes
 
-    Psuedocode:
-    - Create the weather station data SQL query
-    - [Load the data from the database directly into a DataFrame](https://pandas.pydata.org/docs/reference/api/pandas.read_sql.html)
+    Pseudocode:
+    - List the (district, year, month, day) keys of the hourly or daily data changes recorded up to lastChange
+    - Aggregate the hourly and daily data of those keys only (see combineData)
+    - In one transaction, delete the rows of those keys, append the results and remove the aggregated changes
+      (the unique index on the keys is created if the table predates it)
+    - Refresh the planner statistics
+
+    Remarks: district days left without data are deleted, if the update fails the changes are kept for the next run
     """
-    weatherDataQuery = sq.text(
-        f"""
-        SELECT * FROM public.{AB_DLY_TABLE}
-        UNION
-        SELECT * FROM public.{MB_DLY_TABLE}
-        UNION
-        SELECT * FROM public.{SK_DLY_TABLE};
-        """
+    query = sq.text(
+        queryHandler.changedKeysReq(lastChange, HLY_TABLES + DLY_TABLES, DLY_STATIONS)
     )
+    keys = [tuple(key) for key in db.execute(query)]  # type: ignore
+
+    if len(keys) == 0:
+        with db.checkout() as conn, conn.begin():
+            conn.execute(sq.text(queryHandler.deleteChangesReq(lastChange)))
+        print(f"[SUCCESS] {TABLENAME} is up to date")
+        return
+
+    dfCombined = combineData(db, keys)
+
+    schema.createIndexes(db, TABLENAME)
+    preQueries = [
+        queryHandler.deleteDistrictDaysReq(TABLENAME, keys),
+        queryHandler.deleteChangesReq(lastChange),
+    ]
+    db.bulkWrite(dfCombined, TABLENAME, preQueries=preQueries)
+    schema.analyze(db, TABLENAME)
 
-    return pd.read_sql(weatherDataQuery, conn)
+    print(
+        f"[SUCCESS] Updated {len(dfCombined.index)} of the {len(keys)} changed district days in {TABLENAME}"
+    )
 
 
-def aggregateHlyData(df: pd.DataFrame) -> pd.DataFrame:
+def combineData(
+    db: DataService, keys: typing.Optional[typing.List[tuple]] = None
+) -> pd.DataFrame:
     """
     Purpose:
-    Aggregate the hourly weather station data by district, year, month and day
+    Aggregates the hourly and daily weather station data by district and day then combines them
 
     Psuedocode:
-    - Aggregate the columns by district, year, month and day
-    - Name the columns into the final DataFrame
+    - Aggregate the hourly and daily data (in the database or in pandas as per AGGREGATE_IN_DB)
+    - Merge them on the district and day
+    - Cast the results to the column types the table is stored with
+
+    Remarks: keys restricts the aggregation to some (district, year, month, day) keys (only when aggregating in the database)
     """
-    agg_df = (
-        df.groupby(["district", "year", "month", "day"])
-        .agg(
-            {
-                "min_temp": "min",
-                "max_temp": "max",
-                "mean_temp": "mean",
-                "min_dew_point_temp": "min",
-                "max_dew_point_temp": "max",
-                "mean_dew_point_temp": "mean",
-                "min_humidex": "min",
-                "max_humidex": "max",
-                "mean_humidex": "mean",
-                "total_precip": ["min", "max", "mean"],
-                "min_rel_humid": "min",
-                "max_rel_humid": "max",
-                "mean_rel_humid": "mean",
-                "min_stn_press": "min",
-                "max_stn_press": "max",
-                "mean_stn_press": "mean",
-                "min_visibility": "min",
-                "max_visibility": "max",
-                "mean_visibility": "mean",
-            }
+    if AGGREGATE_IN_DB:
+        agg_dfHly = pullAggregatedData(db, HLY_TABLES, HLY_AGGS, HLY_AGG_COLS, keys)
+        agg_dfDly = pullAggregatedData(db, DLY_TABLES, DLY_AGGS, DLY_AGG_COLS, keys)
+    else:
+        stationData = pullStationData(db.connect())
+        agg_dfHly = aggregateWeatherData(
+            db, HLY_TABLES, HLY_DTYPES, HLY_AGGS, HLY_AGG_COLS, stationData
+        )
+        agg_dfDly = aggregateWeatherData(
+            db, DLY_TABLES, DLY_DTYPES, DLY_AGGS, DLY_AGG_COLS, stationData
         )
-        .reset_index()
+
+    # merge on year month day district
+    dfCombined = agg_dfHly.merge(agg_dfDly, on=["year", "month", "day", "district"])
+
+    # store the results with the same column types as before the data was loaded with narrower types
+    floatCols = dfCombined.select_dtypes("float32").columns
+    dfCombined = dfCombined.astype(
+        {
+            **{col: "int64" for col in KEY_DTYPES},
+            **{col: "float64" for col in floatCols},
+        }
     )
 
-    # sets the column names for the aggregate dataframe
-    agg_df.columns = [  # type: ignore
-        "district",
-        "year",
-        "month",
-        "day",
-        "min_temp",
-        "max_temp",
-        "mean_temp",
-        "min_dew_point_temp",
-        "max_dew_point_temp",
-        "mean_dew_point_temp",
-        "min_humidex",
-        "max_humidex",
-        "mean_humidex",
-        "min_precip",
-        "max_precip",
-        "mean_precip",
-        "min_rel_humid",
-        "max_rel_humid",
-        "mean_rel_humid",
-        "min_stn_press",
-        "max_stn_press",
-        "mean_stn_press",
-        "min_visibility",
-        "max_visibility",
-        "mean_visibility",
-    ]
+    return dfCombined
 
-    return agg_df
 
+def aggregateWeatherData(
+    db: DataService,
+    dataTables: list,
+    dtypes: dict,
+    aggs: dict,
+    aggCols: list,
+    stationData: pd.DataFrame,
+) -> pd.DataFrame:
+    """
+    Purpose:
+    Aggregates the weather station data by district, year, month and day in pandas, one streamed chunk at a time
 
-def aggregateDlyData(df: pd.DataFrame) -> pd.DataFrame:
+    Tables:
+    - The provincial weather station data tables in dataTables
+
+    Psuedocode:
+    - Create the weather station data SQL query
+    - Stream the data from the database in chunks typed as per dtypes
+    - For each chunk
+        - Merge the weather station data and the station data together (labels each row with its district)
+        - Reduce the chunk by district, year, month and day as per aggs (see ChunkAggregator)
+    - Merge the reduced chunks and name the columns as per aggCols
+
+    Remarks: only one chunk is loaded at a time, the data is never held in memory as a whole
+    """
+    weatherDataQuery = sq.text(
+        "\nUNION\n".join([f"SELECT * FROM public.{table}" for table in dataTables])
+        + ";"
+    )
+
+    aggregator = ChunkAggregator(AGG_KEYS, aggs, aggCols)
+    for chunk in db.stream(weatherDataQuery, dtypes=dtypes):
+        aggregator.add(chunk.merge(stationData, on="station_id"))
+
+    return aggregator.result()
+
+
+def pullAggregatedData(
+    db: DataService,
+    dataTables: list,
+    aggs: dict,
+    aggCols: list,
+    keys: typing.Optional[typing.List[tuple]] = None,
+) -> pd.DataFrame:
     """
     Purpose:
-    Aggregate the daily weather station data by district and date
+    Aggregates the weather station data by district, year, month and day inside the database
+
+    Tables:
+    - [stations_dly](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#stations_dly)
+    - The provincial weather station data tables in dataTables
 
     Psuedocode:
-    - Aggregate the columns by district and date
-    - Name the columns into the final DataFrame
+    - [Create the GROUP BY query](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions/blob/main/src/WeatherStation/WeatherQueryBuilder.py) joining the data to the district of its station
+    - Load the aggregated rows (the same results as aggregateWeatherData)
+
+    Remarks: if keys are provided, only those (district, year, month, day) are aggregated
     """
-    agg_df = (
-        df.groupby(["district", "year", "month", "day"])
-        .agg(
-            {
-                "max_temp": "max",
-                "min_temp": "min",
-                "mean_temp": "mean",
-                "total_rain": ["min", "max", "mean"],
-                "total_snow": ["min", "max", "mean"],
-                "total_precip": ["min", "max", "mean"],
-                "snow_on_grnd": ["min", "max", "mean"],
-            }
+    query = sq.text(
+        WeatherQueryBuilder().aggregateByDistrictReq(
+            dataTables, DLY_STATIONS, AGG_KEYS[1:], aggs, aggCols, keys
         )
-        .reset_index()
     )
 
-    # sets the column names for the aggregate dataframe
-    agg_df.columns = [  # type: ignore
-        "district",
-        "year",
-        "month",
-        "day",
-        "max_temp",
-        "min_temp",
-        "mean_temp",
-        "min_total_rain",
-        "max_total_rain",
-        "mean_total_rain",
-        "min_total_snow",
-        "max_total_snow",
-        "mean_total_snow",
-        "min_total_precip",
-        "max_total_precip",
-        "mean_total_precip",
-        "min_snow_on_grnd",
-        "max_snow_on_grnd",
-        "mean_snow_on_grnd",
-    ]
-
-    return agg_df
+    return pd.concat(db.stream(query), ignore_index=True)
 
 
 def pullStationData(conn: sq.engine.Connection) -> pd.DataFrame:
@@ -7,6 +7,15 @@ import sys, numpy, typing
 
 sys.path.append("../")
 from Shared.GenericQueryBuilder import GenericQueryBuilder
+from Shared.harvestCalendar import HarvestCalendar, CALENDAR_ATTRS, INVALID_DATE
+
+
+# The SQL aggregate functions matching the pandas aggregations
+SQL_AGGS = {"min": "MIN", "max": "MAX", "mean": "AVG"}
+
+# The table recording the (station_id, year, month, day) keys written to or deleted from the weather station data tables
+CHANGES_TABLE = "weather_station_changes"
+STATION_KEYS = ["station_id", "year", "month", "day"]
 
 
 class WeatherQueryBuilder(GenericQueryBuilder):
@@ -42,6 +51,28 @@ class WeatherQueryBuilder(GenericQueryBuilder):
         WHERE station_id = \'{stationID}\';
         """
 
+    def getStationStatesReq(self, prov: str, stationType: str) -> str:
+        """
+        Purpose:
+        Creates the SQL query to load weather stations along with the date (YEAR-MO-DA) they were last updated and whether they are active (unexecuted)
+
+        Tables:
+        - [dly stations](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#stations_dly)
+        - [hly stations](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#stations_hly)
+        - [station_data_last_updated](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#station_data_last_updated)
+
+        Remarks:
+        - Same stations as getStationsReq, last_updated and is_active are null for stations that were never updated
+        - Replaces a getLastUpdatedReq per station with a single query
+        """
+        return f"""
+        SELECT stations.*, updates.last_updated, updates.is_active
+        FROM public.stations_{stationType} AS stations
+        LEFT JOIN public.station_data_last_updated AS updates
+            ON updates.station_id = stations.station_id
+        WHERE stations.province = \'{prov}\' AND stations.{stationType}_first_year IS NOT NULL;
+        """
+
     def readGetLastUpdated(self, results: object) -> typing.Tuple[str, bool]:
         """
         Purpose:
@@ -171,3 +202,392 @@ class WeatherQueryBuilder(GenericQueryBuilder):
         INSERT INTO station_data_last_updated VALUES (\'{stationID}\', \'{lastUpdated}\');
         COMMIT;
         """
+
+    def upsertLastUpdatedReq(
+        self, lastUpdated: typing.Dict[str, numpy.datetime64]
+    ) -> str:
+        """
+        Purpose:
+        Adds or changes the recorded date multiple stations were last updated in a single statement
+
+        Table:
+        - [station_data_last_updated](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#station_data_last_updated)
+
+        Remarks:
+        - lastUpdated maps each station_id to the date of its newest data point (must not be empty)
+        - Replaces addLastUpdatedReq/modLastUpdatedReq per station, whether the station was queried before or not
+        - The recorded date never moves back (i.e when older data is replayed from the raw archive)
+        """
+        values = ",\n            ".join(
+            f"('{stationID}', '{date}')" for stationID, date in lastUpdated.items()
+        )
+
+        return f"""
+        INSERT INTO station_data_last_updated (station_id, last_updated)
+        VALUES
+            {values}
+        ON CONFLICT (station_id) DO UPDATE
+        SET last_updated = GREATEST(station_data_last_updated.last_updated, EXCLUDED.last_updated);
+        COMMIT;
+        """
+
+    def createHlyLedgerTableReq(self) -> str:
+        """
+        Purpose:
+        Manually creates the SQL table recording which years of hourly data were scraped for each station
+        - status (complete, partial or failed), number of rows stored, number of runs that pulled it and when it was last pulled
+
+        Table:
+        - hly_station_ledger
+
+        Remarks: Creating the table manually ensures the tables persist (usually due to the inability to locate a unique key)
+        """
+        return f"""
+        CREATE TABLE hly_station_ledger (
+            station_id      VARCHAR,
+            year            INT,
+            status          VARCHAR NOT NULL,
+            num_rows        INT DEFAULT 0,
+            attempts        INT DEFAULT 0,
+            updated_at      TIMESTAMP DEFAULT NOW(),
+
+            CONSTRAINT PK_HLY_STATION_LEDGER PRIMARY KEY(station_id, year)
+        );
+        COMMIT;
+        """
+
+    def getHlyLedgerReq(self, status: str) -> str:
+        """
+        Purpose:
+        Request the station years of hourly data with the given status
+
+        Table:
+        - hly_station_ledger
+        """
+        return f"""
+        SELECT station_id, year FROM public.hly_station_ledger
+        WHERE status = \'{status}\';
+        """
+
+    def markHlyLedgerReq(
+        self, stationID: str, year: int, status: str, numRows: int
+    ) -> str:
+        """
+        Purpose:
+        Records the outcome of scraping a year of hourly data for a station
+
+        Table:
+        - hly_station_ledger
+
+        Remarks: adds the station year if it was never attempted before, otherwise updates it and counts the attempt
+        """
+        return f"""
+        INSERT INTO hly_station_ledger (station_id, year, status, num_rows, attempts)
+        VALUES (\'{stationID}\', {year}, \'{status}\', {numRows}, 1)
+        ON CONFLICT (station_id, year) DO UPDATE
+        SET status = EXCLUDED.status, num_rows = EXCLUDED.num_rows,
+            attempts = hly_station_ledger.attempts + 1, updated_at = NOW();
+        COMMIT;
+        """
+
+    def deleteStationYearReq(self, tablename: str, stationID: str, year: int) -> str:
+        """
+        Purpose:
+        Removes the data of a station for a year (so that it can be stored again without duplicates)
+
+        Tables:
+        - [ab_hly_station_data](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#ab_hly_station_data)
+        - [mb_hly_station_data](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#mb_hly_station_data)
+        - [sk_hly_station_data](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#sk_hly_station_data)
+        - weather_station_changes
+
+        Remarks:
+        - The deleted days are recorded as changed (see recordChangesReq)
+        - Not committed, so it can run in the transaction storing the new data (see the preQueries of DataService.bulkWrite)
+        """
+        return self.__recordDeletedReq(
+            tablename, f"station_id = '{stationID}' AND year = {year}"
+        )
+
+    def deleteStationMonthsReq(
+        self,
+        tablename: str,
+        stationID: str,
+        months: typing.List[typing.Tuple[int, int]],
+    ) -> str:
+        """
+        Purpose:
+        Removes the data of a station for some months (so that they can be stored again without duplicates)
+
+        Tables:
+        - [ab_dly_station_data](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#ab_dly_station_data)
+        - [mb_dly_station_data](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#mb_dly_station_data)
+        - [sk_dly_station_data](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#sk_dly_station_data)
+        - weather_station_changes
+
+        Remarks:
+        - months are (year, month) pairs and must not be empty
+        - The deleted days are recorded as changed (see recordChangesReq)
+        - Not committed, so it can run in the transaction storing the new data (see the preQueries of DataService.bulkWrite)
+        """
+        values = ", ".join(f"({year}, {month})" for year, month in months)
+
+        return self.__recordDeletedReq(
+            tablename, f"station_id = '{stationID}' AND (year, month) IN ({values})"
+        )
+
+    def aggregateByDistrictReq(
+        self,
+        dataTables: typing.List[str],
+        stationsTable: str,
+        dateCols: typing.List[str],
+        aggs: dict,
+        aggCols: typing.List[str],
+        keys: typing.Optional[typing.List[tuple]] = None,
+    ) -> str:
+        """
+        Purpose:
+        Creates the SQL query to aggregate the weather station data by district and date inside the database (unexecuted)
+
+        Tables:
+        - [stations_dly](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#stations_dly)
+        - [stations_hly](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#stations_hly)
+        - The provincial weather station data tables (i.e [ab_hly_station_data](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#ab_hly_station_data))
+
+        Pseudocode:
+        - Combine the data tables with UNION (as done when loading them into pandas)
+            - If keys are provided, only keep the rows of the stations in those districts on those days
+        - Join every row to the district of its station
+        - If grouping by week, join every row to its week using the [harvestCalendar](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions/blob/main/src/Shared/harvestCalendar.py) lookup table
+        - Group the rows by district and dateCols, calculating each aggregation in aggs
+
+        Remarks:
+        - aggs uses the same format as [DataFrame.agg](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.agg.html) (i.e {"min_temp": "min", "total_precip": ["min", "max", "mean"]})
+        - aggCols names the aggregations in order, the results have the columns district, dateCols then aggCols
+        - Like pandas, rows missing a date column are skipped and null values are ignored by the aggregations
+        - keys are (district, year, month, day) tuples (only when grouping by year, month and day), the filter matches the
+          (station_id, year, month, day) indexes of the data tables
+        """
+        aggExprs = []
+        for col, funcs in aggs.items():
+            for func in funcs if isinstance(funcs, list) else [funcs]:
+                aggExprs.append(f"{SQL_AGGS[func]}(data.{col})")
+
+        columns = ", ".join(
+            [f"{agg} AS {name}" for agg, name in zip(aggExprs, aggCols)]
+        )
+        stationsQuery = self.__stationsReq(stationsTable)
+
+        keysFilter = ""
+        if keys is not None:
+            values = ", ".join(
+                f"({', '.join(str(int(v)) for v in key)})" for key in keys
+            )
+            keysFilter = f"""
+            WHERE (station_id, year, month, day) IN (
+                SELECT stations.station_id, changed.year, changed.month, changed.day
+                FROM (VALUES {values}) AS changed(district, year, month, day)
+                JOIN ({stationsQuery}) AS stations
+                ON stations.district = changed.district
+            )
+            """
+
+        dataQuery = " UNION ".join(
+            [f"SELECT * FROM public.{table}{keysFilter}" for table in dataTables]
+        )
+
+        calendarJoin = ""
+        dateAttrs = [f"data.{col}" for col in dateCols]
+        if "week" in dateCols:
+            calendarJoin = f"""
+            JOIN ({self.__calendarReq()}) AS calendar(month, day, week)
+            ON data.month = calendar.month AND data.day = calendar.day
+            """
+            dateAttrs[dateCols.index("week")] = "calendar.week"
+
+        groupCols = ", ".join(["stations.district"] + dateAttrs)
+        dateFilter = " AND ".join([f"{attr} IS NOT NULL" for attr in dateAttrs])
+
+        return f"""
+        SELECT {groupCols}, {columns}
+        FROM ({dataQuery}) AS data
+        JOIN ({stationsQuery}) AS stations
+        ON data.station_id = stations.station_id
+        {calendarJoin}
+        WHERE {dateFilter}
+        GROUP BY {groupCols}
+        ORDER BY {groupCols};
+        """
+
+    def createChangesTableReq(self) -> str:
+        """
+        Purpose:
+        Creates the SQL table recording which (station_id, year, month, day) keys of the weather station data tables
+        were written to or deleted from (if it does not exist)
+
+        Table:
+        - weather_station_changes
+
+        Remarks: changes are numbered in the order they are recorded, CombineProvinceData removes them once aggregated
+        """
+        return f"""
+        CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (
+            id              BIGSERIAL PRIMARY KEY,
+            source_table    VARCHAR NOT NULL,
+            station_id      VARCHAR NOT NULL,
+            year            INT,
+            month           INT,
+            day             INT,
+            changed_at      TIMESTAMP DEFAULT NOW()
+        );
+        COMMIT;
+        """
+
+    def recordChangesReq(
+        self, tablename: str, keys: typing.List[typing.Tuple[str, int, int, int]]
+    ) -> str:
+        """
+        Purpose:
+        Records the (station_id, year, month, day) keys written to a weather station data table as changed
+
+        Table:
+        - weather_station_changes
+
+        Remarks:
+        - keys must not be empty
+        - Not committed, so it can run in the transaction storing the data (see the preQueries of DataService.bulkWrite)
+        """
+        values = ", ".join(
+            f"('{tablename}', '{stationID}', {int(year)}, {int(month)}, {int(day)})"
+            for stationID, year, month, day in keys
+        )
+
+        return f"""
+        INSERT INTO {CHANGES_TABLE} (source_table, station_id, year, month, day)
+        VALUES {values};
+        """
+
+    def lastChangeReq(self) -> str:
+        """
+        Purpose:
+        Creates the SQL query returning the id of the last change recorded (0 if none)
+
+        Table:
+        - weather_station_changes
+
+        Remarks:
+        - Run in a transaction, the table is locked against writers until the transaction ends
+        - The lock waits for the transactions recording changes to finish, so every change up to the id is committed
+          (ids are handed out in order, a later change can otherwise commit before an earlier one)
+        """
+        return f"""
+        LOCK TABLE {CHANGES_TABLE} IN SHARE MODE;
+        SELECT COALESCE(MAX(id), 0) FROM {CHANGES_TABLE};
+        """
+
+    def changedKeysReq(
+        self, lastChange: int, dataTables: typing.List[str], stationsTable: str
+    ) -> str:
+        """
+        Purpose:
+        Creates the SQL query listing the (district, year, month, day) keys whose weather station data changed (unexecuted)
+
+        Tables:
+        - weather_station_changes
+        - [stations_dly](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#stations_dly)
+
+        Pseudocode:
+        - Select the changes recorded up to lastChange for the data tables (an index range of the changes)
+        - Join every change to the district of its station
+        - Return each district day once
+        """
+        tables = ", ".join(f"'{table}'" for table in dataTables)
+
+        return f"""
+        SELECT DISTINCT stations.district, changes.year, changes.month, changes.day
+        FROM public.{CHANGES_TABLE} AS changes
+        JOIN ({self.__stationsReq(stationsTable)}) AS stations
+        ON changes.station_id = stations.station_id
+        WHERE changes.id <= {int(lastChange)} AND changes.source_table IN ({tables})
+            AND changes.year IS NOT NULL AND changes.month IS NOT NULL AND changes.day IS NOT NULL;
+        """
+
+    def deleteChangesReq(self, lastChange: int) -> str:
+        """
+        Purpose:
+        Removes the changes recorded up to lastChange once they have been aggregated
+
+        Table:
+        - weather_station_changes
+
+        Remarks: not committed, so it can run in the transaction storing the aggregates (see the preQueries of DataService.bulkWrite)
+        """
+        return f"""
+        DELETE FROM {CHANGES_TABLE} WHERE id <= {int(lastChange)};
+        """
+
+    def deleteDistrictDaysReq(
+        self, tablename: str, keys: typing.List[typing.Tuple[int, int, int, int]]
+    ) -> str:
+        """
+        Purpose:
+        Removes the (district, year, month, day) rows of a district level table so they can be aggregated again
+
+        Table:
+        - [agg_weather_combined](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#agg_weather_combined)
+
+        Remarks:
+        - keys must not be empty, the filter matches the (year, month, day, district) index of the table
+        - Not committed, so it can run in the transaction storing the new rows (see the preQueries of DataService.bulkWrite)
+        """
+        values = ", ".join(
+            f"({int(year)}, {int(month)}, {int(day)}, {int(district)})"
+            for district, year, month, day in keys
+        )
+
+        return f"""
+        DELETE FROM {tablename}
+        WHERE (year, month, day, district) IN ({values});
+        """
+
+    def __stationsReq(self, stationsTable: str) -> str:
+        """
+        Purpose:
+        Creates the SQL query listing the stations which are in a district with their district
+        """
+        return f"""
+            SELECT station_id, CAST(district AS INT) AS district FROM public.{stationsTable}
+            WHERE district IS NOT NULL
+        """
+
+    def __recordDeletedReq(self, tablename: str, condition: str) -> str:
+        """
+        Purpose:
+        Creates the SQL query deleting the rows of a weather station data table matching condition and recording their
+        (station_id, year, month, day) keys as changed in the same statement
+        """
+        return f"""
+        WITH deleted AS (
+            DELETE FROM {tablename} WHERE {condition}
+            RETURNING station_id, year, month, day
+        )
+        INSERT INTO {CHANGES_TABLE} (source_table, station_id, year, month, day)
+        SELECT DISTINCT \'{tablename}\', station_id, year, month, day FROM deleted;
+        """
+
+    def __calendarReq(self) -> str:
+        """
+        Purpose:
+        Creates the (month, day, week) rows of the harvest calendar as a SQL VALUES list
+        """
+        lookupTable = HarvestCalendar().getLookupTable()
+        week = CALENDAR_ATTRS.index("week")
+
+        rows = [
+            f"({month}, {day}, {lookupTable[month, day, week]})"
+            for month in range(1, lookupTable.shape[0])
+            for day in range(1, lookupTable.shape[1])
+            if lookupTable[month, day, week] != INVALID_DATE
+        ]
+
+        return f"VALUES {', '.join(rows)}"
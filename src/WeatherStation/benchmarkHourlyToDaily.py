@@ -0,0 +1,99 @@
+# ----------------------------------------------------
+# benchmarkHourlyToDaily.py
+#
+# Compares the time taken to aggregate hourly weather station data into daily data with
+# ScrapingProcessor.tranformHourlyToDaily (groupby/agg) against ScrapingProcessor.reduceHourlyToDaily (sorted segments)
+#
+# Typical usage example:
+#   python benchmarkHourlyToDaily.py [number of stations] [number of years] [shuffle]
+#
+# Remarks:
+# - The synthetic data is shaped like the output of ScrapingProcessor.dataProcessHourly (a row per station per hour)
+# - Rows are sorted by station and date and some values are missing, as in the pages returned by the hourly data service
+# - Pass shuffle to shuffle the rows (the reducer then has to sort them)
+# - Both implementations are checked to return the same daily data
+# ----------------------------------------------------
+from scrapingProcessor import ScrapingProcessor, HOURLY_SCHEMA  # type: ignore
+import pandas as pd
+import numpy as np
+import sys, time
+
+
+NUM_STATIONS = 1  # The default number of stations
+NUM_YEARS = 1  # The default number of years of hourly data per station
+# The number of times each implementation is timed (the fastest run is kept)
+NUM_RUNS = 5
+MISSING_RATE = 0.05  # The fraction of missing values
+
+
+def main():
+    numStations = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_STATIONS
+    numYears = int(sys.argv[2]) if len(sys.argv) > 2 else NUM_YEARS
+    shuffle = len(sys.argv) > 3 and sys.argv[3] == "shuffle"
+
+    processor = ScrapingProcessor()
+    df = createData(numStations, numYears, shuffle)
+
+    groupbyTime, expected = timeRuns(processor.tranformHourlyToDaily, df)
+    reduceTime, result = timeRuns(processor.reduceHourlyToDaily, df)
+    pd.testing.assert_frame_equal(expected, result)
+
+    print(
+        f"Aggregated {len(df.index)} hourly rows ({numStations} stations x {numYears} years) into {len(result.index)} days"
+    )
+    print(f"\ttranformHourlyToDaily:  {groupbyTime * 1000:.1f}ms")
+    print(f"\treduceHourlyToDaily:    {reduceTime * 1000:.1f}ms")
+    print(f"\tSpeedup:                {groupbyTime / reduceTime:.1f}x")
+
+
+def timeRuns(func, df: pd.DataFrame):
+    """
+    Purpose:
+    Times an aggregation NUM_RUNS times, returning the fastest time and the aggregated data
+    """
+    times = []
+    for _ in range(NUM_RUNS):
+        start = time.perf_counter()
+        result = func(df)
+        times.append(time.perf_counter() - start)
+
+    return min(times), result
+
+
+def createData(numStations: int, numYears: int, shuffle: bool) -> pd.DataFrame:
+    """
+    Purpose:
+    Creates synthetic hourly data shaped like the preprocessed hourly weather station data
+
+    Pseudocode:
+    - Create a row for every hour of every station
+    - Fill the measurements with random floats (rounded like the service's values), some of them missing
+    - Shuffle the rows if requested
+    """
+    rng = np.random.default_rng(0)
+    hours = pd.date_range("2022-01-01", periods=numYears * 8760, freq="h")
+
+    df = pd.DataFrame()
+    df["station_id"] = np.repeat(
+        [str(3010010 + i) for i in range(numStations)], len(hours)
+    )
+    df["datetime"] = np.tile(hours, numStations)
+    df["year"] = df["datetime"].dt.year
+    df["month"] = df["datetime"].dt.month
+    df["day"] = df["datetime"].dt.day
+    df["hour"] = df["datetime"].dt.hour
+
+    attrs = [name for name, dtype in HOURLY_SCHEMA.values() if dtype == "float64"]
+    for attr in attrs:
+        values = rng.normal(10, 10, len(df.index)).round(1)
+        values[rng.random(len(df.index)) < MISSING_RATE] = np.nan
+        df[attr] = values
+
+    if shuffle:
+        df = df.sample(frac=1, random_state=0).reset_index(drop=True)
+
+    return df
+
+
+if __name__ == "__main__":
+    main()
@@ -10,12 +10,16 @@
 # Output:
 #   An excel document with the expected output columns (saves as specified by pathToSave i.e datasets uses datasets/data/)
 #
-# Remarks: As weeks change per year, the weekly aggregation uses the year of 2001 (not a leap year)
+# Remarks:
+# - HlyAggregator(aggregateInDB=True) aggregates the data in PostgreSQL (GROUP BY) so only the aggregated rows are loaded instead of every row
+# - Otherwise the data is streamed and aggregated one chunk at a time (by day, week and month in a single pass) as per the
+#   [chunkAggregator](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions/blob/main/src/Shared/chunkAggregator.py)
+# - As weeks change per year, the weekly aggregation uses the year of 2001 (not a leap year) as per the [harvestCalendar](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions/blob/main/src/Shared/harvestCalendar.py)
 # -------------------------------------------
 from dotenv import load_dotenv
 import sqlalchemy as sq
 import pandas as pd
-import os, sys, datetime
+import os, sys, typing
 
 try:
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
@@ -25,6 +29,9 @@ except:
 sys.path.append("../")
 from Shared.DataService import DataService
 from Shared.aggregatorHelper import AggregatorHelper  # type: ignore
+from Shared.chunkAggregator import ChunkAggregator
+from Shared.harvestCalendar import HarvestCalendar
+from WeatherStation.WeatherQueryBuilder import WeatherQueryBuilder
 
 
 HLY_STATIONS = "stations_hly"  # table that contains the hourly stations
@@ -33,6 +40,69 @@ AB_HLY_TABLE = "ab_hly_station_data"  # table that contains Albertas data
 MB_HLY_TABLE = "mb_hly_station_data"  # table that contains Manitobas data
 SK_HLY_TABLE = "sk_hly_station_data"  # table that contains Saskatchewans data
 
+# The attributes of the hourly weather station data
+HLY_ATTRS = [
+    "min_temp",
+    "max_temp",
+    "mean_temp",
+    "min_dew_point_temp",
+    "max_dew_point_temp",
+    "mean_dew_point_temp",
+    "min_humidex",
+    "max_humidex",
+    "mean_humidex",
+    "total_precip",
+    "min_rel_humid",
+    "max_rel_humid",
+    "mean_rel_humid",
+    "min_stn_press",
+    "max_stn_press",
+    "mean_stn_press",
+    "min_visibility",
+    "max_visibility",
+    "mean_visibility",
+]
+
+# How each attribute is aggregated (see DataFrame.agg) and the names of the aggregated columns
+HLY_AGGS = {
+    attr: ["min", "max", "mean"] if attr == "total_precip" else "mean"
+    for attr in HLY_ATTRS
+}
+HLY_AGG_COLS = [
+    "min_temp",
+    "max_temp",
+    "mean_temp",
+    "min_dew_point_temp",
+    "max_dew_point_temp",
+    "mean_dew_point_temp",
+    "min_humidex",
+    "max_humidex",
+    "mean_humidex",
+    "min_precip",
+    "max_precip",
+    "mean_precip",
+    "min_rel_humid",
+    "max_rel_humid",
+    "mean_rel_humid",
+    "min_stn_press",
+    "max_stn_press",
+    "mean_stn_press",
+    "min_visibility",
+    "max_visibility",
+    "mean_visibility",
+]
+
+# The types the hourly weather station data is loaded as (float32 halves the memory used by the attributes)
+HLY_DTYPES = {
+    "year": "int16",
+    "month": "int16",
+    "day": "int16",
+    **{attr: "float32" for attr in HLY_ATTRS},
+}
+
+# The date columns the data is aggregated by (by day, week and month) along with the district
+AGG_DATE_COLS = [["year", "month", "day"], ["year", "week"], ["year", "month"]]
+
 
 # Load the database connection environment variables located in the docker folder
 try:
@@ -49,7 +119,7 @@ PG_PW = os.getenv("POSTGRES_PW")
 
 
 class HlyAggregator:
-    def __init__(self):
+    def __init__(self, aggregateInDB: bool = False):
         if (
             PG_DB is None
             or PG_ADDR is None
@@ -62,30 +132,17 @@ class HlyAggregator:
         db = DataService(PG_DB, PG_ADDR, int(PG_PORT), PG_USER, PG_PW)
         conn = db.connect()
 
-        self.weatherData = self.__pullWeatherData(conn)
+        self.aggregateInDB = aggregateInDB
         self.stationData = self.__pullStationData(conn)
-        db.cleanup()
-
-        # merge both the weather station data and the station data together
-        self.df = self.weatherData.merge(self.stationData, on="station_id")
         self.helper = AggregatorHelper()
 
-        # setup for weekly aggregations by calculating the week number for all dates
-        self.df["week"] = None
-        dates = self.helper.getDatesInYr()
-
-        for date in dates:
-            dateComponents = date.split("-")
-            monthInt = int(dateComponents[0])
-            dayInt = int(dateComponents[1])
-
-            #  calculate the week number (52 weeks in a year)
-            weekInt = datetime.date(2001, monthInt, dayInt).isocalendar()[1]
+        # the data is aggregated by PostgreSQL when needed so only the aggregated rows are loaded
+        if aggregateInDB:
+            self.db = db
+            return
 
-            #  Assign week numbers (week) based on the month and day in the DataFrame
-            self.df.loc[
-                (self.df["month"] == monthInt) & (self.df["day"] == dayInt), "week"
-            ] = weekInt
+        self.aggregates = self.__aggregateWeatherData(db)
+        db.cleanup()
 
     def aggregateByDay(self, pathToSave: str, byHarvest: bool = False):
         """
@@ -93,68 +150,12 @@ class HlyAggregator:
         Aggregate the hourly weather station data by district, year, month and day
 
         Psuedocode:
-        - Aggregate the columns by district, year, monthy, day
-        - Name the columns into the final DataFrame
+        - Aggregate the columns by district, year, monthy, day (see __aggregate)
         - Get the unique dates in a year formatted as MO-DA
         - Reshape the rows to transform them into columns where each attribute reappears for each date
         - Export to csv
         """
-        agg_df = (
-            self.df.groupby(["district", "year", "month", "day"])
-            .agg(
-                {
-                    "min_temp": "mean",
-                    "max_temp": "mean",
-                    "mean_temp": "mean",
-                    "min_dew_point_temp": "mean",
-                    "max_dew_point_temp": "mean",
-                    "mean_dew_point_temp": "mean",
-                    "min_humidex": "mean",
-                    "max_humidex": "mean",
-                    "mean_humidex": "mean",
-                    "total_precip": ["min", "max", "mean"],
-                    "min_rel_humid": "mean",
-                    "max_rel_humid": "mean",
-                    "mean_rel_humid": "mean",
-                    "min_stn_press": "mean",
-                    "max_stn_press": "mean",
-                    "mean_stn_press": "mean",
-                    "min_visibility": "mean",
-                    "max_visibility": "mean",
-                    "mean_visibility": "mean",
-                }
-            )
-            .reset_index()
-        )
-
-        # sets the column names for the aggregate dataframe
-        agg_df.columns = [  # type: ignore
-            "district",
-            "year",
-            "month",
-            "day",
-            "min_temp",
-            "max_temp",
-            "mean_temp",
-            "min_dew_point_temp",
-            "max_dew_point_temp",
-            "mean_dew_point_temp",
-            "min_humidex",
-            "max_humidex",
-            "mean_humidex",
-            "min_precip",
-            "max_precip",
-            "mean_precip",
-            "min_rel_humid",
-            "max_rel_humid",
-            "mean_rel_humid",
-            "min_stn_press",
-            "max_stn_press",
-            "mean_stn_press",
-            "min_visibility",
-            "max_visibility",
-            "mean_visibility",
-        ]
+        agg_df = self.__aggregate(["year", "month", "day"])
 
         dates = self.helper.getDatesInYr()
         final_df = self.helper.reshapeDataByDates(
@@ -177,67 +178,12 @@ class HlyAggregator:
         Aggregate the hourly weather station data by district, year and week
 
         Psuedocode:
-        - Aggregate the columns by district, year and week
-        - Name the columns into the final DataFrame
+        - Aggregate the columns by district, year and week (see __aggregate)
         - Get the unique dates in a year formatted as W
         - Reshape the rows to transform them into columns where each attribute reappears for each date
         - Export to csv
         """
-        agg_df = (
-            self.df.groupby(["district", "year", "week"])
-            .agg(
-                {
-                    "min_temp": "mean",
-                    "max_temp": "mean",
-                    "mean_temp": "mean",
-                    "min_dew_point_temp": "mean",
-                    "max_dew_point_temp": "mean",
-                    "mean_dew_point_temp": "mean",
-                    "min_humidex": "mean",
-                    "max_humidex": "mean",
-                    "mean_humidex": "mean",
-                    "total_precip": ["min", "max", "mean"],
-                    "min_rel_humid": "mean",
-                    "max_rel_humid": "mean",
-                    "mean_rel_humid": "mean",
-                    "min_stn_press": "mean",
-                    "max_stn_press": "mean",
-                    "mean_stn_press": "mean",
-                    "min_visibility": "mean",
-                    "max_visibility": "mean",
-                    "mean_visibility": "mean",
-                }
-            )
-            .reset_index()
-        )
-
-        # sets the column names for the aggregate dataframe
-        agg_df.columns = [  # type: ignore
-            "district",
-            "year",
-            "week",
-            "min_temp",
-            "max_temp",
-            "mean_temp",
-            "min_dew_point_temp",
-            "max_dew_point_temp",
-            "mean_dew_point_temp",
-            "min_humidex",
-            "max_humidex",
-            "mean_humidex",
-            "min_precip",
-            "max_precip",
-            "mean_precip",
-            "min_rel_humid",
-            "max_rel_humid",
-            "mean_rel_humid",
-            "min_stn_press",
-            "max_stn_press",
-            "mean_stn_press",
-            "min_visibility",
-            "max_visibility",
-            "mean_visibility",
-        ]
+        agg_df = self.__aggregate(["year", "week"])
 
         dates = self.helper.getWeeksInYr()
         final_df = self.helper.reshapeDataByDates(
@@ -260,67 +206,12 @@ class HlyAggregator:
         Aggregate the hourly weather station data by district, year and month
 
         Psuedocode:
-        - Aggregate the columns by district, year and month
-        - Name the columns into the final DataFrame
+        - Aggregate the columns by district, year and month (see __aggregate)
         - Get the unique dates in a year formatted as M:
         - Reshape the rows to transform them into columns where each attribute reappears for each date
         - Export to csv
         """
-        agg_df = (
-            self.df.groupby(["district", "year", "month"])
-            .agg(
-                {
-                    "min_temp": "mean",
-                    "max_temp": "mean",
-                    "mean_temp": "mean",
-                    "min_dew_point_temp": "mean",
-                    "max_dew_point_temp": "mean",
-                    "mean_dew_point_temp": "mean",
-                    "min_humidex": "mean",
-                    "max_humidex": "mean",
-                    "mean_humidex": "mean",
-                    "total_precip": ["min", "max", "mean"],
-                    "min_rel_humid": "mean",
-                    "max_rel_humid": "mean",
-                    "mean_rel_humid": "mean",
-                    "min_stn_press": "mean",
-                    "max_stn_press": "mean",
-                    "mean_stn_press": "mean",
-                    "min_visibility": "mean",
-                    "max_visibility": "mean",
-                    "mean_visibility": "mean",
-                }
-            )
-            .reset_index()
-        )
-
-        # sets the column names for the aggregate dataframe
-        agg_df.columns = [  # type: ignore
-            "district",
-            "year",
-            "month",
-            "min_temp",
-            "max_temp",
-            "mean_temp",
-            "min_dew_point_temp",
-            "max_dew_point_temp",
-            "mean_dew_point_temp",
-            "min_humidex",
-            "max_humidex",
-            "mean_humidex",
-            "min_precip",
-            "max_precip",
-            "mean_precip",
-            "min_rel_humid",
-            "max_rel_humid",
-            "mean_rel_humid",
-            "min_stn_press",
-            "max_stn_press",
-            "mean_stn_press",
-            "min_visibility",
-            "max_visibility",
-            "mean_visibility",
-        ]
+        agg_df = self.__aggregate(["year", "month"])
 
         dates = self.helper.getMonthsInYr()
         final_df = self.helper.reshapeDataByDates(
@@ -337,10 +228,37 @@ class HlyAggregator:
             print("[ERROR]")
             print(e)
 
-    def __pullWeatherData(self, conn: sq.engine.Connection) -> pd.DataFrame:
+    def __aggregate(self, dateCols: list) -> pd.DataFrame:
         """
         Purpose:
-        Loads the weather station data per province from the weather station data tables
+        Aggregate the hourly weather station data by district and dateCols
+
+        Psuedocode:
+        - If aggregating in the database, [create the GROUP BY query](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions/blob/main/src/WeatherStation/WeatherQueryBuilder.py) and load the aggregated rows
+        - Otherwise return the data aggregated while it was streamed (see __aggregateWeatherData)
+        - Name the columns as per HLY_AGG_COLS
+        """
+        if self.aggregateInDB:
+            query = sq.text(
+                WeatherQueryBuilder().aggregateByDistrictReq(
+                    [AB_HLY_TABLE, MB_HLY_TABLE, SK_HLY_TABLE],
+                    HLY_STATIONS,
+                    dateCols,
+                    HLY_AGGS,
+                    HLY_AGG_COLS,
+                )
+            )
+
+            return pd.concat(self.db.stream(query), ignore_index=True)
+
+        return self.aggregates[tuple(dateCols)]
+
+    def __aggregateWeatherData(
+        self, db: DataService
+    ) -> typing.Dict[tuple, pd.DataFrame]:
+        """
+        Purpose:
+        Aggregates the weather station data per province by district and each of AGG_DATE_COLS as {date columns: aggregated data}
 
         Tables:
         - [ab_hly_station_data](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#ab_hly_station_data)
@@ -349,7 +267,14 @@ class HlyAggregator:
 
         Psuedocode:
         - Create the weather station data SQL query
-        - [Load the data from the database directly into a DataFrame](https://pandas.pydata.org/docs/reference/api/pandas.read_sql.html)
+        - Stream the data from the database in chunks typed as per HLY_DTYPES
+        - For each chunk
+            - Merge the weather station data and the station data together (labels each row with its district)
+            - Label every row with its week number (for weekly aggregations)
+            - Reduce the chunk into the aggregations by day, week and month (see ChunkAggregator)
+        - Merge the reduced chunks into the aggregated data
+
+        Remarks: only one chunk is loaded at a time, the data is never held in memory as a whole
         """
         weatherDataQuery = sq.text(
             f"""
@@ -361,7 +286,25 @@ class HlyAggregator:
             """
         )
 
-        return pd.read_sql(weatherDataQuery, conn)
+        aggregators = {
+            tuple(dateCols): ChunkAggregator(
+                ["district"] + dateCols, HLY_AGGS, HLY_AGG_COLS
+            )
+            for dateCols in AGG_DATE_COLS
+        }
+        calendar = HarvestCalendar()
+
+        for chunk in db.stream(weatherDataQuery, dtypes=HLY_DTYPES):
+            chunk = chunk.merge(self.stationData, on="station_id")
+            chunk = calendar.addCalendarAttrs(chunk, {"week": "week"})
+
+            for aggregator in aggregators.values():
+                aggregator.add(chunk)
+
+        return {
+            dateCols: aggregator.result()
+            for dateCols, aggregator in aggregators.items()
+        }
 
     def __pullStationData(self, conn: sq.engine.Connection) -> pd.DataFrame:
         """
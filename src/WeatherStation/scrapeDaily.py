@@ -9,13 +9,17 @@
 #   mb_dly_station_data: https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#mb_dly_station_data
 #   sk_dly_station_data https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#sk_dly_station_data
 #   station_data_last_updated: https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#station_data_last_updated
+#   weather_station_changes: records the station days stored or deleted (aggregated again by CombineProvinceData)
 #
-# Remarks: if the need to pull earlier data arises, changes will need to be made to avoid checking the last date pulled
-# as well as changing the minimum year from 1995
+# Remarks:
+# - If the need to pull earlier data arises, changes will need to be made to avoid checking the last date pulled
+#   as well as changing the minimum year from 1995
+# - With a raw archive (RAW_ARCHIVE_DIR), downloads are archived, in replay mode (RAW_ARCHIVE_MODE=replay) every archived
+#   station month is processed again from the archive (whatever the date it was last updated) and replaces the stored month
 # -------------------------------------------
-from ClimateDataRequester import ClimateDataRequester  # type: ignore
-from WeatherQueryBuilder import WeatherQueryBuilder  # type: ignore
-from scrapingProcessor import ScrapingProcessor  # type: ignore
+from ClimateDataRequester import ClimateDataRequester, DAILY_SOURCE  # type: ignore
+from WeatherQueryBuilder import WeatherQueryBuilder, STATION_KEYS  # type: ignore
+from scrapingProcessor import ScrapingProcessor, DAILY_SCHEMA  # type: ignore
 from dotenv import load_dotenv
 import geopandas as gpd  # type: ignore
 import sqlalchemy as sq
@@ -30,9 +34,14 @@ except:
 
 sys.path.append("../")
 from Shared.DataService import DataService
+from Shared.schemaManager import SchemaManager
+from Shared.rateLimiter import RateLimiter
+from Shared.rawArchive import RawArchive, openArchive
 
 
 DLY_FLAG = "dly"  # implies we would would like to pull dly station data
+REQUEST_RATE = 5  # The number of requests per second
+MAX_CONCURRENT = 4  # The number of requests sent at once
 
 # The abbreviations of the provinces we would like to pull data from
 PROVINCES = [
@@ -68,55 +77,68 @@ def main():
     # Handles (builds/processes) requests to the database
     queryHandler = WeatherQueryBuilder()
 
-    requester = ClimateDataRequester()  # Handles weather station requests
+    # Handles weather station requests
+    limiter = RateLimiter(REQUEST_RATE, MAX_CONCURRENT)
+    archive = openArchive()
+    requester = ClimateDataRequester(limiter, archive)
     processor = ScrapingProcessor()  # Handles the more complex data processing
+    schema = SchemaManager()  # Handles the indexes of the tables
+    readOptions = processor.readOptions(DAILY_SCHEMA)  # Only parses the columns we keep
     conn = db.connect()  # Connect to the database
 
     checkTables(db, queryHandler)
 
+    # In replay mode, the archived station months are processed again (and only those)
+    archived = None
+    if archive is not None and archive.replay:
+        archived = getArchivedMonths(archive)
+
     for prov in PROVINCES:
         stations, states = getStations(prov, db, queryHandler, conn)
         tablename = f"{prov.lower()}_dly_station_data"  # Current province data table
         numUpdated = 0  # Number of records updated
+        lastUpdated = {}  # The date of the newest data point stored for each station
 
-        # Removes inactive stations and adds the date the station was last updated
-        stations = processor.removeInactive(stations, states)
-        stations = processor.addLastUpdated(stations, states)
+        # Removes inactive stations and adds the date the station was last updated (every archived station is replayed)
+        stations = processor.mergeStates(stations, states if archived is None else [])
+        if archived is not None:
+            stations = stations[stations["station_id"].astype(str).isin(archived)]
 
         print(f"Updating data for {prov} in {tablename} ...")
-        for index, row in stations.iterrows():
-            stationID = str(row["station_id"])
-
-            minYear, maxYear = processor.calcDateRange(
-                row["dly_first_year"], row["last_updated"], row["dly_last_year"]
-            )
+        try:
+            for index, row in stations.iterrows():
+                stationID = str(row["station_id"])
+
+                try:
+                    updatdUntil, numRows = pullStation(
+                        prov,
+                        row,
+                        tablename,
+                        requester,
+                        processor,
+                        db,
+                        readOptions,
+                        f"[{index + 1}/{len(stations)}] ",
+                        archived.get(stationID) if archived is not None else None,
+                    )
 
-            print(
-                f"\t[{index + 1}/{len(stations)}] Pulling data for station {stationID} between {int(minYear)}-{int(maxYear)}"
-            )
+                    # The date of the newest data point is stored once the province is done
+                    if updatdUntil != None:
+                        lastUpdated[stationID] = updatdUntil
 
-            try:
-                # Collect data from the weather stations for [minYear, maxYear]
-                df = requester.get_data(prov, stationID, minYear, maxYear)
-                # Prepare data for storage (manipulates dataframe, averages values and removes old data)
-                df = processor.processData(df, row["last_updated"])
-                # Store data (not using return value due to its inaccuracy)
-                df.to_sql(
-                    tablename, conn, schema="public", if_exists="append", index=False
-                )
-
-                # Check what the date was for the newest data point and store it
-                updatdUntil = processor.findLatestDate(df["date"])
-                if updatdUntil != None:
-                    storeLastUpdated(
-                        stationID, row["last_updated"], queryHandler, db, updatdUntil
-                    )
+                    print(f"\t\tupdated {numRows} rows")
+                    numUpdated += 1
+                except Exception as e:
+                    print(f"[ERROR] Failed to scrape data for station {stationID}")
+                    print(e)
+        finally:
+            # Stored even if the province was interrupted, so the stored data is not pulled again
+            storeLastUpdated(lastUpdated, queryHandler, db)
 
-                print(f"\t\tupdated {len(df.index)} rows")
-                numUpdated += 1
-            except Exception as e:
-                print(f"[ERROR] Failed to scrape data for station {stationID}")
-                print(e)
+        # The table is created by the first write, index it and refresh its planner statistics after the bulk load
+        if schema.tableExists(db, tablename):
+            schema.createIndexes(db, tablename)
+            schema.analyze(db, tablename)
 
         print(
             f"[SUCCESS] Updated data for {numUpdated}/{len(stations)} weather stations in {prov}\n"
@@ -124,6 +146,75 @@ def main():
     db.cleanup()
 
 
+def pullStation(
+    prov: str,
+    row: pd.Series,
+    tablename: str,
+    requester: ClimateDataRequester,
+    processor: ScrapingProcessor,
+    db: DataService,
+    readOptions: dict,
+    progress: str = "",
+    months: typing.Optional[typing.Set[typing.Tuple[int, int]]] = None,
+) -> typing.Tuple[typing.Optional[np.datetime64], int]:
+    """
+    Purpose:
+    Pulls the daily data of a station which is newer than the last update and stores it
+
+    Pseudocode:
+    - Calculate the years to pull based on the years with data and the last update (or the archived months when replaying)
+    - Request the data (only parsing the columns we keep)
+    - Preprocess the data (removing the data stored by the last update unless replaying)
+    - Store the data and record the stored days as changed (when replaying, the stored data of the archived months is deleted
+      in the same transaction)
+    - Find the date of the newest data point
+
+    Remarks:
+    - row holds the station's station_id, dly_first_year, dly_last_year and last_updated
+    - months holds the archived (year, month) of the station in replay mode, they are processed again and replace the stored months
+    - Returns the date of the newest data point (None if no data was stored) and the number of rows stored
+    - Errors are raised to the caller
+    """
+    stationID = str(row["station_id"])
+    lastUpdated = row["last_updated"] if months is None else None
+
+    if months is None:
+        minYear, maxYear = processor.calcDateRange(
+            row["dly_first_year"], lastUpdated, row["dly_last_year"]
+        )
+    else:
+        minYear = min(year for year, _ in months)
+        maxYear = max(year for year, _ in months)
+
+    print(
+        f"\t{progress}Pulling data for station {stationID} between {int(minYear)}-{int(maxYear)}"
+    )
+
+    # Collect data from the weather stations for [minYear, maxYear]
+    df = requester.get_data(prov, stationID, minYear, maxYear, readOptions)
+    # Prepare data for storage (manipulates dataframe, averages values and removes old data)
+    df = processor.processData(df, lastUpdated)
+    # Replayed months replace the stored ones in the transaction storing them (nothing is deleted if the archive could not be read)
+    # the deleted and stored days are recorded as changed in the same transaction
+    queryHandler = WeatherQueryBuilder()
+    preQueries = []
+    if months is not None and len(df.index) > 0:
+        preQueries.append(
+            queryHandler.deleteStationMonthsReq(tablename, stationID, sorted(months))
+        )
+    if len(df.index) > 0:
+        keys = df[STATION_KEYS].drop_duplicates()
+        preQueries.append(
+            queryHandler.recordChangesReq(
+                tablename, list(keys.itertuples(index=False, name=None))
+            )
+        )
+    # Store data (not using return value due to its inaccuracy)
+    db.bulkWrite(df, tablename, preQueries=preQueries)
+
+    return processor.findLatestDate(df["date"]), len(df.index)
+
+
 def checkTables(db: DataService, queryHandler: WeatherQueryBuilder):
     """
     Purpose:
@@ -138,6 +229,7 @@ def checkTables(db: DataService, queryHandler: WeatherQueryBuilder):
     - Abort if they are not
     - Check if the update stations table is created
     - If the tables does not exist, create it
+    - Create the table recording the changed station days if it does not exist (read by CombineProvinceData)
     """
     query = sq.text(queryHandler.tableExistsReq(DLY_STATIONS_TABLE))
     tableExists = queryHandler.readTableExists(db.execute(query))  # type: ignore
@@ -153,33 +245,49 @@ def checkTables(db: DataService, queryHandler: WeatherQueryBuilder):
         query = sq.text(queryHandler.createUpdateTableReq())
         db.execute(query)
 
+    db.execute(sq.text(queryHandler.createChangesTableReq()))
+
 
 def storeLastUpdated(
-    stationID: str,
-    lastUpdated: np.datetime64,
+    lastUpdated: typing.Dict[str, np.datetime64],
     queryHandler: WeatherQueryBuilder,
     db: DataService,
-    updatdUntil: np.datetime64,
 ):
     """
     Purpose:
-    Stores the date a station was last updated
+    Stores the date each station of a province was last updated
 
     Tables:
     - [station_data_last_updated](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#station_data_last_updated)
 
     Pseudocode:
-    - Check if lastUpdated is a valid date (np.datetime64)
-    - Adds the station and the date it was last pulled if it was not (this would imply that this is its first update)
-    - Updates the date of the last update if it was
+    - If no station was updated, exit
+    - In a single statement, add the stations that were never pulled before and update the date of the others
+
+    Remarks: lastUpdated maps each station_id to the date of its newest data point
     """
-    if np.isnat(np.datetime64(lastUpdated)):
-        # If it wasnt pulled from, but has been now, add it
-        query = sq.text(queryHandler.addLastUpdatedReq(stationID, updatdUntil))
-        db.execute(query)
-    else:  # Otherwise, modify the date of the last update
-        query = sq.text(queryHandler.modLastUpdatedReq(stationID, updatdUntil))
-        db.execute(query)
+    if len(lastUpdated) == 0:
+        return
+
+    query = sq.text(queryHandler.upsertLastUpdatedReq(lastUpdated))
+    db.execute(query)
+
+
+def getArchivedMonths(archive: RawArchive) -> typing.Dict[str, set]:
+    """
+    Purpose:
+    Gets the months of daily data in the raw archive per station
+
+    Remarks: months are returned as {station_id: {(year, month)}}, daily files are archived under their month (i.e 2004-07)
+    """
+    archived: typing.Dict[str, set] = {}
+
+    for entry in archive.entries(DAILY_SOURCE):
+        if entry["key"] and entry["period"]:
+            year, month = entry["period"].split("-")[:2]
+            archived.setdefault(entry["key"], set()).add((int(year), int(month)))
+
+    return archived
 
 
 def getStations(
@@ -197,36 +305,33 @@ def getStations(
     - [station_data_last_updated](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#station_data_last_updated)
 
     Pseudocode:
-    - Create the SQL query for the dly weather stations
+    - Create the SQL query for the dly weather stations joined with when they were last updated
     - [Load the data from the database directly into a geoDataFrame](https://geopandas.org/en/stable/docs/reference/api/geopandas.GeoDataFrame.from_postgis.html)
     - Convert the geoDataFrame into a regular DataFrame without its geometry
-    - For each row, check when the station was last updated
-    - For each row, add that information into a parallel array
+    - Split the stations which were updated before into a list of states
 
     Remarks:
     Note that stations and states are parallel to one another and that the returned values are as follows:
     - stations is the data from stations_dly without its geometry
     - states is a list of dictionaries containing the station_id (str), last_updated (str) and is_active (bool)
     """
-    query = sq.text(queryHandler.getStationsReq(prov, DLY_FLAG))
+    query = sq.text(queryHandler.getStationStatesReq(prov, DLY_FLAG))
     stations = gpd.GeoDataFrame.from_postgis(query, conn, geom_col="geometry")
     stations = pd.DataFrame(stations.drop(columns=["geometry"]))
-    states = []
-
-    # For each station check if its active and whether or not its been pulled from before (table: station_data_last_updated)
-    for index, row in stations.iterrows():
-        query = sq.text(queryHandler.getLastUpdatedReq(row["station_id"]))
-        lastUpdated, isActive = queryHandler.readGetLastUpdated(db.execute(query))  # type: ignore
-
-        if lastUpdated:
-            lastUpdated = str(np.datetime64(lastUpdated))
-            states.append(
-                {
-                    "station_id": row["station_id"],
-                    "last_updated": lastUpdated,
-                    "is_active": isActive,
-                }
-            )
+
+    # Stations which have been pulled from before (table: station_data_last_updated) hold the date and whether they are active
+    updated = stations[stations["last_updated"].notna()]
+    states = pd.DataFrame(
+        {
+            "station_id": updated["station_id"],
+            "last_updated": pd.to_datetime(updated["last_updated"]).dt.strftime(
+                "%Y-%m-%d"
+            ),
+            "is_active": updated["is_active"].fillna(False).astype(bool),
+        }
+    ).to_dict("records")
+
+    stations = stations.drop(columns=["last_updated", "is_active"])
 
     return stations, states
 
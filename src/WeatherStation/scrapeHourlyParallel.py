@@ -9,18 +9,27 @@
 #   mb_hly_station_data: https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#mb_hly_station_data
 #   sk_hly_station_data https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#sk_hly_station_data
 #
-# Remarks: When tables are updated in the future/the script is ran again, data already pulled may be duplicated
+#   hly_station_ledger: records which years have been scraped for each station
+#   weather_station_changes: records the station days stored or deleted (aggregated again by CombineProvinceData)
+#
+# Remarks:
+# - Only the station years that are not complete in the ledger are pulled, so the script can be ran again to resume/update
+# - A station year is deleted in the transaction storing it again, so pulling it again does not duplicate data and a failed
+#   pull keeps the rows stored before
+# - The current year is marked as partial (it is pulled again on the next run)
+# - Every province is split into station year tasks which run on a single pool of workers (longest tasks first)
+# - With a raw archive (RAW_ARCHIVE_DIR), downloads are archived, in replay mode (RAW_ARCHIVE_MODE=replay) every archived
+#   station year is processed again from the archive, whether or not it is complete in the ledger
 # -------------------------------------------
-from ClimateDataRequester import ClimateDataRequester  # type: ignore
-from WeatherQueryBuilder import WeatherQueryBuilder  # type: ignore
-from scrapingProcessor import ScrapingProcessor  # type: ignore
+from ClimateDataRequester import ClimateDataRequester, HOURLY_SOURCE  # type: ignore
+from WeatherQueryBuilder import WeatherQueryBuilder, STATION_KEYS  # type: ignore
+from scrapingProcessor import ScrapingProcessor, HOURLY_SCHEMA  # type: ignore
 from dotenv import load_dotenv
-from time import sleep
-import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import geopandas as gpd  # type: ignore
 import sqlalchemy as sq
-import numpy as np
-import os, sys
+import pandas as pd
+import os, sys, time, datetime, signal, contextlib, typing
 
 try:
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
@@ -29,9 +38,13 @@ except:
 
 sys.path.append("../")
 from Shared.DataService import DataService
+from Shared.schemaManager import SchemaManager
+from Shared.rateLimiter import RateLimiter, shareLimiter, getSharedLimiter
+from Shared.rawArchive import RawArchive, openArchive
 
 
 NUM_WORKERS = 12  # The number of workers
+REQUEST_RATE = 2  # The number of requests per second shared by every worker
 
 # The abbreviations of the provinces we would like to pull data from
 PROVINCES = [
@@ -43,6 +56,21 @@ PROVINCES = [
 # The SQL table where the hourly stations are located
 HLY_STATIONS_TABLE = "stations_hly"
 
+# The SQL table recording which years have been scraped for each station
+LEDGER_TABLE = "hly_station_ledger"
+
+# The statuses of the station years in the ledger
+COMPLETE_STATUS = "complete"  # stored and will not change (the year is over)
+PARTIAL_STATUS = "partial"  # stored but the year is not over yet
+FAILED_STATUS = "failed"  # could not be scraped
+
+MAX_ATTEMPTS = 3  # The number of times a station year is attempted per run
+RETRY_DELAY = 30  # The number of seconds to wait before the first retry (doubles with every retry)
+TASK_TIMEOUT = 600  # The number of seconds an attempt can take before it is abandoned
+
+# The estimated cost of a station's first/last year relative to a full year (used to order the tasks)
+PARTIAL_YEAR_COST = 0.5
+
 # The file used to store progress information
 LOG_FILE = "data/scrape_stations_parallel.log"
 
@@ -65,14 +93,30 @@ def main():
 
     # Handles (builds/processes) requests to the database
     queryHandler = WeatherQueryBuilder()
+    schema = SchemaManager()  # Handles the indexes of the tables
+
+    # Limits the requests of every worker (shared through the pool's initializer)
+    limiter = RateLimiter(REQUEST_RATE, NUM_WORKERS)
 
     conn = db.connect()  # Connect to the database
     checkTables(db, queryHandler)
 
+    # The station years that have already been scraped
+    completed = getCompletedYears(queryHandler, conn)
+
+    # In replay mode, the archived station years are processed again (and only those)
+    archive = openArchive()
+    archived = None
+    if archive is not None and archive.replay:
+        completed = set()
+        archived = getArchivedYears(archive)
+    tasks = []  # The station years to pull across every province
+    tablenames = []
+
     for prov in PROVINCES:
         stations = getStations(prov, queryHandler, conn)
         tablename = f"{prov.lower()}_hly_station_data"
-        jobArgs = []
+        tablenames.append(tablename)
 
         # Check if the table exists yet, if not add it
         query = sq.text(queryHandler.tableExistsReq(tablename))
@@ -80,47 +124,80 @@ def main():
         if not tableExists:
             query = sq.text(queryHandler.createHrlyProvStationTableReq(tablename))
             db.execute(query)
+        schema.createIndexes(db, tablename)
 
-        for index, row in stations.iterrows():
-            jobArgs.append(tuple((index, row, len(stations), tablename)))
-
-        updateLog(LOG_FILE, f"Updating data for {prov} in {tablename} ...")
-        pool = mp.Pool(NUM_WORKERS)  # Defines the number of workers
-
-        # Creates the queue of jobs - pullSateliteData is the function and jobArgs holds the arguments
-        pool.starmap(pullHourlyData, jobArgs)
-        pool.close()  # Once these jobs are finished close the multiple processes pool
-
+        provTasks = planTasks(stations, completed, tablename, archived)
+        tasks += provTasks
         updateLog(
             LOG_FILE,
-            f"[SUCCESS] Finished updated data for weather stations in {prov}\n",
+            f"Planned {len(provTasks)} station years for {prov} in {tablename}",
         )
 
+    # Longest tasks first so that no worker is left with a long task once the others run out of work
+    tasks.sort(key=lambda task: task[0], reverse=True)
+
+    # A single pool for every province, workers pick up the next task as soon as they finish one
+    with ProcessPoolExecutor(
+        NUM_WORKERS, initializer=shareLimiter, initargs=(limiter,)
+    ) as executor:
+        futures = {}
+        for _, tablename, stationID, year in tasks:
+            future = executor.submit(pullStationYear, tablename, stationID, year)
+            futures[future] = (stationID, year)
+
+        # Log the tasks as they complete (in whatever order they finish)
+        numFailed = 0
+        for numDone, future in enumerate(as_completed(futures), start=1):
+            stationID, year = futures[future]
+
+            try:
+                status, numRows = future.result()
+            except Exception as e:
+                status, numRows = FAILED_STATUS, 0
+                updateLog(ERROR_FILE, f"\t\t[ERROR] {stationID} year {year}: {e}")
+
+            numFailed += int(status == FAILED_STATUS)
+            updateLog(
+                LOG_FILE,
+                f"\t[{numDone}/{len(tasks)}] station {stationID} year {year} {status} ({numRows} rows)",
+            )
+
+    # Refresh the planner statistics after the bulk load
+    for tablename in tablenames:
+        schema.analyze(db, tablename)
+
+    updateLog(
+        LOG_FILE,
+        f"[SUCCESS] Finished updating {len(tasks) - numFailed}/{len(tasks)} station years\n",
+    )
+
     db.cleanup()
 
 
-def pullHourlyData(index: int, row: gpd.GeoSeries, numStations: int, tablename: str):
+def pullStationYear(
+    tablename: str, stationID: str, year: int
+) -> typing.Tuple[str, int]:
     """
     Purpose:
-    Pulls the hourly data and updates the database
+    Pulls a year of hourly data for a station and updates the database
 
     Tables:
     - [ab_hly_station_data](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#ab_hly_station_data)
     - [mb_hly_station_data](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#mb_hly_station_data)
     - [sk_hly_station_data](https://github.com/ChromaticPanic/CGC_Grain_Outcome_Predictions#sk_hly_station_data)
+    - hly_station_ledger
 
     Pseudocode:
-    - Connect to the database
-    - Update the logs as data starts getting pulled
-    - Calculate the time span
-    - Start a random delay (to prevent being detected as a bot)
-    - Request the data
-    - Preprocess the data
-    - Store the data
-    - Update logs
-    - Disconnect from the database
-
-    Remarks: When tables are updated in the future/the script is ran again, data already pulled may be duplicated
+    - Get a handle on the database (pooled, so each worker process reuses its connections across tasks)
+    - Up to MAX_ATTEMPTS times (waiting longer after each failure and giving up on attempts taking over TASK_TIMEOUT)
+        - Request the data (paced by the rate limiter shared by every worker)
+        - Preprocess the data
+        - Replace any data previously stored for the year with the data, recording the deleted and stored days as changed
+          (in one transaction)
+        - Record the year as complete (or partial for the current year) in the ledger
+    - Record the year as failed in the ledger if every attempt failed
+
+    Remarks: returns the status recorded in the ledger and the number of rows stored
     """
     if (
         PG_DB is None
@@ -129,54 +206,94 @@ def pullHourlyData(index: int, row: gpd.GeoSeries, numStations: int, tablename:
         or PG_USER is None
         or PG_PW is None
     ):
-        updateLog(LOG_FILE, "Missing database credentials")
-        return
+        raise ValueError("Environment variables not set")
 
-    # Handles connections to the database
-    db = DataService(PG_DB, PG_ADDR, int(PG_PORT), PG_USER, PG_PW)
-    conn = db.connect()  # Connect to the database
+    # Handles connections to the database (connections are only opened once per worker process)
+    db = DataService(PG_DB, PG_ADDR, int(PG_PORT), PG_USER, PG_PW, pooled=True)
 
-    requester = ClimateDataRequester()  # Handles weather station requests
+    # Handles weather station requests
+    requester = ClimateDataRequester(getSharedLimiter(), openArchive())
     processor = ScrapingProcessor()  # Handles the more complex data processing
+    queryHandler = WeatherQueryBuilder()
+    # Only parses the columns we keep
+    readOptions = processor.readOptions(HOURLY_SCHEMA)
 
-    startYear = int(row["hly_first_year"])
-    endYear = int(row["hly_last_year"])
-    stationID = str(row["station_id"])
-
-    updateLog(
-        LOG_FILE,
-        f"\t[{index + 1}/{numStations}] Pulling data for station {stationID} between {startYear}-{endYear}",
-    )
-
-    span = endYear - startYear
-    for i in range(0, span):
+    for attempt in range(MAX_ATTEMPTS):
         try:
-            sleep(np.random.randint(5, 20))
-            currYear = startYear + i
-
-            # Collect data from the weather stations 1 year at a time
-            df = requester.get_hourly_data(stationID, currYear, currYear)
-            # Prepare data for storage (manipulates dataframe, averages values and removes old data)
-            df = processor.dataProcessHourly(df)
-            # Transform hourly data to daily data
-            df = processor.tranformHourlyToDaily(df)
-
-            # Store data (not using return value due to its inaccuracy)
-            df.to_sql(tablename, conn, schema="public", if_exists="append", index=False)
-
-            updateLog(
-                LOG_FILE,
-                f"station {stationID} year {currYear} updated {len(df.index)} rows",
+            with timeLimit(TASK_TIMEOUT):
+                # Collect data from the weather station for the year
+                df = requester.get_hourly_data(stationID, year, year, readOptions)
+
+                if len(df.index) > 0:
+                    # Prepare data for storage (manipulates dataframe, averages values and removes old data)
+                    df = processor.dataProcessHourly(df)
+                    # Transform hourly data to daily data
+                    df = processor.reduceHourlyToDaily(df)
+
+                # Replace what a previous (interrupted) run may have stored in one transaction (the old rows are kept if storing fails)
+                # the deleted and stored days are recorded as changed in the same transaction
+                query = queryHandler.deleteStationYearReq(tablename, stationID, year)
+                if len(df.index) > 0:
+                    keys = df[STATION_KEYS].drop_duplicates()
+                    changesQuery = queryHandler.recordChangesReq(
+                        tablename, list(keys.itertuples(index=False, name=None))
+                    )
+                    db.bulkWrite(df, tablename, preQueries=[query, changesQuery])
+                else:
+                    with db.checkout() as conn, conn.begin():
+                        conn.execute(sq.text(query))
+
+            currentYear = datetime.date.today().year
+            status = PARTIAL_STATUS if year >= currentYear else COMPLETE_STATUS
+            query = queryHandler.markHlyLedgerReq(
+                stationID, year, status, len(df.index)
             )
+            db.execute(sq.text(query))
+
+            return status, len(df.index)
 
         except Exception as e:
             updateLog(
                 ERROR_FILE,
-                f"\t\t[ERROR] Failed to scrape data for station {stationID} year {currYear}",
+                f"\t\t[ERROR] Failed to scrape data for station {stationID} year {year} (attempt {attempt + 1}/{MAX_ATTEMPTS})",
             )
             updateLog(ERROR_FILE, f"\t\t{e}")
 
-    db.cleanup()
+            if attempt < MAX_ATTEMPTS - 1:
+                time.sleep(RETRY_DELAY * 2**attempt)
+
+    query = queryHandler.markHlyLedgerReq(stationID, year, FAILED_STATUS, 0)
+    db.execute(sq.text(query))
+
+    return FAILED_STATUS, 0
+
+
+@contextlib.contextmanager
+def timeLimit(seconds: int) -> typing.Iterator[None]:
+    """
+    Purpose:
+    Raises TaskTimeout if a with block takes longer than seconds
+
+    Remarks: relies on SIGALRM, on platforms without it (i.e Windows) the block is not limited
+    """
+    if not hasattr(signal, "SIGALRM"):
+        yield
+        return
+
+    def onAlarm(signum, frame):
+        raise TaskTimeout(f"timed out after {seconds}s")
+
+    previous = signal.signal(signal.SIGALRM, onAlarm)
+    signal.alarm(seconds)
+    try:
+        yield
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+class TaskTimeout(Exception):
+    """Raised when an attempt takes longer than TASK_TIMEOUT (not a TimeoutError so the rate limiter does not retry it)"""
 
 
 def checkTables(db: DataService, queryHandler: WeatherQueryBuilder):
@@ -190,6 +307,8 @@ def checkTables(db: DataService, queryHandler: WeatherQueryBuilder):
     Pseudocode:
     - Create the query to check if the hourly stations are loaded into the database
     - Abort if they are not
+    - Create the ledger if it does not exist
+    - Create the table recording the changed station days if it does not exist (read by CombineProvinceData)
     """
     query = sq.text(queryHandler.tableExistsReq(HLY_STATIONS_TABLE))
     tableExists = queryHandler.readTableExists(db.execute(query))  # type: ignore
@@ -201,6 +320,88 @@ def checkTables(db: DataService, queryHandler: WeatherQueryBuilder):
         db.cleanup()
         sys.exit()
 
+    # check if the ledger exists in the database - if not create it
+    query = sq.text(queryHandler.tableExistsReq(LEDGER_TABLE))
+    tableExists = queryHandler.readTableExists(db.execute(query))  # type: ignore
+    if not tableExists:
+        query = sq.text(queryHandler.createHlyLedgerTableReq())
+        db.execute(query)
+
+    db.execute(sq.text(queryHandler.createChangesTableReq()))
+
+
+def getCompletedYears(
+    queryHandler: WeatherQueryBuilder, conn: sq.engine.Connection
+) -> set:
+    """
+    Purpose:
+    Gets the station years that are complete in the ledger
+
+    Tables:
+    - hly_station_ledger
+
+    Remarks: returns a set of (station_id, year) tuples
+    """
+    query = sq.text(queryHandler.getHlyLedgerReq(COMPLETE_STATUS))
+    completed = pd.read_sql(query, conn)
+
+    return set(zip(completed["station_id"].astype(str), completed["year"].astype(int)))
+
+
+def planTasks(
+    stations: pd.DataFrame,
+    completed: set,
+    tablename: str,
+    archived: typing.Optional[set] = None,
+) -> list:
+    """
+    Purpose:
+    Lists the station years of a province that still need to be pulled
+
+    Pseudocode:
+    - For each station, list every year between its first and last year of hourly data (inclusive)
+    - Remove the years that are complete in the ledger (missing, partial and failed years are kept)
+    - If archived station years are provided (replay mode), remove the years that were not archived
+    - Estimate how long each station year will take
+
+    Remarks:
+    - Tasks are returned as (estimated cost, tablename, station_id, year)
+    - The first and last years of a station are usually incomplete, so they are estimated to take half as long
+    """
+    tasks = []
+
+    for _, row in stations.iterrows():
+        stationID = str(row["station_id"])
+        startYear = int(row["hly_first_year"])
+        endYear = int(row["hly_last_year"])
+
+        for year in range(startYear, endYear + 1):
+            if (stationID, year) in completed:
+                continue
+
+            if archived is None or (stationID, year) in archived:
+                cost = PARTIAL_YEAR_COST if year in (startYear, endYear) else 1.0
+                tasks.append((cost, tablename, stationID, year))
+
+    return tasks
+
+
+def getArchivedYears(archive: RawArchive) -> set:
+    """
+    Purpose:
+    Gets the station years whose hourly data is in the raw archive
+
+    Remarks: station years are returned as a set of (station_id, year)
+    """
+    archived = set()
+
+    for entry in archive.entries(HOURLY_SOURCE):
+        startYear, endYear = entry["period"].split("-")
+        for year in range(int(startYear), int(endYear) + 1):
+            archived.add((entry["key"], year))
+
+    return archived
+
 
 def getStations(
     prov: str, queryHandler: WeatherQueryBuilder, conn: sq.engine.Connection
@@ -11,6 +11,78 @@ import pandas as pd
 import typing
 
 
+# The columns kept from the daily CSV files as {source column: (column, data type)}
+DAILY_SCHEMA = {
+    "Climate ID": ("station_id", "str"),
+    "Date/Time": ("date", "datetime64[ns]"),  # (YEAR-MO-DA)
+    "Year": ("year", "int64"),
+    "Month": ("month", "int64"),
+    "Day": ("day", "int64"),
+    "Max Temp (°C)": ("max_temp", "float64"),
+    "Min Temp (°C)": ("min_temp", "float64"),
+    "Mean Temp (°C)": ("mean_temp", "float64"),
+    "Total Rain (mm)": ("total_rain", "float64"),
+    "Total Snow (cm)": ("total_snow", "float64"),
+    "Total Precip (mm)": ("total_precip", "float64"),
+    "Snow on Grnd (cm)": ("snow_on_grnd", "float64"),
+}
+
+# The columns kept from the hourly CSV pages as {source column: (column, data type)}
+HOURLY_SCHEMA = {
+    "CLIMATE_IDENTIFIER": ("station_id", "str"),
+    "LOCAL_DATE": ("datetime", "datetime64[ns]"),
+    "LOCAL_YEAR": ("year", "int64"),
+    "LOCAL_MONTH": ("month", "int64"),
+    "LOCAL_DAY": ("day", "int64"),
+    "LOCAL_HOUR": ("hour", "int64"),
+    "TEMP": ("temp", "float64"),
+    "DEW_POINT_TEMP": ("dew_point_temp", "float64"),
+    "HUMIDEX": ("humidex", "float64"),
+    "PRECIP_AMOUNT": ("precip_amount", "float64"),
+    "RELATIVE_HUMIDITY": ("rel_humid", "float64"),
+    "STATION_PRESSURE": ("stn_press", "float64"),
+    "VISIBILITY": ("visibility", "float64"),
+}
+
+# The missing values replaced by 0 in the daily and hourly data
+DAILY_ZERO_FILLED = ["snow_on_grnd", "total_rain", "total_snow", "total_precip"]
+HOURLY_ZERO_FILLED = [
+    "dew_point_temp",
+    "rel_humid",
+    "precip_amount",
+    "visibility",
+    "stn_press",
+    "humidex",
+]
+
+
+# The daily aggregates of the hourly data as (column, hourly column, aggregate), in the order they are stored
+HOURLY_TO_DAILY = [
+    ("min_temp", "temp", "min"),
+    ("max_temp", "temp", "max"),
+    ("mean_temp", "temp", "mean"),
+    ("min_dew_point_temp", "dew_point_temp", "min"),
+    ("max_dew_point_temp", "dew_point_temp", "max"),
+    ("mean_dew_point_temp", "dew_point_temp", "mean"),
+    ("min_humidex", "humidex", "min"),
+    ("max_humidex", "humidex", "max"),
+    ("mean_humidex", "humidex", "mean"),
+    ("total_precip", "precip_amount", "sum"),
+    ("min_rel_humid", "rel_humid", "min"),
+    ("max_rel_humid", "rel_humid", "max"),
+    ("mean_rel_humid", "rel_humid", "mean"),
+    ("min_stn_press", "stn_press", "min"),
+    ("max_stn_press", "stn_press", "max"),
+    ("mean_stn_press", "stn_press", "mean"),
+    ("min_visibility", "visibility", "min"),
+    ("max_visibility", "visibility", "max"),
+    ("mean_visibility", "visibility", "mean"),
+]
+
+# The columns identifying a day of hourly data
+DAY_KEYS = ["station_id", "year", "month", "day"]
+
+
 class ScrapingProcessor:
     @typing.no_type_check  # need to define a data class for this
     def removeInactive(self, stations: pd.DataFrame, states: list) -> pd.DataFrame:
@@ -19,19 +91,14 @@ class ScrapingProcessor:
         Remove the inactive stations from the list of stations once pulled
 
         Pseudocode:
-        - For each state, check if its active
-        - If it is not active, remove it from the DataFrame
+        - Join the states onto the stations (by station_id)
+        - Keep the stations that are active or have no state
 
         Remarks: stations and states are both parallel
         """
-        for state in states:
-            if not state["is_active"]:
-                stations.drop(
-                    stations[stations.station_id == state["station_id"]].index,
-                    inplace=True,
-                )
+        joined = self.joinStates(stations, states)
 
-        return stations
+        return stations[joined["is_active"].ne(False).to_numpy()]
 
     @typing.no_type_check  # need to define a data class for this
     def addLastUpdated(self, stations: str, states: list) -> pd.DataFrame:
@@ -40,20 +107,68 @@ class ScrapingProcessor:
         Adds the date a station was last updated (from states)
 
         Pseudocode:
-        - Create the column in the DataFrame (defaults as None)
-        - For each state, [add the last_updated date based on the station_id](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.loc.html)
+        - Join the states onto the stations (by station_id)
+        - Add the last_updated date of each station (None for stations without a state)
 
         Remarks: stations and states are both parallel
         """
-        stations["last_updated"] = None
-
-        for state in states:
-            stations.loc[
-                stations["station_id"] == state["station_id"], "last_updated"
-            ] = state["last_updated"]
+        joined = self.joinStates(stations, states)
+        stations["last_updated"] = joined["last_updated"].where(joined["matched"], None)
 
         return stations
 
+    @typing.no_type_check  # need to define a data class for this
+    def mergeStates(self, stations: pd.DataFrame, states: list) -> pd.DataFrame:
+        """
+        Purpose:
+        Removes the inactive stations and adds the date the remaining stations were last updated in a single pass
+
+        Pseudocode:
+        - Join the states onto the stations (by station_id)
+        - Add the last_updated date of each station (None for stations without a state)
+        - Keep the stations that are active or have no state
+
+        Remarks: equivalent to removeInactive followed by addLastUpdated
+        """
+        joined = self.joinStates(stations, states)
+
+        stations = stations.copy()
+        stations["last_updated"] = joined["last_updated"].where(joined["matched"], None)
+
+        return stations[joined["is_active"].ne(False).to_numpy()]
+
+    def joinStates(self, stations: pd.DataFrame, states: list) -> pd.DataFrame:
+        """
+        Purpose:
+        Joins the states (station_id, last_updated and is_active) onto the stations, keeping the index of the stations
+
+        Pseudocode:
+        - Load the states into a DataFrame (keeping the last state of each station)
+            - last_updated is kept as an object column so that the dates are not cast
+        - [Join it onto the stations](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.join.html)
+        - Flag the stations which had a state
+        """
+        statesDF = pd.DataFrame(
+            {
+                "station_id": [state["station_id"] for state in states],
+                "last_updated": pd.Series(
+                    [state["last_updated"] for state in states], dtype=object
+                ),
+                "is_active": pd.Series(
+                    [state["is_active"] for state in states], dtype=object
+                ),
+                "matched": True,
+            }
+        )
+        statesDF = statesDF.drop_duplicates("station_id", keep="last")
+
+        joined = stations[["station_id"]].join(
+            statesDF.set_index("station_id"), on="station_id"
+        )
+        joined["matched"] = joined["matched"].notna()
+
+        return joined
+
     def findLatestDate(self, listOfDates: list) -> typing.Optional[np.datetime64]:
         """
         Purpose:
@@ -122,108 +237,89 @@ class ScrapingProcessor:
         if lastUpdated:
             df.drop(df[df.date <= lastUpdated].index, inplace=True)
 
+    def readOptions(self, schema: dict) -> dict:
+        """
+        Purpose:
+        Creates the [read_csv](https://pandas.pydata.org/docs/reference/api/pandas.read_csv.html) arguments to only parse the columns of a schema
+
+        Pseudocode:
+        - Only read the columns of the schema (usecols), the other columns are never parsed
+        - Parse the columns directly into their data types (dtype), dates are parsed as they are read (parse_dates)
+
+        Remarks: pass the arguments to ClimateDataRequester.get_data or get_hourly_data (i.e DAILY_SCHEMA or HOURLY_SCHEMA)
+        """
+        dates = [
+            col for col, (_, dtype) in schema.items() if dtype.startswith("datetime")
+        ]
+
+        return {
+            "usecols": list(schema.keys()),
+            "dtype": {
+                col: dtype for col, (_, dtype) in schema.items() if col not in dates
+            },
+            "parse_dates": dates,
+        }
+
+    def applySchema(self, df: pd.DataFrame, schema: dict) -> pd.DataFrame:
+        """
+        Purpose:
+        Keeps, renames and casts the columns of a schema in a single pass
+
+        Pseudocode:
+        - Save the data and abort if it is missing columns of the schema
+        - Keep the columns of the schema (if the data was not read with readOptions)
+        - [Rename the columns](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.rename.html)
+        - [Cast the columns](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.astype.html) which were not parsed into their data type
+        """
+        missing = [col for col in schema if col not in df.columns]
+        if missing:
+            if len(df.index) > 0:
+                df.to_csv(
+                    "data/failed/"
+                    + str(df.iloc[0, 0])
+                    + "_unexpected_column_names.csv",
+                    index=False,
+                )
+            raise ValueError(f"Missing columns {missing}")
+
+        if len(df.columns) != len(schema):
+            df = df[list(schema.keys())]
+
+        df = df.rename(
+            columns={col: name for col, (name, _) in schema.items()}, copy=False
+        )
+        dtypes = {name: dtype for name, dtype in schema.values()}
+        toCast = {
+            name: dtype for name, dtype in dtypes.items() if df[name].dtype != dtype
+        }
+
+        return df.astype(toCast) if toCast else df
+
     def processData(self, df: pd.DataFrame, lastUpdated: np.datetime64) -> pd.DataFrame:
         """
         Purpose:
         Prepares data to be stored into the database
 
         Pseudocode:
-        - [Drop irrelevant columns](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.drop.html)
-        - [Rename columns](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.rename.html)
-        - [Cast DataFrame column data types](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.astype.html)
+        - Keep, rename and cast the columns of the daily schema (see applySchema)
         - Remove obsolete data (would already be in the database)
         - Impute null and incorrect values
             - [dropna](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.dropna.html)
-            - [loc](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.loc.html)
-            - [where](https://numpy.org/doc/stable/reference/generated/numpy.where.html)
-        """
-        try:
-            df.drop(
-                columns=[
-                    "Data Quality",
-                    "Max Temp Flag",
-                    "Mean Temp Flag",
-                    "Min Temp Flag",
-                    "Heat Deg Days Flag",
-                    "Cool Deg Days Flag",
-                    "Spd of Max Gust (km/h)",
-                    "Total Rain Flag",
-                    "Total Snow Flag",
-                    "Total Precip Flag",
-                    "Snow on Grnd Flag",
-                    "Dir of Max Gust Flag",
-                    "Spd of Max Gust Flag",
-                    "Heat Deg Days (°C)",
-                    "Cool Deg Days (°C)",
-                    "Longitude (x)",
-                    "Station Name",
-                    "Latitude (y)",
-                    "Dir of Max Gust (10s deg)",
-                ],
-                inplace=True,
-            )
-        except:
-            df.to_csv(
-                "data/failed/" + str(df.iloc[0, 0]) + "_unexpected_column_names.csv",
-                index=False,
-            )
+            - [fillna](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.fillna.html)
 
-        df.rename(columns={df.columns[0]: "station_id"}, inplace=True)
-        df.rename(columns={df.columns[1]: "date"}, inplace=True)  # (YEAR-MO-DA)
-        df.rename(columns={df.columns[2]: "year"}, inplace=True)
-        df.rename(columns={df.columns[3]: "month"}, inplace=True)
-        df.rename(columns={df.columns[4]: "day"}, inplace=True)
-        df.rename(columns={df.columns[5]: "max_temp"}, inplace=True)  # (°C)
-        df.rename(columns={df.columns[6]: "min_temp"}, inplace=True)  # (°C)
-        df.rename(columns={df.columns[7]: "mean_temp"}, inplace=True)  # (°C)
-        df.rename(columns={df.columns[8]: "total_rain"}, inplace=True)  # (mm)
-        df.rename(columns={df.columns[9]: "total_snow"}, inplace=True)  # (cm)
-        df.rename(columns={df.columns[10]: "total_precip"}, inplace=True)  # (mm)
-        df.rename(columns={df.columns[11]: "snow_on_grnd"}, inplace=True)  # (cm)
-
-        df[["station_id"]] = df[["station_id"]].astype(str)
-        df[["date"]] = df[["date"]].astype("datetime64[ns]")
-        df[["year", "month", "day"]] = df[["year", "month", "day"]].astype(int)
-        df[
-            [
-                "max_temp",
-                "min_temp",
-                "mean_temp",
-                "total_rain",
-                "total_snow",
-                "total_precip",
-                "snow_on_grnd",
-            ]
-        ] = df[
-            [
-                "max_temp",
-                "min_temp",
-                "mean_temp",
-                "total_rain",
-                "total_snow",
-                "total_precip",
-                "snow_on_grnd",
-            ]
-        ].astype(
-            float
-        )
+        Remarks: the fewest columns are parsed when the data is read with readOptions(DAILY_SCHEMA)
+        """
+        df = self.applySchema(df, DAILY_SCHEMA)
 
         self.removeOlderThan(df, lastUpdated)
 
-        df.dropna(subset=["mean_temp"], inplace=True)
-        df.loc[df["snow_on_grnd"].isnull(), "snow_on_grnd"] = 0
-        df.loc[df["total_rain"].isnull(), "total_rain"] = 0
-        df.loc[df["total_snow"].isnull(), "total_snow"] = 0
-        df.loc[df["total_precip"].isnull(), "total_precip"] = 0
+        # Rows without a mean temperature are dropped, the other missing values are imputed at once
+        df = df.dropna(subset=["mean_temp"])
+        fills = {col: 0 for col in DAILY_ZERO_FILLED}
+        fills["max_temp"] = df["mean_temp"]
+        fills["min_temp"] = df["mean_temp"]
 
-        df["max_temp"] = np.where(
-            df["max_temp"].isnull(), df["mean_temp"], df["max_temp"]
-        )
-        df["min_temp"] = np.where(
-            df["min_temp"].isnull(), df["mean_temp"], df["min_temp"]
-        )
-
-        return df
+        return df.fillna(fills)
 
     def dataProcessHourly(self, df: pd.DataFrame) -> pd.DataFrame:
         """
@@ -231,85 +327,75 @@ class ScrapingProcessor:
         Prepares data to be stored into the database
 
         Pseudocode:
-        - [Drop irrelevant columns](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.drop.html)
-        - [Rename columns](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.rename.html)
-        - [Impute null and incorrect values](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.loc.html)
-        - [Cast DataFrame column data types](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.astype.html)
+        - Keep, rename and cast the columns of the hourly schema (see applySchema)
+        - [Impute null and incorrect values](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.fillna.html)
+
+        Remarks: the fewest columns are parsed when the data is read with readOptions(HOURLY_SCHEMA)
+        """
+        df = self.applySchema(df, HOURLY_SCHEMA)
+
+        return df.fillna({col: 0 for col in HOURLY_ZERO_FILLED})
+
+    def reduceHourlyToDaily(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Purpose:
+        Aggregates hourly data to compress values into a single day (minimum, mean and maximum values)
+
+        Psuedocode:
+        - Sort the rows once by station_id, year, month and day (a single sort on a combined key)
+            - The sort is skipped if the rows are already sorted (the hourly data service sorts its pages)
+        - Find where each day starts in the sorted rows
+        - Load the hourly columns into a single block (one contiguous row per column)
+        - Reduce every column of the block at once for each day ([reduceat](https://numpy.org/doc/stable/reference/generated/numpy.ufunc.reduceat.html))
+            - minimums and maximums ignore missing values (fmin/fmax)
+            - sums and means ignore missing values (missing values are summed as 0 and not counted)
+        - Fill a preallocated block with the aggregates in the order of HOURLY_TO_DAILY
+
+        Remarks: same results as tranformHourlyToDaily (groupby/agg), which is kept as the reference implementation
         """
-        df.drop(
-            columns=[
-                "x",
-                "y",
-                "ID",
-                "STATION_NAME",
-                "PROVINCE_CODE",
-                "TEMP_FLAG",
-                "DEW_POINT_TEMP_FLAG",
-                "RELATIVE_HUMIDITY_FLAG",
-                "PRECIP_AMOUNT_FLAG",
-                "WIND_DIRECTION",
-                "WIND_DIRECTION_FLAG",
-                "WIND_SPEED",
-                "WIND_SPEED_FLAG",
-                "VISIBILITY_FLAG",
-                "STATION_PRESSURE_FLAG",
-                "HUMIDEX_FLAG",
-                "WINDCHILL",
-                "WINDCHILL_FLAG",
-            ],
-            inplace=True,
+        hourlyCols = list(dict.fromkeys(col for _, col, _ in HOURLY_TO_DAILY))
+        dailyCols = [name for name, _, _ in HOURLY_TO_DAILY]
+
+        if len(df.index) == 0:
+            return pd.DataFrame(columns=DAY_KEYS + dailyCols)
+
+        # stations are numbered in sorted order so that the combined key sorts like the keys themselves
+        stationCodes, _ = pd.factorize(df["station_id"], sort=True)
+        key = stationCodes.astype(np.int64) * 10000 + df["year"].to_numpy(np.int64)
+        key = (key * 13 + df["month"].to_numpy(np.int64)) * 32
+        key += df["day"].to_numpy(np.int64)
+
+        values = np.vstack([df[col].to_numpy(np.float64) for col in hourlyCols])
+        order = None
+        if np.any(key[1:] < key[:-1]):
+            order = np.argsort(key)
+            key = key[order]
+            values = values[:, order]
+
+        starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+        missing = np.isnan(values)
+
+        mins = np.fmin.reduceat(values, starts, axis=1)
+        maxs = np.fmax.reduceat(values, starts, axis=1)
+        sums = np.add.reduceat(np.where(missing, 0, values), starts, axis=1)
+        counts = np.add.reduceat(~missing, starts, axis=1, dtype=np.int64)
+        means = np.divide(
+            sums, counts, out=np.full(sums.shape, np.nan), where=counts > 0
         )
 
-        df.rename(columns={df.columns[0]: "station_id"}, inplace=True)
-        df.rename(columns={df.columns[1]: "datetime"}, inplace=True)
-        df.rename(columns={df.columns[2]: "year"}, inplace=True)
-        df.rename(columns={df.columns[3]: "month"}, inplace=True)
-        df.rename(columns={df.columns[4]: "day"}, inplace=True)
-        df.rename(columns={df.columns[5]: "hour"}, inplace=True)
-        df.rename(columns={df.columns[6]: "temp"}, inplace=True)
-        df.rename(columns={df.columns[7]: "dew_point_temp"}, inplace=True)
-        df.rename(columns={df.columns[8]: "humidex"}, inplace=True)
-        df.rename(columns={df.columns[9]: "precip_amount"}, inplace=True)
-        df.rename(columns={df.columns[10]: "rel_humid"}, inplace=True)
-        df.rename(columns={df.columns[11]: "stn_press"}, inplace=True)
-        df.rename(columns={df.columns[12]: "visibility"}, inplace=True)
-
-        df.loc[df["dew_point_temp"].isnull(), "dew_point_temp"] = 0
-        df.loc[df["rel_humid"].isnull(), "rel_humid"] = 0
-        df.loc[df["precip_amount"].isnull(), "precip_amount"] = 0
-        df.loc[df["visibility"].isnull(), "visibility"] = 0
-        df.loc[df["stn_press"].isnull(), "stn_press"] = 0
-        df.loc[df["humidex"].isnull(), "humidex"] = 0
-
-        df[["station_id"]] = df[["station_id"]].astype(str)
-        df[["datetime"]] = df[["datetime"]].astype("datetime64[ns]")
-        df[["year", "month", "day", "hour"]] = df[
-            ["year", "month", "day", "hour"]
-        ].astype(int)
-
-        df[
-            [
-                "dew_point_temp",
-                "rel_humid",
-                "precip_amount",
-                "visibility",
-                "stn_press",
-                "humidex",
-            ]
-        ] = df[
-            [
-                "dew_point_temp",
-                "rel_humid",
-                "precip_amount",
-                "visibility",
-                "stn_press",
-                "humidex",
-            ]
-        ].astype(
-            float
+        reduced = {"min": mins, "max": maxs, "sum": sums, "mean": means}
+        block = np.empty((len(starts), len(HOURLY_TO_DAILY)), dtype=np.float64)
+        for i, (_, col, agg) in enumerate(HOURLY_TO_DAILY):
+            block[:, i] = reduced[agg][hourlyCols.index(col)]
+
+        # the keys of each day are read from its first row
+        firstRows = starts if order is None else order[starts]
+        transformed = pd.DataFrame(
+            {col: df[col].to_numpy()[firstRows] for col in DAY_KEYS}
         )
+        transformed[dailyCols] = block
 
-        return df
+        return transformed
 
     def tranformHourlyToDaily(self, df: pd.DataFrame) -> pd.DataFrame:
         """
@@ -320,6 +406,8 @@ class ScrapingProcessor:
         - [Aggregate the data](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.agg.html) [by station_id, year, month and day](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.groupby.html)
         - [Rename the columns](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.rename.html)
         - [Cast DataFrame column data types](https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.astype.html)
+
+        Remarks: reference implementation of reduceHourlyToDaily (see benchmarkHourlyToDaily.py)
         """
         # get min max mean for each day
         transformed = (
@@ -28,6 +28,9 @@ create table ab_hly_station_data
     mean_visibility     double precision
 );
 
+create index ix_ab_hly_station_data_btree_station_id_year_month_day
+    on ab_hly_station_data (station_id, year, month, day);
+
 create table ab_station_data
 (
     station_id   text,
@@ -44,6 +47,9 @@ create table ab_station_data
     snow_on_grnd double precision
 );
 
+create index ix_ab_station_data_btree_station_id_year_month_day
+    on ab_station_data (station_id, year, month, day);
+
 create table agg_day_copernicus_satellite_data
 (
     year                                 bigint,
@@ -107,6 +113,12 @@ create table agg_day_copernicus_satellite_data
     mean_leaf_area_index_low_vegetation  double precision
 );
 
+create index ix_agg_day_copernicus_satellite_data_btree_year_month_day_distr
+    on agg_day_copernicus_satellite_data (year, month, day, district);
+
+create index ix_agg_day_copernicus_satellite_data_brin_year_month_day
+    on agg_day_copernicus_satellite_data using brin (year, month, day);
+
 create table agg_ergot_samples
 (
     sample_id            bigint,
@@ -251,6 +263,9 @@ create table agg_soil_moisture
 create index ix_public_agg_soil_moisture_index
     on agg_soil_moisture (index);
 
+create index ix_agg_soil_moisture_btree_year_month_day_district
+    on agg_soil_moisture (year, month, day, district);
+
 create table census_ag_regions
 (
     district bigint,
@@ -316,6 +331,9 @@ create table mb_hly_station_data
     mean_visibility     double precision
 );
 
+create index ix_mb_hly_station_data_btree_station_id_year_month_day
+    on mb_hly_station_data (station_id, year, month, day);
+
 create table mb_station_data
 (
     station_id   text,
@@ -332,6 +350,9 @@ create table mb_station_data
     snow_on_grnd double precision
 );
 
+create index ix_mb_station_data_btree_station_id_year_month_day
+    on mb_station_data (station_id, year, month, day);
+
 create table sk_hly_station_data
 (
     id                  serial
@@ -362,6 +383,9 @@ create table sk_hly_station_data
     mean_visibility     double precision
 );
 
+create index ix_sk_hly_station_data_btree_station_id_year_month_day
+    on sk_hly_station_data (station_id, year, month, day);
+
 create table sk_station_data
 (
     station_id   text,
@@ -378,6 +402,9 @@ create table sk_station_data
     snow_on_grnd double precision
 );
 
+create index ix_sk_station_data_btree_station_id_year_month_day
+    on sk_station_data (station_id, year, month, day);
+
 create table soil_components
 (
     poly_id           bigint,
@@ -472,6 +499,9 @@ create table soil_moisture
     soil_moisture double precision
 );
 
+create index ix_soil_moisture_brin_date
+    on soil_moisture using brin (date);
+
 create table soil_surronding_land
 (
     poly_id    bigint,
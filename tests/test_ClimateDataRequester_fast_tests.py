@@ -1,9 +1,51 @@
 import pytest
 import sys
 import pandas as pd
+import re
+import json as jsonlib
 
+sys.path.append("../src")
 sys.path.append("../src/WeatherStation")
-from ClimateDataRequester import ClimateDataRequester as cr
+from ClimateDataRequester import ClimateDataRequester as cr, PAGE_SIZE
+
+
+class FakeResponse:
+    def __init__(self, content=b"", json=None):
+        self.content = content if json is None else jsonlib.dumps(json).encode()
+        self.jsonData = json
+        self.status_code = 200
+        self.text = content.decode()
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.jsonData
+
+
+class FakeSession:
+    """Serves numRows hourly rows in pages, optionally without reporting the number of rows"""
+
+    def __init__(self, numRows, reportCount=True):
+        self.numRows = numRows
+        self.reportCount = reportCount
+        self.urls = []
+
+    def get(self, url, timeout=None, **kwargs):
+        self.urls.append(url)
+
+        if "f=json" in url:
+            return FakeResponse(
+                json={"numberMatched": self.numRows} if self.reportCount else {}
+            )
+
+        start = int(re.search(r"startindex=(\d+)", url).group(1))
+        rows = range(start, min(start + PAGE_SIZE, self.numRows))
+        if len(rows) == 0:
+            return FakeResponse()
+
+        lines = ["ID,TEMP"] + [f"{i},{i / 10}" for i in rows]
+        return FakeResponse("\n".join(lines).encode())
 
 
 def getTestList():
@@ -92,6 +134,59 @@ def test_trim_by_date_beyond():
     assert len(resultList) == 8
 
 
+@pytest.mark.parametrize("reportCount", [True, False])
+def test_get_hourly_data_pages(reportCount):
+    req = cr()
+    req.session = FakeSession(PAGE_SIZE * 2 + 5, reportCount)
+
+    df = req.get_hourly_data("3010010", 2000, 2005)
+    assert len(df.index) == PAGE_SIZE * 2 + 5
+    assert df["ID"].tolist() == list(range(PAGE_SIZE * 2 + 5))
+
+    if reportCount:
+        # the count and then exactly one request per page
+        assert len(req.session.urls) == 4
+
+
+def test_get_hourly_data_empty():
+    req = cr()
+    req.session = FakeSession(0, False)
+    assert req.get_hourly_data("3010010").empty
+
+
+class FakeListingSession:
+    """Serves a province listing of the daily files from getTestList and a small CSV per file"""
+
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url, headers=None, verify=None, timeout=None):
+        self.urls.append(url)
+
+        if url.endswith("/"):
+            links = getTestList() + ["climate_daily_AB_3010011_2004-07_P1D.csv"]
+            html = "".join(f'<a href="{link}">{link}</a>' for link in links)
+            return FakeResponse(f"<html><body>{html}</body></html>".encode())
+
+        return FakeResponse(f"File\n{url.split('/')[-1]}".encode())
+
+
+def test_get_data_listing_cache():
+    req = cr()
+    req.session = FakeListingSession()
+
+    df = req.get_data("AB", "3010010", 2020, 2021)
+    assert sorted(df["File"].tolist()) == sorted(getTestList()[2:6])
+
+    df = req.get_data("AB", "3010010", 2004, 2004)
+    assert len(df.index) == 2
+    assert len(req.get_url_list("AB")) == 9
+    assert len(req.get_url_list("AB", "3010011")) == 1
+
+    # the province listing is only downloaded once
+    assert len([url for url in req.session.urls if url.endswith("/")]) == 1
+
+
 def test_pull_data():
     req = cr()
     df = req.pull_data("AB/climate_daily_AB_3010010_2004-07_P1D.csv")
@@ -1,6 +1,7 @@
 import pytest
 import sys
 
+sys.path.append("../src")
 sys.path.append("../src/WeatherStation")
 from ClimateDataRequester import ClimateDataRequester as cr
 
@@ -2,10 +2,11 @@ import pytest
 import sys
 import numpy as np
 import pandas as pd
+import io
 
 sys.path.append("../src/WeatherStation")
 
-from scrapingProcessor import ScrapingProcessor
+from scrapingProcessor import ScrapingProcessor, HOURLY_SCHEMA
 
 processor = ScrapingProcessor()
 
@@ -209,6 +210,23 @@ def test_add_last_updated_with_missing():
     assert np.isnat(stations["last_updated"][0])
 
 
+def test_merge_states():
+    stations = pd.DataFrame()
+    stations["station_id"] = ["1", "2", "3", "4"]
+    states = [
+        {"station_id": "3", "last_updated": "2012-01-01", "is_active": False},
+        {"station_id": "1", "last_updated": "2010-05-05", "is_active": True},
+        {"station_id": "2", "last_updated": np.datetime64("NaT"), "is_active": True},
+    ]
+
+    stations = processor.mergeStates(stations, states)
+
+    assert list(stations["station_id"]) == ["1", "2", "4"]
+    assert stations["last_updated"][0] == "2010-05-05"
+    assert np.isnat(stations["last_updated"][1])
+    assert stations["last_updated"][3] is None
+
+
 def test_find_latest_date():
     listOfDates = [
         np.datetime64("2010-05-05"),
@@ -488,3 +506,46 @@ def test_remove_older_than_null_date():
     assert np.datetime64("2012-05-05") in df.values
     assert np.datetime64("2012-05-07") in df.values
     assert np.datetime64("2000-05-05") in df.values
+
+
+def test_data_process_hourly_schema():
+    csv = (
+        "x,CLIMATE_IDENTIFIER,LOCAL_DATE,LOCAL_YEAR,LOCAL_MONTH,LOCAL_DAY,LOCAL_HOUR,TEMP,TEMP_FLAG,"
+        "DEW_POINT_TEMP,HUMIDEX,PRECIP_AMOUNT,RELATIVE_HUMIDITY,STATION_PRESSURE,VISIBILITY\n"
+        "-114.1,3010010,2004-07-01 00:00:00,2004,7,1,0,15.5,M,,,0.2,80,90.1,\n"
+    )
+
+    # only the columns of the schema are read (and renamed/cast once)
+    df = pd.read_csv(io.StringIO(csv), **processor.readOptions(HOURLY_SCHEMA))
+    assert "x" not in df.columns and "TEMP_FLAG" not in df.columns
+
+    df = processor.dataProcessHourly(df)
+    assert list(df.columns) == [name for name, _ in HOURLY_SCHEMA.values()]
+    assert df["station_id"][0] == "3010010"
+    assert df["datetime"][0] == np.datetime64("2004-07-01T00:00:00")
+    assert df["dew_point_temp"][0] == 0
+    assert df["visibility"][0] == 0
+    assert df["temp"][0] == 15.5
+
+
+def test_reduce_hourly_to_daily():
+    df = pd.DataFrame()
+    df["station_id"] = ["2", "1", "1", "2", "1", "1"]
+    df["year"] = [2020] * 6
+    df["month"] = [1] * 6
+    df["day"] = [1, 2, 1, 1, 1, 2]
+    df["hour"] = [0, 0, 0, 1, 1, 1]
+    for col in ["dew_point_temp", "humidex", "rel_humid", "stn_press", "visibility"]:
+        df[col] = [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]
+    df["temp"] = [np.nan, -2.5, 4.0, np.nan, 1.0, np.nan]
+    df["precip_amount"] = [0.5, np.nan, 1.5, 0.2, 0.0, np.nan]
+
+    result = processor.reduceHourlyToDaily(df)
+    expected = processor.tranformHourlyToDaily(df)
+
+    # days are sorted by station and date, missing values are ignored (days without values are NaN, totals are 0)
+    pd.testing.assert_frame_equal(result, expected)
+    assert list(result["station_id"]) == ["1", "1", "2"]
+    assert result["mean_temp"][0] == 2.5
+    assert np.isnan(result["max_temp"][2])
+    assert result["total_precip"][1] == 0
@@ -0,0 +1,93 @@
+import sys
+
+sys.path.append("../src")
+
+from WeatherStation.WeatherQueryBuilder import WeatherQueryBuilder
+
+queryBuilder = WeatherQueryBuilder()
+
+
+def getQuery(dateCols):
+    return " ".join(
+        queryBuilder.aggregateByDistrictReq(
+            ["ab_hly_station_data", "mb_hly_station_data"],
+            "stations_hly",
+            dateCols,
+            {"min_temp": "mean", "total_precip": ["min", "max", "mean"]},
+            ["min_temp", "min_precip", "max_precip", "mean_precip"],
+        ).split()
+    )
+
+
+def test_aggregate_by_district_day():
+    query = getQuery(["year", "month", "day"])
+
+    assert query.startswith(
+        "SELECT stations.district, data.year, data.month, data.day, "
+        "AVG(data.min_temp) AS min_temp, MIN(data.total_precip) AS min_precip, "
+        "MAX(data.total_precip) AS max_precip, AVG(data.total_precip) AS mean_precip"
+    )
+    assert (
+        "FROM (SELECT * FROM public.ab_hly_station_data UNION "
+        "SELECT * FROM public.mb_hly_station_data) AS data" in query
+    )
+    assert "FROM public.stations_hly" in query
+    assert "GROUP BY stations.district, data.year, data.month, data.day" in query
+    assert "calendar" not in query
+
+
+def test_aggregate_by_district_week():
+    query = getQuery(["year", "week"])
+
+    # weeks are looked up from the harvest calendar (the 29th of February uses the week of the 28th)
+    assert "GROUP BY stations.district, data.year, calendar.week" in query
+    assert "(1, 1, 1)" in query
+    assert "(2, 29, 9)" in query
+    assert "(2, 30," not in query
+
+
+def test_aggregate_changed_keys():
+    query = " ".join(
+        queryBuilder.aggregateByDistrictReq(
+            ["ab_dly_station_data", "mb_dly_station_data"],
+            "stations_dly",
+            ["year", "month", "day"],
+            {"min_temp": "min"},
+            ["min_temp"],
+            [(4810, 2023, 7, 1), (4820, 2023, 7, 2)],
+        ).split()
+    )
+
+    # every data table is filtered on its (station_id, year, month, day) index before the tables are combined
+    assert query.count("WHERE (station_id, year, month, day) IN") == 2
+    assert "FROM (VALUES (4810, 2023, 7, 1), (4820, 2023, 7, 2)) AS changed" in query
+
+
+def test_changed_keys():
+    query = " ".join(
+        queryBuilder.changedKeysReq(
+            1200, ["ab_dly_station_data", "ab_hly_station_data"], "stations_dly"
+        ).split()
+    )
+
+    assert query.startswith(
+        "SELECT DISTINCT stations.district, changes.year, changes.month, changes.day"
+    )
+    assert (
+        "WHERE changes.id <= 1200 AND changes.source_table IN ('ab_dly_station_data', 'ab_hly_station_data')"
+        in query
+    )
+
+
+def test_record_deleted_keys():
+    query = " ".join(
+        queryBuilder.deleteStationYearReq(
+            "ab_hly_station_data", "3010010", 2022
+        ).split()
+    )
+
+    # the deleted days are recorded as changed by the same statement
+    assert query.startswith("WITH deleted AS ( DELETE FROM ab_hly_station_data")
+    assert "RETURNING station_id, year, month, day" in query
+    assert "INSERT INTO weather_station_changes" in query
+    assert "COMMIT" not in query
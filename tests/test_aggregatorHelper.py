@@ -0,0 +1,116 @@
+import pytest
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append("../src")
+
+from Shared.aggregatorHelper import AggregatorHelper, MIN_YEAR, MAX_YEAR
+
+helper = AggregatorHelper()
+
+
+def getDailyAggDF():
+    agg_df = pd.DataFrame()
+    agg_df["district"] = [4610, 4610, 4620, 4610]
+    agg_df["year"] = [2000, 2000, 2000, 1999]
+    agg_df["month"] = [1, 10, 1, 10]
+    agg_df["day"] = [2, 1, 1, 1]
+    agg_df["min_temp"] = [-10.5, 2.0, -20.0, 5.0]
+    agg_df["max_temp"] = [1.5, 12.0, np.nan, 15.0]
+    return agg_df
+
+
+def getDistricts():
+    data = pd.DataFrame()
+    data["district"] = [4610, 4620]
+    return data
+
+
+def getRow(df, year, district):
+    return df.loc[(df["year"] == year) & (df["district"] == district)].iloc[0]
+
+
+def test_reshape_by_dates_shape():
+    dates = helper.getDatesInYr()
+    df = helper.reshapeDataByDates(dates, getDailyAggDF(), getDistricts(), "dates")
+
+    assert len(df) == (MAX_YEAR - MIN_YEAR + 1) * 2
+    assert df.columns.tolist()[:4] == [
+        "year",
+        "district",
+        "01-01:min_temp",
+        "01-01:max_temp",
+    ]
+    assert len(df.columns) == 2 + len(dates) * 2
+    assert df["year"].tolist()[:4] == [MIN_YEAR, MIN_YEAR, MIN_YEAR + 1, MIN_YEAR + 1]
+    assert df["district"].tolist()[:4] == [4610, 4620, 4610, 4620]
+
+
+def test_reshape_by_dates_values():
+    dates = helper.getDatesInYr()
+    df = helper.reshapeDataByDates(dates, getDailyAggDF(), getDistricts(), "dates")
+
+    row = getRow(df, 2000, 4610)
+    assert row["01-02:min_temp"] == -10.5
+    assert row["01-02:max_temp"] == 1.5
+    assert row["10-01:min_temp"] == 2.0
+    assert row["01-01:min_temp"] == 0
+
+    row = getRow(df, 2000, 4620)
+    assert row["01-01:min_temp"] == -20.0
+    assert np.isnan(row["01-01:max_temp"])
+
+    # columns without any data keep the zero default as an integer
+    assert df["03-03:min_temp"].dtype == np.int64
+    assert (df["03-03:min_temp"] == 0).all()
+
+
+def test_reshape_by_dates_harvest():
+    dates = helper.getDatesInYr()
+    df = helper.reshapeDataByDates(
+        dates, getDailyAggDF(), getDistricts(), "dates", True
+    )
+
+    # the fall of the previous year is used for the current harvest
+    assert getRow(df, 2000, 4610)["10-01:min_temp"] == 5.0
+    assert getRow(df, 2001, 4610)["10-01:min_temp"] == 2.0
+    assert getRow(df, 2000, 4610)["01-02:min_temp"] == -10.5
+
+
+def test_reshape_by_weeks_and_months():
+    agg_df = pd.DataFrame()
+    agg_df["district"] = [4610, 4610]
+    agg_df["year"] = [2000, 2000]
+    agg_df["week"] = [1, 40]
+    agg_df["rain"] = [3.5, 7.0]
+
+    weeks = helper.getWeeksInYr()
+    df = helper.reshapeDataByDates(weeks, agg_df, getDistricts(), "weeks", True)
+    assert getRow(df, 2000, 4610)["1:rain"] == 3.5
+    assert getRow(df, 2001, 4610)["40:rain"] == 7.0
+    assert getRow(df, 2000, 4610)["40:rain"] == 0
+
+    agg_df = agg_df.rename(columns={"week": "month"})
+    agg_df["month"] = [1, 9]
+
+    months = helper.getMonthsInYr()
+    df = helper.reshapeDataByDates(months, agg_df, getDistricts(), "months")
+    assert len(df.columns) == 2 + len(months)
+    assert getRow(df, 2000, 4610)["1:rain"] == 3.5
+    assert getRow(df, 2000, 4610)["9:rain"] == 7.0
+
+
+def test_reshape_duplicate_rows_default_to_zero():
+    agg_df = getDailyAggDF()
+    agg_df = pd.concat([agg_df, agg_df.iloc[[0]]], ignore_index=True)
+
+    dates = helper.getDatesInYr()
+    df = helper.reshapeDataByDates(dates, agg_df, getDistricts(), "dates")
+    assert getRow(df, 2000, 4610)["01-02:min_temp"] == 0
+    assert getRow(df, 2000, 4610)["10-01:min_temp"] == 2.0
+
+
+def test_reshape_invalid_date_type():
+    with pytest.raises(ValueError):
+        helper.reshapeDataByDates([], getDailyAggDF(), getDistricts(), "days")
@@ -0,0 +1,98 @@
+import multiprocessing as mp
+import sys
+import os
+
+sys.path.append("../src")
+
+from Shared.rawArchive import RawArchive, requestName
+from Shared.rateLimiter import RateLimiter
+from Shared.stubServices import StubClient
+from Shared.cdsPipeline import CDSPipeline
+
+DATASET = "reanalysis-era5-land"
+
+
+def markProcessed(target: str):
+    """Stands in for the processing of a download (ran on the pool)"""
+    os.rename(target, f"{target}.done")
+
+
+def test_pipeline(tmp_path):
+    archive = RawArchive(str(tmp_path / "archive"))
+    jobs = []
+    for day in range(1, 6):
+        request = {"year": "2022", "month": "7", "day": str(day)}
+        target = str(tmp_path / f"2022_7_{day}.netcdf.zip")
+        jobs.append((request, target, (target,)))
+
+        # the last request was never archived and fails once completed
+        if day < 5:
+            archive.put(
+                b"netcdf", "era5-land", "", "2022", requestName(DATASET, request)
+            )
+
+    client = StubClient(archive, "era5-land", latency=0.1, errorRate=0.2, seed=2)
+    limiter = RateLimiter(1000, 4, baseBackoff=0.01)
+    downloaded = []
+    failed = []
+
+    pipeline = CDSPipeline(
+        client, DATASET, limiter, maxQueued=2, pollInterval=0.02, log=failed.append
+    )
+    with mp.get_context("fork").Pool(2) as pool:
+        numProcessed = pipeline.run(
+            jobs,
+            pool,
+            markProcessed,
+            lambda request, target: downloaded.append(request["day"]),
+        )
+
+    assert numProcessed == 4
+    assert sorted(downloaded) == ["1", "2", "3", "4"]
+    assert len(failed) == 1 and "2022_7_5" in failed[0]
+    for day in range(1, 5):
+        assert os.path.exists(tmp_path / f"2022_7_{day}.netcdf.zip.done")
+
+    # submissions rejected by the full queue are retried
+    numRequests, numErrors = client.getRequestCount()
+    assert numErrors > 0
+    assert numRequests == 5 + numErrors
+
+
+def failThirdDay(target: str):
+    """Stands in for processing that fails for the third day"""
+    if "2022_7_3" in target:
+        raise RuntimeError("bad download")
+    markProcessed(target)
+
+
+def test_pipeline_errors(tmp_path):
+    archive = RawArchive(str(tmp_path / "archive"))
+    jobs = []
+    for day in range(1, 5):
+        request = {"year": "2022", "month": "7", "day": str(day)}
+        target = str(tmp_path / f"2022_7_{day}.netcdf.zip")
+        jobs.append((request, target, (target,)))
+        archive.put(b"netcdf", "era5-land", "", "2022", requestName(DATASET, request))
+
+    def archiveDownload(request: dict, target: str):
+        if request["day"] == "2":
+            raise OSError("No space left on device")
+
+    client = StubClient(archive, "era5-land", latency=0.1)
+    limiter = RateLimiter(1000, 4, baseBackoff=0.01)
+    failed = []
+
+    pipeline = CDSPipeline(
+        client, DATASET, limiter, maxQueued=2, pollInterval=0.02, log=failed.append
+    )
+    with mp.get_context("fork").Pool(2) as pool:
+        numProcessed = pipeline.run(jobs, pool, failThirdDay, archiveDownload)
+
+    # the failed handoff and processing are reported, the other jobs are processed
+    assert numProcessed == 2
+    assert len(failed) == 2
+    assert "hand off" in failed[0] and "2022_7_2" in failed[0]
+    assert "process" in failed[1] and "2022_7_3" in failed[1]
+    for day in [1, 4]:
+        assert os.path.exists(tmp_path / f"2022_7_{day}.netcdf.zip.done")
@@ -0,0 +1,63 @@
+import pytest
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append("../src")
+
+import Shared.chunkAggregator as chunkAggregator
+from Shared.chunkAggregator import ChunkAggregator
+
+AGGS = {"temp": ["min", "max", "mean"], "precip": "mean"}
+AGG_COLS = ["min_temp", "max_temp", "mean_temp", "mean_precip"]
+
+
+def makeData(numRows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "district": rng.integers(0, 20, numRows).astype("int16"),
+            "year": rng.integers(1995, 1999, numRows).astype("int16"),
+            "temp": rng.normal(size=numRows).astype("float32"),
+            "precip": rng.normal(size=numRows),
+        }
+    )
+    df.loc[rng.random(numRows) < 0.3, "temp"] = np.nan
+    df.loc[df["district"] == 3, "precip"] = np.nan
+
+    return df
+
+
+def test_matches_groupby(monkeypatch):
+    monkeypatch.setattr(chunkAggregator, "MERGE_ROWS", 50)
+    df = makeData(20000)
+
+    aggregator = ChunkAggregator(["district", "year"], AGGS, AGG_COLS)
+    for start in range(0, len(df.index), 1500):
+        aggregator.add(df.iloc[start : start + 1500])
+
+    expected = df.astype({"temp": "float64"}).groupby(["district", "year"])
+    expected = expected.agg(AGGS).reset_index()
+    expected.columns = ["district", "year"] + AGG_COLS
+
+    pd.testing.assert_frame_equal(aggregator.result(), expected, check_dtype=False)
+
+
+def test_empty():
+    aggregator = ChunkAggregator(["district"], AGGS)
+    aggregator.add(makeData(0))
+
+    agg_df = aggregator.result()
+    assert len(agg_df.index) == 0
+    assert agg_df.columns.tolist() == [
+        "district",
+        "temp_min",
+        "temp_max",
+        "temp_mean",
+        "precip_mean",
+    ]
+
+
+def test_invalid_function():
+    with pytest.raises(ValueError):
+        ChunkAggregator(["district"], {"temp": "median"})
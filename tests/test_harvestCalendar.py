@@ -0,0 +1,43 @@
+import pytest
+import sys
+import datetime
+import pandas as pd
+
+sys.path.append("../src")
+
+from Shared.harvestCalendar import HarvestCalendar, CALENDAR_ATTRS, INVALID_DATE
+
+harvestCalendar = HarvestCalendar()
+
+
+def test_weeks_match_2001_iso_weeks():
+    table = harvestCalendar.getLookupTable()
+    weekPos = CALENDAR_ATTRS.index("week")
+
+    date = datetime.date(2001, 1, 1)
+    while date.year == 2001:
+        assert table[date.month, date.day, weekPos] == date.isocalendar()[1]
+        date += datetime.timedelta(days=1)
+
+
+def test_leap_day():
+    table = harvestCalendar.getLookupTable()
+
+    assert table[2, 29, CALENDAR_ATTRS.index("week")] == 9
+    assert table[2, 29, CALENDAR_ATTRS.index("day_of_year")] == 60
+    assert table[3, 1, CALENDAR_ATTRS.index("day_of_year")] == 61
+    assert (table[2, 30] == INVALID_DATE).all()
+
+
+def test_add_calendar_attrs():
+    df = pd.DataFrame()
+    df["month"] = [1, 8, 9, 12]
+    df["day"] = [1, 31, 1, 31]
+
+    df = harvestCalendar.addCalendarAttrs(
+        df, {"week": "week_of_year", "harvest_year_offset": "offset"}
+    )
+
+    assert df["week_of_year"].tolist() == [1, 35, 35, 1]
+    assert df["offset"].tolist() == [0, 0, 1, 1]
+    assert "day_of_year" not in df.columns
@@ -0,0 +1,166 @@
+import pytest
+import sys
+import os
+import numpy as np
+import pandas as pd
+
+sys.path.append("../src")
+sys.path.append("../src/SatelliteCopernicus")
+
+pytest.importorskip("geopandas")
+xr = pytest.importorskip("xarray")
+pytest.importorskip("cdsapi")
+
+# the script moves into its own folder when it is imported
+cwd = os.getcwd()
+import pullCopernicusData
+from pullCopernicusData import VARIABLES, AGGREGATES
+
+os.chdir(cwd)
+
+from Shared.regionLookup import RegionLookup, NO_REGION
+
+# a 3x3 grid (sorted coordinates) where two regions share the first two rows and the last row is outside of every region
+LOOKUP = RegionLookup(
+    np.array([49.0, 49.1, 49.2]),
+    np.array([-100.2, -100.1, -100.0]),
+    np.array([1, 1, 2, 1, 2, 2] + [NO_REGION] * 3),
+    np.array([4610, 4610, 4620, 4610, 4620, 4620] + [NO_REGION] * 3),
+)
+
+
+def makeDataset() -> "xr.Dataset":
+    """Two days of three hours stored like the downloads (descending latitudes) with missing values"""
+    rng = np.random.default_rng(0)
+    times = pd.to_datetime(
+        ["2022-07-01 00:00", "2022-07-01 12:00", "2022-07-01 23:00"]
+        + ["2022-07-02 00:00", "2022-07-02 06:00", "2022-07-02 18:00"]
+    )
+    lats = np.array([49.2, 49.1, 49.0])
+    lons = np.array([-100.2, -100.1, -100.0])
+
+    t2m = rng.normal(290, 5, (6, 3, 3)).astype("float32")
+    t2m[rng.random(t2m.shape) < 0.3] = np.nan
+    # region 2 is (49.0, -100.0), (49.1, -100.1) and (49.1, -100.0), it has no temperature on the second day
+    t2m[3:, 2, 2] = np.nan
+    t2m[3:, 1, 1:] = np.nan
+    sp = rng.normal(95000, 500, (6, 3, 3))
+    sp[:3] = np.nan  # no pressure on the first day
+
+    # every other variable is missing from the file
+    return xr.Dataset(
+        {
+            "t2m": (("time", "latitude", "longitude"), t2m),
+            "sp": (("time", "latitude", "longitude"), sp),
+        },
+        coords={"time": times, "latitude": lats, "longitude": lons},
+    )
+
+
+def referenceAggregate(dataset: "xr.Dataset", lookup: RegionLookup) -> pd.DataFrame:
+    """Aggregates the flat hourly table (one row per hour and cell) by day and region"""
+    df = dataset.to_dataframe().reset_index()
+    df = df.rename(columns={"latitude": "lat", "longitude": "lon", **VARIABLES})
+    for attr in VARIABLES.values():
+        if attr not in df.columns:
+            df[attr] = np.nan
+    df[list(VARIABLES.values())] = df[list(VARIABLES.values())].astype(float)
+
+    df = lookup.label(df)
+    df["year"] = df["time"].dt.year
+    df["month"] = df["time"].dt.month
+    df["day"] = df["time"].dt.day
+
+    aggregate = (
+        df.groupby(["year", "month", "day", "cr_num", "district"])
+        .agg({attr: AGGREGATES for attr in VARIABLES.values()})
+        .reset_index()
+    )
+    aggregate.columns = ["year", "month", "day", "cr_num", "district"] + [
+        f"{agg}_{attr}" for attr in VARIABLES.values() for agg in AGGREGATES
+    ]
+
+    return aggregate
+
+
+def test_aggregate_dataset(monkeypatch):
+    monkeypatch.setattr(pullCopernicusData, "loadRegionLookup", lambda *args: LOOKUP)
+    dataset = makeDataset()
+
+    result = pullCopernicusData.aggregateDataset(dataset, None)
+    expected = referenceAggregate(dataset, LOOKUP)
+
+    # rows are ordered by day then region, missing values are ignored (days without values are NaN)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    assert list(result["district"]) == [4610, 4620, 4610, 4620]
+    assert result["mean_surface_pressure"].isna().tolist() == [True, True, False, False]
+    assert result["min_temperature"].isna().tolist() == [False, False, False, True]
+    assert result["max_snowmelt"].isna().all()
+
+
+def completed(dates: list) -> pd.DataFrame:
+    """The completed days as returned by getCompleteDates"""
+    return pd.DataFrame(dates, columns=["year", "month", "day"], dtype="int64")
+
+
+def allDays(numDays: int) -> list:
+    return [str(day) for day in range(1, numDays + 1)]
+
+
+@pytest.fixture
+def plan(monkeypatch):
+    """Plans the requests for 2022 (January to March) allowing up to maxDays days (x months) per request"""
+    fieldsPerDay = len(pullCopernicusData.ATTRS) * len(pullCopernicusData.HOURS)
+
+    def plan(completedDf, maxDays, years=["2022"], months=["1", "2", "3"]):
+        monkeypatch.setattr(pullCopernicusData, "MAX_FIELDS", fieldsPerDay * maxDays)
+        monkeypatch.setattr(pullCopernicusData, "YEARS", years)
+        monkeypatch.setattr(pullCopernicusData, "MONTHS", months)
+
+        return pullCopernicusData.planRequests(completedDf)
+
+    return plan
+
+
+def test_plan_merges_missing_months(plan):
+    # February and its 28 days joins the request of January's 31 days (the CDS skips the dates which do not exist)
+    requests = plan(completed([]), 93)
+
+    assert requests == [("2022", ["1", "2", "3"], allDays(31))]
+
+
+def test_plan_partial_months(plan):
+    requests = plan(completed([(2022, 2, 10)]), 93)
+
+    february = [day for day in allDays(28) if day != "10"]
+    assert requests == [
+        ("2022", ["1"], allDays(31)),
+        ("2022", ["2"], february),
+        ("2022", ["3"], allDays(31)),
+    ]
+
+
+def test_plan_max_fields(plan):
+    requests = plan(completed([]), 62)
+    assert requests == [
+        ("2022", ["1", "2"], allDays(31)),
+        ("2022", ["3"], allDays(31)),
+    ]
+
+    # a month over MAX_FIELDS is split into evenly sized batches which are not merged
+    requests = plan(completed([]), 16, months=["1"])
+    assert [days for _, _, days in requests] == [allDays(16), allDays(31)[16:]]
+
+
+def test_plan_year_boundary(plan):
+    # February 2022 directly follows the request for January 2021 once February 2021 and January 2022 are complete
+    completedDf = completed(
+        [(2021, 2, day) for day in range(1, 29)]
+        + [(2022, 1, day) for day in range(1, 32)]
+    )
+    requests = plan(completedDf, 93, years=["2021", "2022"], months=["1", "2"])
+
+    assert requests == [
+        ("2021", ["1"], allDays(31)),
+        ("2022", ["2"], allDays(28)),
+    ]
@@ -0,0 +1,52 @@
+import json
+import sys
+
+sys.path.append("../src")
+
+from Shared.queryProfiler import QueryProfiler
+
+
+def test_record_disabled():
+    profiler = QueryProfiler()
+    profiler.record("SELECT 1", 0.5, 1, 8)
+
+    assert profiler.getStats() == []
+
+
+def test_record_by_stage():
+    profiler = QueryProfiler()
+    profiler.enable()
+
+    with profiler.stage("pull"):
+        profiler.record("SELECT *\n  FROM   stations", 0.5, 10, 80)
+        profiler.record("SELECT * FROM stations", 1.5, 20, 160)
+    profiler.record("SELECT * FROM stations", 3.0, 5, 40)
+
+    stats = profiler.getStats()
+    assert [stat["stage"] for stat in stats] == ["untagged", "pull"]
+
+    stat = stats[1]
+    assert stat["statement"] == "SELECT * FROM stations"
+    assert stat["caller"] == f"{__name__}.test_record_by_stage"
+    assert stat["calls"] == 2
+    assert stat["seconds"] == 2.0
+    assert stat["maxSeconds"] == 1.5
+    assert stat["rows"] == 30
+    assert stat["bytes"] == 240
+
+
+def test_export(tmp_path):
+    profiler = QueryProfiler()
+    profiler.enable()
+
+    with profiler.stage("write"):
+        profiler.record("COPY a FROM STDIN", 1.0, 100, 1000)
+        profiler.record("COPY b FROM STDIN", 2.0, 50, 500)
+
+    path = tmp_path / "profile.json"
+    profiler.export(str(path))
+    profile = json.loads(path.read_text())
+
+    assert profile["stages"]["write"]["calls"] == 2
+    assert profile["stages"]["write"]["rows"] == 150
+    assert profile["queries"][0]["statement"] == "COPY b FROM STDIN"
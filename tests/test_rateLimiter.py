@@ -0,0 +1,99 @@
+import pytest
+import sys
+import time
+import threading
+import requests as rq
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.append("../src")
+
+from Shared.rateLimiter import RateLimiter, isRetryable
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers 429 to the first numBusy requests then 200, 404 is returned for /missing"""
+
+    numBusy = 0
+    numRequests = 0
+
+    def do_GET(self):
+        StubHandler.numRequests += 1
+
+        if self.path == "/missing":
+            self.send_response(404)
+        elif StubHandler.numRequests <= StubHandler.numBusy:
+            self.send_response(429)
+            self.send_header("Retry-After", "0.1")
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stubServer():
+    server = HTTPServer(("localhost", 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    StubHandler.numBusy = 0
+    StubHandler.numRequests = 0
+    yield f"http://localhost:{server.server_port}"
+
+    server.shutdown()
+    server.server_close()
+
+
+def get(url):
+    res = rq.get(url, timeout=5)
+    res.raise_for_status()
+    return res
+
+
+def test_rate_limit(stubServer):
+    limiter = RateLimiter(rate=20, maxConcurrent=4)
+
+    start = time.perf_counter()
+    for _ in range(11):
+        limiter.call(get, stubServer)
+
+    # the first request is sent straight away, the next 10 at 20 per second
+    assert time.perf_counter() - start >= 0.45
+    assert StubHandler.numRequests == 11
+
+
+def test_backoff_and_recover(stubServer):
+    StubHandler.numBusy = 2
+    limiter = RateLimiter(rate=20, maxConcurrent=4)
+
+    assert limiter.call(get, stubServer).status_code == 200
+    assert StubHandler.numRequests == 3
+    assert limiter.getRate() < 20
+
+    for _ in range(20):
+        limiter.call(get, stubServer)
+    assert limiter.getRate() == 20
+
+
+def test_gives_up(stubServer):
+    StubHandler.numBusy = 100
+    limiter = RateLimiter(rate=20, maxConcurrent=4, maxRetries=2)
+
+    with pytest.raises(rq.HTTPError):
+        limiter.call(get, stubServer)
+    assert StubHandler.numRequests == 3
+
+    # errors that are not the service pushing back are not retried
+    with pytest.raises(rq.HTTPError):
+        limiter.call(get, f"{stubServer}/missing")
+    assert StubHandler.numRequests == 4
+
+
+def test_is_retryable():
+    assert isRetryable(Exception("Too many queued requests"))
+    assert not isRetryable(ValueError("invalid request"))
@@ -0,0 +1,71 @@
+import pytest
+import sys
+import os
+
+sys.path.append("../src")
+sys.path.append("../src/WeatherStation")
+
+from Shared.rawArchive import RawArchive, requestName
+from ClimateDataRequester import ClimateDataRequester, DAILY_SOURCE
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    """Serves a daily CSV file, counting the requests made"""
+
+    def __init__(self):
+        self.numRequests = 0
+
+    def get(self, url, timeout=None, **kwargs):
+        self.numRequests += 1
+        return FakeResponse(b"Climate ID,Year\n3010010,2004\n")
+
+
+def test_put_and_load(tmp_path):
+    archive = RawArchive(str(tmp_path))
+    digest = archive.put(b"a,b\n1,2\n", "climate-daily", "3010010", "2004-07", "url1")
+
+    # the same content is only stored once
+    assert archive.put(b"a,b\n1,2\n", "climate-daily", "3010011", "2004-07", "url2")
+    assert len(os.listdir(os.path.join(tmp_path, "objects", digest[:2]))) == 1
+
+    # a new archive reads the manifest back, the latest download of a name is kept
+    archive.put(b"a,b\n3,4\n", "climate-daily", "3010010", "2004-07", "url1")
+    archive = RawArchive(str(tmp_path), replay=True)
+    assert archive.load("climate-daily", "url1") == b"a,b\n3,4\n"
+    assert len(archive.entries("climate-daily", period="2004-07")) == 2
+
+    with pytest.raises(FileNotFoundError):
+        archive.load("climate-daily", "url3")
+
+
+def test_request_name():
+    request = {"variable": ["2m_temperature"], "day": "1"}
+
+    assert requestName("era5", request) == requestName("era5", dict(request))
+    assert requestName("era5", request) != requestName("era5", {"day": "2"})
+
+
+def test_requester_replay(tmp_path):
+    url = "AB/climate_daily_AB_3010010_2004-07_P1D.csv"
+
+    req = ClimateDataRequester(archive=RawArchive(str(tmp_path)))
+    req.session = FakeSession()
+    recorded = req.pull_data(url)
+    assert req.session.numRequests == 1
+
+    entry = req.archive.entries(DAILY_SOURCE)[0]
+    assert (entry["key"], entry["period"]) == ("3010010", "2004-07")
+
+    # replaying reads the file back from the archive without any request
+    req = ClimateDataRequester(archive=RawArchive(str(tmp_path), replay=True))
+    req.session = FakeSession()
+    assert req.pull_data(url).equals(recorded)
+    assert req.session.numRequests == 0
@@ -0,0 +1,81 @@
+import pytest
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append("../src")
+
+gpd = pytest.importorskip("geopandas")
+from shapely.geometry import box  # type: ignore
+from Shared.regionLookup import RegionLookup, readRegionLookup, regionsKey, NO_REGION
+from Shared.regionLookup import REGIONS_KEY_ATTR
+
+# a 2x3 grid where the cells of the first row fall in region (1, 4610) and the second row is outside of every region
+LOOKUP = RegionLookup(
+    np.array([49.0, 49.1]),
+    np.array([-100.2, -100.1, -100.0]),
+    np.array([1, 1, 1, NO_REGION, NO_REGION, NO_REGION]),
+    np.array([4610, 4610, 4610, NO_REGION, NO_REGION, NO_REGION]),
+)
+
+
+def test_label():
+    df = pd.DataFrame(
+        {
+            "lat": [49.1, 49.0, 49.0, 49.0],
+            "lon": [-100.0, -100.0, -100.2, -100.0],
+            "temperature": [1.0, 2.0, 3.0, 4.0],
+        }
+    )
+
+    df = LOOKUP.label(df)
+
+    assert df["temperature"].tolist() == [2.0, 3.0, 4.0]
+    assert df["district"].tolist() == [4610, 4610, 4610]
+    assert "lat" not in df.columns and "lon" not in df.columns
+
+
+def test_label_off_grid():
+    df = pd.DataFrame({"lat": [49.05], "lon": [-100.0]})
+
+    with pytest.raises(ValueError):
+        LOOKUP.label(df)
+
+
+def test_save(tmp_path):
+    path = str(tmp_path / "lookup.npz")
+    LOOKUP.save(path)
+
+    lookup = readRegionLookup(path)
+    assert np.array_equal(lookup.lons, LOOKUP.lons)
+    assert np.array_equal(lookup.districts, LOOKUP.districts)
+
+
+def test_zones():
+    # the grid in its stored order (descending latitudes)
+    cells, starts, crNums, districts = LOOKUP.zones(
+        np.array([49.1, 49.0]), np.array([-100.2, -100.1, -100.0])
+    )
+
+    # only the second row of the stored grid is within a region
+    assert sorted(cells.tolist()) == [3, 4, 5]
+    assert starts.tolist() == [0]
+    assert crNums.tolist() == [1] and districts.tolist() == [4610]
+
+
+def test_regions_key():
+    agRegions = gpd.GeoDataFrame(
+        {"cr_num": [1], "district": [4610], "geometry": [box(0, 0, 1, 1)]}
+    )
+    key = regionsKey(agRegions)
+
+    # the hash is kept with the regions and reused
+    assert agRegions.attrs[REGIONS_KEY_ATTR] == key
+    agRegions.attrs[REGIONS_KEY_ATTR] = "cached"
+    assert regionsKey(agRegions) == "cached"
+
+    # other geometries hash to another key
+    otherRegions = gpd.GeoDataFrame(
+        {"cr_num": [1], "district": [4610], "geometry": [box(0, 0, 2, 1)]}
+    )
+    assert regionsKey(otherRegions) != key
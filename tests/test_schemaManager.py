@@ -0,0 +1,40 @@
+import sys
+
+sys.path.append("../src")
+
+from Shared.schemaManager import SchemaManager, MAX_IDENTIFIER_LEN
+from Shared.DataService import createIndexReq, indexName
+
+schema = SchemaManager()
+
+
+def test_create_indexes_req():
+    query = schema.createIndexesReq("agg_day_copernicus_satellite_data")
+
+    assert query.count("CREATE INDEX IF NOT EXISTS") == 2
+    assert "USING btree (year, month, day, district)" in query
+    assert "USING brin (year, month, day)" in query
+
+    # index names are truncated to the maximum identifier length
+    for line in query.splitlines():
+        if "CREATE INDEX" in line:
+            assert len(line.split()[-1]) <= MAX_IDENTIFIER_LEN
+
+
+def test_create_unique_index_req():
+    query = " ".join(schema.createIndexesReq("agg_weather_combined").split())
+
+    assert query.startswith("CREATE UNIQUE INDEX IF NOT EXISTS")
+    assert "USING btree (year, month, day, district)" in query
+
+
+def test_create_indexes_req_undeclared_table():
+    assert schema.createIndexesReq("not_a_table") == ""
+
+
+def test_create_index_req_staging():
+    # replaceTable builds the indexes of the staging table before renaming them
+    query = " ".join(createIndexReq("soil_moisture_staging", "brin", ["date"]).split())
+
+    assert indexName("soil_moisture_staging", "brin", ["date"]) in query
+    assert "ON public.soil_moisture_staging USING brin (date)" in query
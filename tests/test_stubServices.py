@@ -0,0 +1,121 @@
+import pytest
+import sys
+import os
+import json
+
+sys.path.append("../src")
+sys.path.append("../src/WeatherStation")
+
+from Shared.rawArchive import RawArchive, requestName
+from Shared.rateLimiter import RateLimiter
+from Shared.stubServices import StubServer, StubClient
+from ClimateDataRequester import (
+    ClimateDataRequester,
+    DAILY_URL,
+    HOURLY_URL,
+    DAILY_SOURCE,
+    HOURLY_SOURCE,
+    LISTING_SOURCE,
+)
+
+DAILY_FILE = "climate_daily_AB_3010010_2022-07_P1D.csv"
+DAILY_CSV = "Climate ID,Date/Time,Mean Temp (°C)\n3010010,2022-07-01,21.5\n3010010,2022-07-02,19.0\n"
+HOURLY_CSV = "CLIMATE_IDENTIFIER,LOCAL_DATE,TEMP\n3010010,2022-01-01 00:00:00,-12.5\n"
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """An archive holding a daily listing, a daily file and an hourly query recorded from the real services"""
+    archive = RawArchive(str(tmp_path))
+    requester = ClimateDataRequester()
+
+    listing = f'<html><body><a href="{DAILY_FILE}">{DAILY_FILE}</a></body></html>'
+    archive.put(listing.encode(), LISTING_SOURCE, "AB", "", requester.listing_url("AB"))
+    archive.put(
+        DAILY_CSV.encode("ISO-8859-1"),
+        DAILY_SOURCE,
+        "3010010",
+        "2022-07",
+        requester.listing_url("AB") + DAILY_FILE,
+    )
+
+    url = requester.hourly_url("3010010", 2022, 2022)
+    count = json.dumps({"numberMatched": 1}).encode()
+    archive.put(count, HOURLY_SOURCE, "3010010", "2022-2022", requester.count_url(url))
+    archive.put(
+        HOURLY_CSV.encode(),
+        HOURLY_SOURCE,
+        "3010010",
+        "2022-2022",
+        requester.page_url(url, 0),
+    )
+
+    return archive
+
+
+@pytest.fixture
+def stubURLs(monkeypatch):
+    """Points the requesters to a stub server"""
+
+    def point(server):
+        monkeypatch.setenv(
+            "CLIMATE_DAILY_URL",
+            DAILY_URL.replace("https://dd.weather.gc.ca", server.url),
+        )
+        monkeypatch.setenv(
+            "CLIMATE_HOURLY_URL",
+            HOURLY_URL.replace("https://api.weather.gc.ca", server.url),
+        )
+
+    return point
+
+
+def test_serves_recorded_downloads(archive, stubURLs):
+    with StubServer(archive) as server:
+        stubURLs(server)
+        requester = ClimateDataRequester(RateLimiter(100, 4))
+
+        daily = requester.get_data("AB", "3010010", 2022, 2022)
+        hourly = requester.get_hourly_data("3010010", 2022, 2022)
+
+        assert daily["Mean Temp (°C)"].tolist() == [21.5, 19.0]
+        assert hourly["TEMP"].tolist() == [-12.5]
+        # listing, daily file, hourly count and page
+        assert server.getRequestCount() == (4, 0)
+
+        # downloads that were never recorded are missing
+        assert requester.get_data("AB", "3010010", 2021, 2021).empty
+        assert requester.pull_data("AB/climate_daily_AB_3010010_2021-07_P1D.csv").empty
+
+
+def test_injected_errors_are_retried(archive, stubURLs):
+    with StubServer(archive, errorRate=0.5, seed=1, retryAfter=0.01) as server:
+        stubURLs(server)
+        requester = ClimateDataRequester(RateLimiter(100, 4))
+
+        hourly = requester.get_hourly_data("3010010", 2022, 2022)
+
+        numRequests, numErrors = server.getRequestCount()
+        assert hourly["TEMP"].tolist() == [-12.5]
+        assert numErrors > 0
+        assert numRequests == 2 + numErrors
+
+
+def test_stub_client(tmp_path):
+    archive = RawArchive(str(tmp_path / "archive"))
+    request = {"variable": ["2m_temperature"], "year": "2022"}
+    archive.put(b"netcdf", "era5-land", "", "2022", requestName("dataset", request))
+
+    client = StubClient(archive, "era5-land", errorRate=0.5, seed=3)
+    limiter = RateLimiter(100, 1, baseBackoff=0.01)
+    target = str(tmp_path / "data.netcdf.zip")
+
+    # the first attempt fails as if the CDS queue was full and is retried
+    limiter.call(client.retrieve, "dataset", request, target)
+    assert client.getRequestCount() == (2, 1)
+    with open(target, "rb") as file:
+        assert file.read() == b"netcdf"
+
+    with pytest.raises(FileNotFoundError):
+        client.errorRate = 0
+        client.retrieve("dataset", {"year": "2021"}, target)
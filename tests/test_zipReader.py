@@ -0,0 +1,40 @@
+import pytest
+import zipfile
+import sys
+import io
+
+sys.path.append("../src")
+
+from Shared.zipReader import openMember
+
+CONTENT = bytes(range(256)) * 40
+
+
+@pytest.mark.parametrize("compression", [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_open_member(tmp_path, compression):
+    path = str(tmp_path / "data.netcdf.zip")
+    with zipfile.ZipFile(path, "w", compression) as archive:
+        archive.writestr("data.nc", CONTENT)
+
+    with openMember(path) as member:
+        assert member.read(3) == CONTENT[:3]
+
+        # readers seek back and forth through the file
+        member.seek(-10, io.SEEK_END)
+        assert member.read() == CONTENT[-10:]
+        member.seek(100)
+        assert member.read(50) == CONTENT[100:150]
+        assert member.tell() == 150
+
+
+def test_open_member_by_name(tmp_path):
+    path = str(tmp_path / "data.zip")
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("first.nc", b"first")
+        archive.writestr("second.nc", b"second")
+
+    with openMember(path, "second.nc") as member:
+        assert member.read() == b"second"
+
+    with pytest.raises(KeyError):
+        openMember(path, "third.nc")